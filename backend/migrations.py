@@ -0,0 +1,595 @@
+"""Versioned schema migrations.
+
+Each migration runs once, in its own transaction, and is recorded in
+`schema_migrations`. Pending migrations are applied on server startup
+(unless MIGRATE_ON_STARTUP is off) or by hand from backend/:
+
+    python migrations.py            # apply everything pending
+    python migrations.py --status   # list applied and pending versions
+
+Migrations are plain SQL and must never be edited once released; change
+the schema by appending a new one and updating models_orm.py to match.
+"""
+import argparse
+import os
+import dotenv
+from sqlalchemy import text
+from database import engine
+
+dotenv.load_dotenv()
+
+MIGRATE_ON_STARTUP = os.environ.get("MIGRATE_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+# Arbitrary key for pg_advisory_lock so concurrent servers migrate one at a time.
+LOCK_KEY = 4_172_031_961
+
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+
+@migration(1, "baseline schema")
+def _baseline(conn):
+    # Matches the tables that existed before migrations; a no-op on existing databases.
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS users (
+            id uuid PRIMARY KEY,
+            email varchar NOT NULL,
+            display_name varchar,
+            country varchar,
+            spotify_id varchar NOT NULL UNIQUE,
+            created_at timestamp
+        );
+        CREATE TABLE IF NOT EXISTS tracks (
+            id varchar PRIMARY KEY,
+            name varchar NOT NULL,
+            artist varchar NOT NULL,
+            album varchar,
+            uri varchar NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS audio_features (
+            track_id varchar PRIMARY KEY REFERENCES tracks (id),
+            danceability double precision,
+            energy double precision,
+            tempo double precision,
+            valence double precision,
+            acousticness double precision,
+            instrumentalness double precision
+        );
+        CREATE TABLE IF NOT EXISTS user_top_tracks (
+            user_id uuid REFERENCES users (id),
+            track_id varchar REFERENCES tracks (id),
+            rank integer,
+            PRIMARY KEY (user_id, track_id)
+        );
+        CREATE TABLE IF NOT EXISTS playlists (
+            id varchar PRIMARY KEY,
+            user_id uuid NOT NULL REFERENCES users (id),
+            name varchar NOT NULL,
+            is_public boolean,
+            snapshot_id varchar
+        );
+        CREATE TABLE IF NOT EXISTS playlist_tracks (
+            playlist_id varchar REFERENCES playlists (id),
+            track_id varchar REFERENCES tracks (id),
+            added_at timestamp,
+            PRIMARY KEY (playlist_id, track_id)
+        );
+        CREATE TABLE IF NOT EXISTS user_liked_tracks (
+            user_id uuid REFERENCES users (id),
+            track_id varchar REFERENCES tracks (id),
+            liked_at timestamp,
+            PRIMARY KEY (user_id, track_id)
+        );
+        CREATE TABLE IF NOT EXISTS artists (
+            id varchar PRIMARY KEY,
+            name varchar,
+            genres varchar[] NOT NULL,
+            updated_at timestamptz NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS jobs (
+            id uuid PRIMARY KEY,
+            kind varchar NOT NULL,
+            status varchar NOT NULL,
+            user_id uuid,
+            params jsonb NOT NULL,
+            done integer NOT NULL,
+            total integer,
+            resumed_from integer NOT NULL,
+            checkpoint jsonb,
+            result jsonb,
+            error text,
+            created_at timestamptz NOT NULL,
+            started_at timestamptz,
+            updated_at timestamptz NOT NULL,
+            finished_at timestamptz
+        );
+        CREATE TABLE IF NOT EXISTS sync_watermarks (
+            user_id uuid REFERENCES users (id),
+            stream varchar,
+            watermark timestamptz,
+            watermark_key varchar,
+            synced_at timestamptz NOT NULL,
+            PRIMARY KEY (user_id, stream)
+        );
+    """))
+
+
+@migration(2, "track metadata columns and user_stream_history")
+def _track_metadata(conn):
+    conn.execute(text("""
+        ALTER TABLE tracks
+            ADD COLUMN IF NOT EXISTS popularity integer,
+            ADD COLUMN IF NOT EXISTS release_date varchar,
+            ADD COLUMN IF NOT EXISTS genres text;
+        CREATE TABLE IF NOT EXISTS user_stream_history (
+            user_id uuid REFERENCES users (id),
+            track_id varchar REFERENCES tracks (id),
+            played_at timestamp,
+            PRIMARY KEY (user_id, track_id, played_at)
+        );
+    """))
+
+
+@migration(3, "indexes for per-user reads and the enrichment scan")
+def _hot_path_indexes(conn):
+    # The liked/history primary keys lead with user_id too, but these also
+    # serve newest-first reads and are much narrower.
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_user_liked_tracks_user_id
+            ON user_liked_tracks (user_id, liked_at DESC);
+        CREATE INDEX IF NOT EXISTS ix_user_stream_history_user_id
+            ON user_stream_history (user_id, played_at DESC);
+        CREATE INDEX IF NOT EXISTS ix_playlists_user_id
+            ON playlists (user_id);
+        CREATE INDEX IF NOT EXISTS ix_tracks_missing_metadata
+            ON tracks (id)
+            WHERE popularity IS NULL OR release_date IS NULL OR genres IS NULL;
+    """))
+
+
+@migration(4, "typed genres and release year on tracks")
+def _typed_track_metadata(conn):
+    # genre_ids/release_year are derived from the genres JSON and release_date
+    # text by a trigger, so every writer keeps them in sync without knowing
+    # about genre ids.
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS genres (
+            id serial PRIMARY KEY,
+            name varchar NOT NULL UNIQUE
+        );
+        ALTER TABLE tracks
+            ADD COLUMN IF NOT EXISTS genre_ids integer[],
+            ADD COLUMN IF NOT EXISTS release_year smallint;
+
+        CREATE OR REPLACE FUNCTION tracks_typed_metadata() RETURNS trigger AS $$
+        BEGIN
+            NEW.release_year := substring(NEW.release_date FROM '^[0-9]{4}')::smallint;
+            IF NEW.genres IS NULL THEN
+                NEW.genre_ids := NULL;
+            ELSE
+                INSERT INTO genres (name)
+                SELECT DISTINCT name FROM json_array_elements_text(NEW.genres::json) AS name
+                ON CONFLICT (name) DO NOTHING;
+                NEW.genre_ids := ARRAY(
+                    SELECT g.id
+                    FROM json_array_elements_text(NEW.genres::json) WITH ORDINALITY AS e (name, ord)
+                    JOIN genres g ON g.name = e.name
+                    ORDER BY e.ord
+                );
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS tracks_typed_metadata ON tracks;
+        CREATE TRIGGER tracks_typed_metadata
+            BEFORE INSERT OR UPDATE OF release_date, genres ON tracks
+            FOR EACH ROW EXECUTE FUNCTION tracks_typed_metadata();
+    """))
+
+    # Backfill set-wise rather than through the per-row trigger.
+    conn.execute(text("""
+        INSERT INTO genres (name)
+        SELECT DISTINCT json_array_elements_text(genres::json) FROM tracks WHERE genres IS NOT NULL
+        ON CONFLICT (name) DO NOTHING
+    """))
+    conn.execute(text("""
+        ALTER TABLE tracks DISABLE TRIGGER tracks_typed_metadata;
+        UPDATE tracks t
+        SET release_year = substring(t.release_date FROM '^[0-9]{4}')::smallint,
+            genre_ids = CASE WHEN t.genres IS NULL THEN NULL ELSE ARRAY(
+                SELECT g.id
+                FROM json_array_elements_text(t.genres::json) WITH ORDINALITY AS e (name, ord)
+                JOIN genres g ON g.name = e.name
+                ORDER BY e.ord
+            ) END
+        WHERE t.genres IS NOT NULL OR t.release_date IS NOT NULL;
+        ALTER TABLE tracks ENABLE TRIGGER tracks_typed_metadata;
+    """))
+
+
+@migration(5, "per-user stats rollups")
+def _stats_rollups(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS user_stat_tracks (
+            user_id uuid REFERENCES users (id),
+            track_id varchar REFERENCES tracks (id),
+            artist varchar,
+            release_year smallint,
+            popularity integer,
+            genre_ids integer[],
+            PRIMARY KEY (user_id, track_id)
+        );
+        CREATE INDEX IF NOT EXISTS ix_user_stat_tracks_track_id ON user_stat_tracks (track_id);
+
+        CREATE TABLE IF NOT EXISTS user_genre_counts (
+            user_id uuid REFERENCES users (id),
+            genre_id integer REFERENCES genres (id),
+            tracks integer NOT NULL,
+            summary_tracks integer NOT NULL,
+            PRIMARY KEY (user_id, genre_id)
+        );
+        CREATE INDEX IF NOT EXISTS ix_user_genre_counts_top ON user_genre_counts (user_id, tracks DESC);
+
+        CREATE TABLE IF NOT EXISTS user_artist_counts (
+            user_id uuid REFERENCES users (id),
+            artist varchar,
+            tracks integer NOT NULL,
+            PRIMARY KEY (user_id, artist)
+        );
+        CREATE INDEX IF NOT EXISTS ix_user_artist_counts_top ON user_artist_counts (user_id, tracks DESC);
+
+        CREATE TABLE IF NOT EXISTS user_year_counts (
+            user_id uuid REFERENCES users (id),
+            release_year smallint,
+            tracks integer NOT NULL,
+            popularity_sum bigint NOT NULL,
+            PRIMARY KEY (user_id, release_year)
+        );
+    """))
+
+    conn.execute(text("""
+        INSERT INTO user_stat_tracks (user_id, track_id, artist, release_year, popularity, genre_ids)
+        SELECT s.user_id, t.id, t.artist, t.release_year, t.popularity, t.genre_ids
+        FROM (
+            SELECT user_id, track_id FROM user_liked_tracks
+            UNION
+            SELECT user_id, track_id FROM user_stream_history
+            UNION
+            SELECT user_id, track_id FROM user_top_tracks
+        ) s
+        JOIN tracks t ON t.id = s.track_id
+        ON CONFLICT DO NOTHING;
+
+        INSERT INTO user_genre_counts (user_id, genre_id, tracks, summary_tracks)
+        SELECT user_id, genre_id, count(*),
+               count(*) FILTER (WHERE popularity IS NOT NULL AND release_year IS NOT NULL)
+        FROM user_stat_tracks, unnest(genre_ids) AS genre_id
+        GROUP BY user_id, genre_id
+        ON CONFLICT DO NOTHING;
+
+        INSERT INTO user_artist_counts (user_id, artist, tracks)
+        SELECT user_id, artist, count(*)
+        FROM user_stat_tracks
+        WHERE artist IS NOT NULL
+        GROUP BY user_id, artist
+        ON CONFLICT DO NOTHING;
+
+        INSERT INTO user_year_counts (user_id, release_year, tracks, popularity_sum)
+        SELECT user_id, release_year, count(*), sum(popularity)
+        FROM user_stat_tracks
+        WHERE popularity IS NOT NULL AND release_year IS NOT NULL
+        GROUP BY user_id, release_year
+        ON CONFLICT DO NOTHING;
+    """))
+
+
+@migration(6, "per-user data version")
+def _user_data_version(conn):
+    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS data_version bigint NOT NULL DEFAULT 0"))
+
+
+@migration(7, "feature change sequence on tracks")
+def _track_feature_seq(conn):
+    # Every insert or feature-column update takes a fresh sequence value, so
+    # the recommender's feature matrix can pick up just the changed tracks.
+    conn.execute(text("""
+        CREATE SEQUENCE IF NOT EXISTS track_feature_seq;
+        ALTER TABLE tracks ADD COLUMN IF NOT EXISTS feature_seq bigint;
+
+        CREATE OR REPLACE FUNCTION tracks_feature_seq() RETURNS trigger AS $$
+        BEGIN
+            NEW.feature_seq := nextval('track_feature_seq');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+
+        UPDATE tracks SET feature_seq = nextval('track_feature_seq') WHERE feature_seq IS NULL;
+        CREATE INDEX IF NOT EXISTS ix_tracks_feature_seq ON tracks (feature_seq);
+
+        DROP TRIGGER IF EXISTS tracks_feature_seq ON tracks;
+        CREATE TRIGGER tracks_feature_seq
+            BEFORE INSERT OR UPDATE OF popularity, release_date, genres ON tracks
+            FOR EACH ROW EXECUTE FUNCTION tracks_feature_seq();
+    """))
+
+
+@migration(8, "stop burning genre ids on known genres")
+def _genre_ids_without_gaps(conn):
+    # INSERT ... ON CONFLICT DO NOTHING still draws a serial value per row, so
+    # every enriched track used up ids. Keep ids dense now that they index
+    # feature-matrix columns.
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION tracks_typed_metadata() RETURNS trigger AS $$
+        BEGIN
+            NEW.release_year := substring(NEW.release_date FROM '^[0-9]{4}')::smallint;
+            IF NEW.genres IS NULL THEN
+                NEW.genre_ids := NULL;
+            ELSE
+                INSERT INTO genres (name)
+                SELECT DISTINCT e.name FROM json_array_elements_text(NEW.genres::json) AS e (name)
+                WHERE NOT EXISTS (SELECT 1 FROM genres g WHERE g.name = e.name)
+                ON CONFLICT (name) DO NOTHING;
+                NEW.genre_ids := ARRAY(
+                    SELECT g.id
+                    FROM json_array_elements_text(NEW.genres::json) WITH ORDINALITY AS e (name, ord)
+                    JOIN genres g ON g.name = e.name
+                    ORDER BY e.ord
+                );
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+    """))
+
+
+@migration(9, "precomputed recommendations and per-user import version")
+def _user_recommendations(conn):
+    # Any write to a user's liked, top, recently played or playlist tracks
+    # bumps users.import_version, so precomputed recommendations can tell
+    # whether they still reflect the user's library.
+    conn.execute(text("""
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS import_version bigint NOT NULL DEFAULT 0;
+
+        CREATE TABLE IF NOT EXISTS user_recommendations (
+            user_id uuid REFERENCES users (id),
+            rank smallint,
+            track_id varchar NOT NULL REFERENCES tracks (id),
+            score real NOT NULL,
+            import_version bigint NOT NULL,
+            computed_at timestamptz NOT NULL DEFAULT now(),
+            PRIMARY KEY (user_id, rank)
+        );
+
+        CREATE OR REPLACE FUNCTION users_bump_import_version() RETURNS trigger AS $$
+        BEGIN
+            IF TG_TABLE_NAME = 'playlist_tracks' THEN
+                UPDATE users SET import_version = import_version + 1
+                WHERE id IN (SELECT p.user_id FROM changed c JOIN playlists p ON p.id = c.playlist_id);
+            ELSE
+                UPDATE users SET import_version = import_version + 1
+                WHERE id IN (SELECT user_id FROM changed);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+    """))
+    for table in ("user_liked_tracks", "user_top_tracks", "user_stream_history", "playlist_tracks"):
+        conn.execute(text(f"""
+            DROP TRIGGER IF EXISTS {table}_inserted ON {table};
+            CREATE TRIGGER {table}_inserted
+                AFTER INSERT ON {table} REFERENCING NEW TABLE AS changed
+                FOR EACH STATEMENT EXECUTE FUNCTION users_bump_import_version();
+            DROP TRIGGER IF EXISTS {table}_deleted ON {table};
+            CREATE TRIGGER {table}_deleted
+                AFTER DELETE ON {table} REFERENCING OLD TABLE AS changed
+                FOR EACH STATEMENT EXECUTE FUNCTION users_bump_import_version();
+        """))
+
+
+@migration(10, "audio features bump the track feature sequence")
+def _audio_feature_seq(conn):
+    # Audio features are part of a track's recommender vector, so storing
+    # them marks the track changed for the feature matrix.
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION audio_features_changed() RETURNS trigger AS $$
+        BEGIN
+            UPDATE tracks SET feature_seq = nextval('track_feature_seq')
+            WHERE id IN (SELECT track_id FROM changed);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS audio_features_inserted ON audio_features;
+        CREATE TRIGGER audio_features_inserted
+            AFTER INSERT ON audio_features REFERENCING NEW TABLE AS changed
+            FOR EACH STATEMENT EXECUTE FUNCTION audio_features_changed();
+        DROP TRIGGER IF EXISTS audio_features_updated ON audio_features;
+        CREATE TRIGGER audio_features_updated
+            AFTER UPDATE ON audio_features REFERENCING NEW TABLE AS changed
+            FOR EACH STATEMENT EXECUTE FUNCTION audio_features_changed();
+    """))
+
+
+@migration(11, "basket change log for the co-occurrence recommender")
+def _basket_changes(conn):
+    # Every write to a playlist's tracks or a user's liked tracks logs the
+    # basket it touched, so the co-occurrence matrix only re-reads those.
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS basket_changes (
+            seq bigserial PRIMARY KEY,
+            basket varchar NOT NULL
+        );
+
+        CREATE OR REPLACE FUNCTION basket_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_TABLE_NAME = 'playlist_tracks' THEN
+                INSERT INTO basket_changes (basket) SELECT DISTINCT 'playlist:' || playlist_id FROM changed;
+            ELSE
+                INSERT INTO basket_changes (basket) SELECT DISTINCT 'liked:' || user_id FROM changed;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+    """))
+    for table in ("playlist_tracks", "user_liked_tracks"):
+        conn.execute(text(f"""
+            DROP TRIGGER IF EXISTS {table}_basket_inserted ON {table};
+            CREATE TRIGGER {table}_basket_inserted
+                AFTER INSERT ON {table} REFERENCING NEW TABLE AS changed
+                FOR EACH STATEMENT EXECUTE FUNCTION basket_changed();
+            DROP TRIGGER IF EXISTS {table}_basket_deleted ON {table};
+            CREATE TRIGGER {table}_basket_deleted
+                AFTER DELETE ON {table} REFERENCING OLD TABLE AS changed
+                FOR EACH STATEMENT EXECUTE FUNCTION basket_changed();
+        """))
+
+
+@migration(12, "albums seeded from new releases")
+def _albums(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS albums (
+            id varchar PRIMARY KEY,
+            name varchar,
+            release_date varchar,
+            total_tracks integer,
+            seeded_at timestamptz NOT NULL DEFAULT now()
+        )
+    """))
+
+
+@migration(13, "track feature change log")
+def _track_feature_changes(conn):
+    # Tracks whose feature_seq moves are logged here for the feature matrix to
+    # drain, so a change is picked up once its transaction commits however
+    # far its sequence value lags behind.
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS track_feature_changes (
+            track_id varchar NOT NULL
+        );
+
+        CREATE OR REPLACE FUNCTION track_features_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO track_feature_changes (track_id) SELECT id FROM new_rows;
+            ELSE
+                INSERT INTO track_feature_changes (track_id)
+                SELECT n.id FROM new_rows n JOIN old_rows o ON o.id = n.id
+                WHERE n.feature_seq IS DISTINCT FROM o.feature_seq;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS tracks_feature_inserted ON tracks;
+        CREATE TRIGGER tracks_feature_inserted
+            AFTER INSERT ON tracks REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION track_features_changed();
+        DROP TRIGGER IF EXISTS tracks_feature_updated ON tracks;
+        CREATE TRIGGER tracks_feature_updated
+            AFTER UPDATE ON tracks REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION track_features_changed();
+    """))
+
+
+@migration(14, "one queued or running catalog-wide job per kind")
+def _catalog_job_unique(conn):
+    # Jobs without a user cover the whole catalog; a second one of the same
+    # kind would only repeat the first one's work. Older duplicates left
+    # behind before this index are cancelled (and stay resumable).
+    conn.execute(text("""
+        UPDATE jobs SET status = 'cancelled', updated_at = now(), finished_at = now()
+        WHERE user_id IS NULL AND status IN ('queued', 'running')
+          AND id NOT IN (
+              SELECT DISTINCT ON (kind) id FROM jobs
+              WHERE user_id IS NULL AND status IN ('queued', 'running')
+              ORDER BY kind, created_at
+          );
+        CREATE UNIQUE INDEX IF NOT EXISTS jobs_catalog_active
+            ON jobs (kind) WHERE user_id IS NULL AND status IN ('queued', 'running');
+    """))
+
+
+@migration(15, "audio features retry_after for failed fetches")
+def _audio_feature_retry(conn):
+    # A row with retry_after set records a failed /audio-features request;
+    # its track isn't asked for again until then.
+    conn.execute(text("""
+        ALTER TABLE audio_features ADD COLUMN IF NOT EXISTS retry_after timestamptz;
+    """))
+
+
+@migration(16, "surrogate key for the track feature change log")
+def _track_feature_changes_key(conn):
+    # The log holds one row per change, so a track can appear many times.
+    conn.execute(text("""
+        ALTER TABLE track_feature_changes ADD COLUMN IF NOT EXISTS seq bigserial PRIMARY KEY;
+    """))
+
+
+def _ensure_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version integer PRIMARY KEY,
+            description varchar NOT NULL,
+            applied_at timestamptz NOT NULL DEFAULT now()
+        )
+    """))
+
+
+def applied_versions(conn) -> set:
+    _ensure_table(conn)
+    return set(conn.execute(text("SELECT version FROM schema_migrations")).scalars().all())
+
+
+def migrate(bind=engine) -> list:
+    """Apply pending migrations in version order; returns the versions applied."""
+    applied = []
+    with bind.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+        conn.commit()
+        try:
+            with conn.begin():
+                done = applied_versions(conn)
+            for version, description, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+                if version in done:
+                    continue
+                with conn.begin():
+                    fn(conn)
+                    conn.execute(text("""
+                        INSERT INTO schema_migrations (version, description) VALUES (:version, :description)
+                    """), {"version": version, "description": description})
+                print(f"Applied migration {version}: {description}")
+                applied.append(version)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+            conn.commit()
+    return applied
+
+
+def status(bind=engine) -> list:
+    with bind.begin() as conn:
+        done = applied_versions(conn)
+    return [
+        {"version": version, "description": description, "applied": version in done}
+        for version, description, _ in sorted(MIGRATIONS, key=lambda m: m[0])
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply database schema migrations.")
+    parser.add_argument("--status", action="store_true", help="list migrations without applying them")
+    args = parser.parse_args()
+
+    if args.status:
+        for m in status():
+            print(f"{m['version']:>4}  {'applied' if m['applied'] else 'pending':<8} {m['description']}")
+    else:
+        applied = migrate()
+        print(f"Applied {len(applied)} migration(s)." if applied else "Schema is up to date.")
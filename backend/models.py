@@ -31,6 +31,13 @@ class AudioFeatureBase(BaseModel):
     instrumentalness: float
 
 
+class AudioFeatureTarget(BaseModel):
+    """Bounds and/or an ideal value for one audio feature when building a playlist."""
+    min: Optional[float] = None
+    max: Optional[float] = None
+    target: Optional[float] = None
+
+
 class UserTopTrack(BaseModel):
     user_id: UUID
     track_id: str
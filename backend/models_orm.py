@@ -1,6 +1,6 @@
 import sqlalchemy
-from sqlalchemy import Column, String, Boolean, DateTime, Float, ForeignKey
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, Boolean, DateTime, Float, ForeignKey, Index, Integer, Text
+from sqlalchemy.dialects.postgresql import UUID, ARRAY, JSONB
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -14,6 +14,9 @@ class User(Base):
     country = Column(String)
     spotify_id = Column(String, nullable=False, unique=True)
     created_at = Column(DateTime)
+    data_version = Column(sqlalchemy.BigInteger, nullable=False, default=0)  # bumped when stats data changes
+    # Bumped by triggers (migration 9) whenever the user's liked, top, recent or playlist tracks change.
+    import_version = Column(sqlalchemy.BigInteger, nullable=False, default=0)
 
 
 class Track(Base):
@@ -23,6 +26,24 @@ class Track(Base):
     artist = Column(String, nullable=False)
     album = Column(String)
     uri = Column(String, nullable=False)
+    popularity = Column(Integer)
+    release_date = Column(String)  # as Spotify reports it: YYYY, YYYY-MM or YYYY-MM-DD
+    genres = Column(Text)  # JSON list of the primary artist's genres
+    # Typed copies of release_date/genres, maintained by a trigger (migration 4).
+    genre_ids = Column(ARRAY(Integer))  # genres.id, in the order of `genres`
+    release_year = Column(sqlalchemy.SmallInteger)
+    feature_seq = Column(sqlalchemy.BigInteger, index=True)  # track_feature_seq value at the last feature change
+
+    __table_args__ = (
+        Index("ix_tracks_missing_metadata", "id",
+              postgresql_where=sqlalchemy.text("popularity IS NULL OR release_date IS NULL OR genres IS NULL")),
+    )
+
+
+class Genre(Base):
+    __tablename__ = "genres"
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, unique=True)
 
 
 class AudioFeature(Base):
@@ -34,6 +55,7 @@ class AudioFeature(Base):
     valence = Column(Float)
     acousticness = Column(Float)
     instrumentalness = Column(Float)
+    retry_after = Column(DateTime(timezone=True))  # set while a failed fetch waits to be retried
 
 
 class UserTopTrack(Base):
@@ -51,6 +73,8 @@ class Playlist(Base):
     is_public = Column(Boolean)
     snapshot_id = Column(String)
 
+    __table_args__ = (Index("ix_playlists_user_id", "user_id"),)
+
 
 class PlaylistTrack(Base):
     __tablename__ = "playlist_tracks"
@@ -64,3 +88,129 @@ class UserLikedTrack(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
     track_id = Column(String, ForeignKey("tracks.id"), primary_key=True)
     liked_at = Column(DateTime)
+
+    __table_args__ = (Index("ix_user_liked_tracks_user_id", "user_id", liked_at.desc()),)
+
+
+class UserStreamHistory(Base):
+    __tablename__ = "user_stream_history"
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    track_id = Column(String, ForeignKey("tracks.id"), primary_key=True)
+    played_at = Column(DateTime, primary_key=True)
+
+    __table_args__ = (Index("ix_user_stream_history_user_id", "user_id", played_at.desc()),)
+
+
+class Artist(Base):
+    __tablename__ = "artists"
+    id = Column(String, primary_key=True)  # Spotify artist ID
+    name = Column(String)
+    genres = Column(ARRAY(String), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    kind = Column(String, nullable=False)
+    status = Column(String, nullable=False)  # queued, running, succeeded, failed, cancelled
+    user_id = Column(UUID(as_uuid=True))
+    params = Column(JSONB, nullable=False)
+    done = Column(Integer, nullable=False, default=0)
+    total = Column(Integer)
+    resumed_from = Column(Integer, nullable=False, default=0)  # `done` when the current run started
+    checkpoint = Column(JSONB)
+    result = Column(JSONB)
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    started_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+    finished_at = Column(DateTime(timezone=True))
+
+    # At most one queued or running catalog-wide (user-less) job per kind.
+    __table_args__ = (
+        Index("jobs_catalog_active", "kind", unique=True,
+              postgresql_where=sqlalchemy.text("user_id IS NULL AND status IN ('queued', 'running')")),
+    )
+
+
+class SyncWatermark(Base):
+    __tablename__ = "sync_watermarks"
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    stream = Column(String, primary_key=True)  # e.g. "liked_tracks"
+    watermark = Column(DateTime(timezone=True))  # newest Spotify timestamp ingested
+    watermark_key = Column(String)  # track ID at the watermark, to break timestamp ties
+    synced_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class UserStatTrack(Base):
+    """A track counted in a user's stats rollups, with the metadata it was counted with."""
+    __tablename__ = "user_stat_tracks"
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    track_id = Column(String, ForeignKey("tracks.id"), primary_key=True, index=True)
+    artist = Column(String)
+    release_year = Column(sqlalchemy.SmallInteger)
+    popularity = Column(Integer)
+    genre_ids = Column(ARRAY(Integer))
+
+
+class UserGenreCount(Base):
+    __tablename__ = "user_genre_counts"
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    genre_id = Column(Integer, ForeignKey("genres.id"), primary_key=True)
+    tracks = Column(Integer, nullable=False)
+    summary_tracks = Column(Integer, nullable=False)  # only tracks with popularity and release year
+
+    __table_args__ = (Index("ix_user_genre_counts_top", "user_id", tracks.desc()),)
+
+
+class UserArtistCount(Base):
+    __tablename__ = "user_artist_counts"
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    artist = Column(String, primary_key=True)
+    tracks = Column(Integer, nullable=False)
+
+    __table_args__ = (Index("ix_user_artist_counts_top", "user_id", tracks.desc()),)
+
+
+class UserYearCount(Base):
+    __tablename__ = "user_year_counts"
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    release_year = Column(sqlalchemy.SmallInteger, primary_key=True)
+    tracks = Column(Integer, nullable=False)
+    popularity_sum = Column(sqlalchemy.BigInteger, nullable=False)
+
+
+class UserRecommendation(Base):
+    """One entry of a user's precomputed top-N recommendations."""
+    __tablename__ = "user_recommendations"
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    rank = Column(sqlalchemy.SmallInteger, primary_key=True)  # 1 = best
+    track_id = Column(String, ForeignKey("tracks.id"), nullable=False)
+    score = Column(sqlalchemy.REAL, nullable=False)
+    import_version = Column(sqlalchemy.BigInteger, nullable=False)  # users.import_version the list was computed from
+    computed_at = Column(DateTime(timezone=True), nullable=False, server_default=sqlalchemy.func.now())
+
+
+class TrackFeatureChange(Base):
+    """A track whose features changed; drained by the feature matrix refresh."""
+    __tablename__ = "track_feature_changes"
+    seq = Column(sqlalchemy.BigInteger, primary_key=True, autoincrement=True)
+    track_id = Column(String, nullable=False)  # logged once per change, so it repeats
+
+
+class BasketChange(Base):
+    """A playlist's or user's liked tracks changed; read and cleared by the co-occurrence matrix."""
+    __tablename__ = "basket_changes"
+    seq = Column(sqlalchemy.BigInteger, primary_key=True, autoincrement=True)
+    basket = Column(String, nullable=False)  # "playlist:<playlists.id>" or "liked:<users.id>"
+
+
+class Album(Base):
+    """An album whose tracks have been seeded; seeding skips albums already here."""
+    __tablename__ = "albums"
+    id = Column(String, primary_key=True)  # Spotify album ID
+    name = Column(String)
+    release_date = Column(String)
+    total_tracks = Column(Integer)
+    seeded_at = Column(DateTime(timezone=True), nullable=False, server_default=sqlalchemy.func.now())
@@ -1,5 +1,9 @@
 from fastapi import APIRouter, Body, HTTPException
 from database import engine
+from services.spotify_client import client as spotify_client
+from services.rate_limit import scheduler
+from services import artist_genres, cooccurrence, dashboard, feature_matrix, identity, library_sync
+from services.recently_played_poller import poller
 import sqlalchemy
 
 router = APIRouter(prefix="/admin", tags=["admin"])
@@ -8,13 +12,24 @@ router = APIRouter(prefix="/admin", tags=["admin"])
 def reset_all_data():
     try:
         with engine.begin() as conn:
+            conn.execute(sqlalchemy.text("DELETE FROM user_genre_counts"))
+            conn.execute(sqlalchemy.text("DELETE FROM user_artist_counts"))
+            conn.execute(sqlalchemy.text("DELETE FROM user_year_counts"))
+            conn.execute(sqlalchemy.text("DELETE FROM user_recommendations"))
+            conn.execute(sqlalchemy.text("DELETE FROM user_stat_tracks"))
+            conn.execute(sqlalchemy.text("DELETE FROM sync_watermarks"))
             conn.execute(sqlalchemy.text("DELETE FROM playlist_tracks"))
             conn.execute(sqlalchemy.text("DELETE FROM playlists"))
             conn.execute(sqlalchemy.text("DELETE FROM user_stream_history"))
             conn.execute(sqlalchemy.text("DELETE FROM user_liked_tracks"))
             conn.execute(sqlalchemy.text("DELETE FROM user_top_tracks"))
+            conn.execute(sqlalchemy.text("DELETE FROM audio_features"))
             conn.execute(sqlalchemy.text("DELETE FROM tracks"))
+            conn.execute(sqlalchemy.text("DELETE FROM albums"))
             conn.execute(sqlalchemy.text("DELETE FROM users"))
+        dashboard.clear_cache()
+        feature_matrix.refresh(full=True)
+        cooccurrence.refresh(full=True)
 
         return {"message": "All data wiped successfully."}
     except Exception as e:
@@ -25,3 +40,22 @@ def reset_all_data():
 def ping():
     return {"status": "Pong! Backend is alive."}
 
+@router.get("/metrics")
+def metrics():
+    return {
+        "spotify_http": spotify_client.stats(),
+        "spotify_scheduler": scheduler.stats(),
+        "artist_genre_cache": artist_genres.cache_stats(),
+        "identity_cache": identity.cache_stats(),
+        "dashboard_cache": dashboard.cache_stats(),
+        "recently_played_poller": poller.stats(),
+    }
+
+
+@router.get("/recently-played-lag")
+def recently_played_lag():
+    try:
+        return {"users": library_sync.sync_lag()}
+    except Exception as e:
+        print("Error reading recently-played lag:", str(e))
+        raise HTTPException(status_code=500, detail="Failed to read recently-played lag.")
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Body, HTTPException
+from uuid import UUID
+from services import jobs
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+@router.get("/{job_id}")
+def get_job(job_id: UUID):
+    job = jobs.get(str(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/{job_id}/cancel")
+def cancel_job(job_id: UUID):
+    if not jobs.cancel(str(job_id)):
+        raise HTTPException(status_code=409, detail="Job is not running in this server or already finished")
+    return {"message": "Cancellation requested", "job_id": job_id}
+
+
+@router.post("/{job_id}/resume")
+def resume_job(job_id: UUID, access_token: str = Body(..., embed=True)):
+    if not jobs.resume(str(job_id), access_token):
+        raise HTTPException(status_code=409, detail="Only failed, cancelled or interrupted jobs can be resumed, "
+                                                    "and not while another job of the same kind is queued or running")
+    return {"message": "Job resumed", "job_id": job_id}
@@ -1,18 +1,21 @@
 from fastapi import APIRouter, HTTPException, Body, Request
 from database import engine
 import sqlalchemy
-import uuid
 import services.spotify_api as spotify
+from services.identity import resolve_identity
+from services import audio_index, bulk_write, cooccurrence, playlist_import, jobs
+from services.feature_matrix import AUDIO_COLUMNS
+from models import AudioFeatureTarget
 from sqlalchemy import text
 from datetime import datetime
 
 router = APIRouter(prefix="/playlists", tags=["playlists"])
 
+
 @router.post("/import")
 def import_user_playlists(access_token: str = Body(..., embed=True)):
     try:
-        user = spotify.get_user_profile(access_token)
-        user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, user["id"]))
+        user_uuid = resolve_identity(access_token).user_uuid
         playlists = spotify.get_user_playlists(access_token)
 
         with engine.begin() as conn:
@@ -41,112 +44,85 @@ def import_user_playlists(access_token: str = Body(..., embed=True)):
 @router.post("/tracks")
 def import_playlist_tracks(access_token: str = Body(..., embed=True)):
     try:
-        user = spotify.get_user_profile(access_token)
-        user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, user["id"]))
+        user_uuid = resolve_identity(access_token).user_uuid
+        job_id = jobs.submit("import_playlist_tracks", access_token, {"user_id": user_uuid}, user_id=user_uuid)
+        return {"message": "Playlist track import started", "job_id": job_id}
 
-        with engine.begin() as conn:
-            playlist_ids = conn.execute(sqlalchemy.text("""
-                SELECT id FROM playlists WHERE user_id = :uid
-            """), {"uid": user_uuid}).scalars().all()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        for playlist_id in playlist_ids:
-            tracks = spotify.get_tracks_in_playlist(access_token, playlist_id)
 
-            with engine.begin() as conn:
-                for item in tracks:
-                    track = item.get("track")
-                    if not track or not track.get("id"):
-                        continue
-
-                    conn.execute(sqlalchemy.text("""
-                        INSERT INTO tracks (id, name, artist, album, uri)
-                        VALUES (:id, :name, :artist, :album, :uri)
-                        ON CONFLICT (id) DO NOTHING
-                    """), {
-                        "id": track["id"],
-                        "name": track["name"],
-                        "artist": track["artists"][0]["name"],
-                        "album": track["album"]["name"],
-                        "uri": track["uri"]
-                    })
-
-                    conn.execute(sqlalchemy.text("""
-                        INSERT INTO playlist_tracks (playlist_id, track_id, added_at)
-                        VALUES (:playlist_id, :track_id, :added_at)
-                        ON CONFLICT DO NOTHING
-                    """), {
-                        "playlist_id": playlist_id,
-                        "track_id": track["id"],
-                        "added_at": item.get("added_at")
-                    })
-
-        return {"message": "All playlist tracks imported successfully"}
+@jobs.handler("import_playlist_tracks")
+def run_playlist_tracks_import(job: jobs.JobContext) -> dict:
+    with engine.begin() as conn:
+        playlist_ids = conn.execute(sqlalchemy.text("""
+            SELECT id FROM playlists WHERE user_id = :uid
+        """), {"uid": job.params["user_id"]}).scalars().all()
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    done_ids = set((job.checkpoint or {}).get("done", [])) & set(playlist_ids)
+
+    def on_playlist_done(playlist_id):
+        done_ids.add(playlist_id)
+        job.progress(len(done_ids), total=len(playlist_ids), checkpoint={"done": sorted(done_ids)})
+
+    job.progress(len(done_ids), total=len(playlist_ids))
+    summary = playlist_import.import_playlist_tracks(
+        job.access_token,
+        [pid for pid in playlist_ids if pid not in done_ids],
+        on_playlist_done=on_playlist_done
+    )
+    if summary["failed"]:
+        print(f"Playlist import failures: {summary['failed']}")
+    cooccurrence.refresh()
+    return summary
 
 
 @router.post("/snapshots")
 def refresh_playlists_if_snapshot_changed(access_token: str = Body(..., embed=True)):
     try:
-        user = spotify.get_user_profile(access_token)
-        user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, user["id"]))
+        user_uuid = resolve_identity(access_token).user_uuid
         playlists = spotify.get_user_playlists(access_token)
-        updated_count = 0
 
         with engine.begin() as conn:
-            for pl in playlists:
-                playlist_id = pl["id"]
-                new_snapshot = pl["snapshot_id"]
-                name = pl["name"]
-                is_public = pl["public"]
-
-                current = conn.execute(sqlalchemy.text("""
-                    SELECT snapshot_id FROM playlists WHERE id = :pid
-                """), {"pid": playlist_id}).scalar()
-
-                if current != new_snapshot:
-                    print(f"🌀 Updating {name}...")
-                    conn.execute(sqlalchemy.text("""
-                        UPDATE playlists
-                        SET name = :name, is_public = :is_public, snapshot_id = :snapshot_id
-                        WHERE id = :id
-                    """), {
-                        "id": playlist_id,
-                        "name": name,
-                        "is_public": is_public,
-                        "snapshot_id": new_snapshot
-                    })
-
-                    tracks = spotify.get_tracks_in_playlist(access_token, playlist_id)
-                    for item in tracks:
-                        track = item.get("track")
-                        if not track or not track.get("id"):
-                            continue
-                        conn.execute(sqlalchemy.text("""
-                            INSERT INTO tracks (id, name, artist, album, uri)
-                            VALUES (:id, :name, :artist, :album, :uri)
-                            ON CONFLICT (id) DO NOTHING
-                        """), {
-                            "id": track["id"],
-                            "name": track["name"],
-                            "artist": track["artists"][0]["name"],
-                            "album": track["album"]["name"],
-                            "uri": track["uri"]
-                        })
-                        conn.execute(sqlalchemy.text("""
-                            INSERT INTO playlist_tracks (playlist_id, track_id, added_at)
-                            VALUES (:playlist_id, :track_id, :added_at)
-                            ON CONFLICT DO NOTHING
-                        """), {
-                            "playlist_id": playlist_id,
-                            "track_id": track["id"],
-                            "added_at": item.get("added_at")
-                        })
-
-                    updated_count += 1
-
-        return {"updated": updated_count}
+            stored = dict(conn.execute(text("""
+                SELECT id, snapshot_id FROM playlists WHERE id = ANY(:ids)
+            """), {"ids": [pl["id"] for pl in playlists]}).fetchall())
+
+        changed = [pl for pl in playlists if stored.get(pl["id"]) != pl["snapshot_id"]]
+        synced = []
+
+        for pl in changed:
+            print(f"🌀 Updating {pl['name']}...")
+            items = [
+                item for item in spotify.get_tracks_in_playlist(access_token, pl["id"])
+                if bulk_write.track_row(item.get("track"))
+            ]
+            new_ids = {item["track"]["id"] for item in items}
+
+            with engine.begin() as conn:
+                existing_ids = set(conn.execute(text("""
+                    SELECT track_id FROM playlist_tracks WHERE playlist_id = :pid
+                """), {"pid": pl["id"]}).scalars().all())
+                added = new_ids - existing_ids
+                removed = existing_ids - new_ids
+
+                # Write the playlist row first (it may be new) and the snapshot
+                # in the same transaction as the delta, so a failed sync is retried.
+                bulk_write.upsert_playlists(conn, user_uuid, [pl])
+
+                if removed:
+                    conn.execute(text("""
+                        DELETE FROM playlist_tracks
+                        WHERE playlist_id = :pid AND track_id = ANY(:removed)
+                    """), {"pid": pl["id"], "removed": list(removed)})
+
+                bulk_write.insert_playlist_items(conn, [(pl["id"], item) for item in items if item["track"]["id"] in added])
+
+            synced.append({"id": pl["id"], "name": pl["name"], "added": len(added), "removed": len(removed)})
+
+        if synced:
+            cooccurrence.refresh()
+        return {"updated": len(synced), "playlists": synced}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -154,14 +130,34 @@ def refresh_playlists_if_snapshot_changed(access_token: str = Body(..., embed=Tr
 @router.post("/build")
 def build_custom_playlist(
     access_token: str = Body(..., embed=True),
-    track_ids: list[str] = Body(..., embed=True),
-    playlist_name: str = Body(..., embed=True)
+    playlist_name: str = Body(..., embed=True),
+    track_ids: list[str] = Body(None, embed=True),
+    audio_features: dict[str, AudioFeatureTarget] = Body(None, embed=True),
+    size: int = Body(50, embed=True, ge=1, le=500)
 ):
+    """Create a playlist from `track_ids`, or from the catalog tracks best matching `audio_features`.
 
+    `audio_features` maps feature names to a min/max range and/or a target,
+    e.g. {"energy": {"min": 0.7, "max": 0.9}, "valence": {"min": 0.5}, "tempo": {"target": 125}}.
+    """
     try:
-        user_data = spotify.get_user_profile(access_token)
-        user_id = user_data["id"]
-        user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, user_id))
+        if track_ids is not None and audio_features:
+            raise HTTPException(status_code=400, detail="Provide track_ids or audio_features, not both")
+        if track_ids is None:
+            if not audio_features:
+                raise HTTPException(status_code=400, detail="Provide track_ids or audio_features")
+            unknown = sorted(set(audio_features) - set(AUDIO_COLUMNS))
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown audio features: {', '.join(unknown)}")
+            track_ids = audio_index.find_tracks(
+                {name: (f.min, f.max) for name, f in audio_features.items() if f.min is not None or f.max is not None},
+                {name: f.target for name, f in audio_features.items() if f.target is not None},
+                size
+            )
+            if not track_ids:
+                raise HTTPException(status_code=404, detail="No tracks match the requested audio features")
+
+        user_id, user_uuid = resolve_identity(access_token)
 
         playlist = spotify.create_playlist(access_token, user_id, playlist_name)
         playlist_id = playlist["id"]
@@ -183,18 +179,15 @@ def build_custom_playlist(
                 "snapshot_id": snapshot_id
             })
 
-            for track_id in track_ids:
-                conn.execute(text("""
-                    INSERT INTO playlist_tracks (playlist_id, track_id)
-                    VALUES (:playlist_id, :track_id)
-                    ON CONFLICT DO NOTHING
-                """), {
-                    "playlist_id": playlist_id,
-                    "track_id": track_id
-                })
+            bulk_write.insert_rows(conn, "playlist_tracks", bulk_write.PLAYLIST_TRACK_COLUMNS, [
+                {"playlist_id": playlist_id, "track_id": track_id, "added_at": None}
+                for track_id in dict.fromkeys(track_ids)
+            ])
 
-        return {"message": "Custom playlist created successfully", "playlist_id": playlist_id}
+        return {"message": "Custom playlist created successfully", "playlist_id": playlist_id, "track_ids": track_ids}
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Playlist build error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -206,17 +199,16 @@ def combine_playlists(
     playlist_name: str = Body(..., embed=True)
 ):
     try:
-        user_data = spotify.get_user_profile(access_token)
-        user_id = user_data["id"]
-        user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, user_id))
+        user_id, user_uuid = resolve_identity(access_token)
         combined_tracks = []
 
         combined_track_ids = set()
         for pid in playlist_ids:
             tracks = spotify.get_playlist_tracks(access_token, pid)
             for t in tracks:
-                if t["track"] and t["track"]["id"]:
+                if t["track"] and t["track"]["id"] and t["track"]["id"] not in combined_track_ids:
                     combined_track_ids.add(t["track"]["id"])
+                    combined_tracks.append(t["track"])
 
         track_ids = list(combined_track_ids)
 
@@ -240,28 +232,12 @@ def combine_playlists(
                 "snapshot_id": snapshot_id
             })
 
-            for track in combined_tracks:
-                conn.execute(text("""
-                    INSERT INTO tracks (id, name, artist, album, uri)
-                    VALUES (:id, :name, :artist, :album, :uri)
-                    ON CONFLICT (id) DO NOTHING
-                """), {
-                    "id": track["id"],
-                    "name": track["name"],
-                    "artist": track["artists"][0]["name"],
-                    "album": track["album"]["name"],
-                    "uri": track["uri"]
-                    })
-
-            for track_id in track_ids:
-                conn.execute(text("""
-                    INSERT INTO playlist_tracks (playlist_id, track_id)
-                    VALUES (:playlist_id, :track_id)
-                    ON CONFLICT DO NOTHING
-                """), {
-                    "playlist_id": playlist_id,
-                    "track_id": track_id
-                })
+            bulk_write.insert_tracks(conn, [bulk_write.track_row(t) for t in combined_tracks])
+
+            bulk_write.insert_rows(conn, "playlist_tracks", bulk_write.PLAYLIST_TRACK_COLUMNS, [
+                {"playlist_id": playlist_id, "track_id": track_id, "added_at": None}
+                for track_id in dict.fromkeys(track_ids)
+            ])
 
         return {"message": "Combined playlist created", "playlist_id": playlist_id}
 
@@ -272,8 +248,7 @@ def combine_playlists(
 @router.post("/prune")
 def delete_removed_playlists(access_token: str = Body(..., embed=True)):
     try:
-        user = spotify.get_user_profile(access_token)
-        user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, user["id"]))
+        user_uuid = resolve_identity(access_token).user_uuid
         spotify_playlists = spotify.get_user_playlists(access_token)
         spotify_playlist_ids = {pl["id"] for pl in spotify_playlists}
 
@@ -293,6 +268,9 @@ def delete_removed_playlists(access_token: str = Body(..., embed=True)):
                     DELETE FROM playlists WHERE id = ANY(:deleted)
                 """), {"deleted": list(deleted_ids)})
 
+        if deleted_ids:
+            cooccurrence.refresh(wait=False)
+
         return {"deleted": list(deleted_ids)}
 
     except Exception as e:
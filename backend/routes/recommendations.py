@@ -1,81 +1,81 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
 from sqlalchemy import text
 from database import engine
-from services import spotify_api
-import uuid
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-import json
+from services import ann_index, cooccurrence, feature_matrix, jobs, rate_limit, recommendation_batch, recommender
+from services.identity import resolve_identity
 
 router = APIRouter(
     prefix="/recommendations",
-    tags=["recommendations"]
+    tags=["recommendations"],
+    dependencies=[Depends(rate_limit.interactive_priority)]
 )
 
 @router.get("")
-def get_content_based_recommendations(access_token: str = Query(...)):
+def get_content_based_recommendations(
+    access_token: str = Query(...),
+    limit: int = Query(20, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    exact: bool = Query(False),
+    probes: int = Query(ann_index.PROBES, ge=1, le=ann_index.MAX_PROBES),
+    mode: str = Query("content", pattern="^(content|cooccurrence)$")
+):
     try:
-        user_profile = spotify_api.get_user_profile(access_token)
-        user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, user_profile["id"]))
+        user_uuid = resolve_identity(access_token).user_uuid
+
+        if mode == "cooccurrence":
+            with engine.begin() as conn:
+                user_track_ids = recommender.user_track_ids(conn, user_uuid)
+            matrix = cooccurrence.current()
+            top_recs = cooccurrence.recommend(matrix, user_track_ids, limit, offset) if matrix is not None else []
+            if not top_recs and offset == 0:
+                raise HTTPException(status_code=404, detail="No co-occurring tracks found")
+            return {"recommendations": [track_id for track_id, _ in top_recs]}
 
         with engine.begin() as conn:
-            user_tracks = conn.execute(text("""
-                SELECT DISTINCT t.id, t.popularity, t.release_date, t.genres, t.artist
-                FROM tracks t
-                LEFT JOIN user_liked_tracks ult ON t.id = ult.track_id AND ult.user_id = :uid
-                LEFT JOIN user_top_tracks utt ON t.id = utt.track_id AND utt.user_id = :uid
-                LEFT JOIN user_stream_history ush ON t.id = ush.track_id AND ush.user_id = :uid
-                LEFT JOIN playlist_tracks pt ON t.id = pt.track_id
-                LEFT JOIN playlists p ON pt.playlist_id = p.id AND p.user_id = :uid
-                WHERE ult.user_id IS NOT NULL
-                   OR utt.user_id IS NOT NULL
-                   OR ush.user_id IS NOT NULL
-                   OR p.user_id IS NOT NULL
-            """), {"uid": user_uuid}).fetchall()
+            precomputed = recommendation_batch.precomputed(conn, user_uuid, limit, offset)
+            if precomputed is not None:
+                return {"recommendations": precomputed}
+            user_track_ids = recommender.user_track_ids(conn, user_uuid)
 
-            all_tracks = conn.execute(text("""
-                SELECT id, popularity, release_date, genres, artist
-                FROM tracks
-            """)).fetchall()
+        if not user_track_ids:
+            raise HTTPException(status_code=404, detail="No user track data found")
 
-        if not user_tracks:
+        features = feature_matrix.current()
+        user_rows = [features.row_of[tid] for tid in user_track_ids if tid in features.row_of]
+        if not user_rows:
             raise HTTPException(status_code=404, detail="No user track data found")
 
-        def genre_vector(genres, all_genres):
-            vec = [0] * len(all_genres)
-            for g in json.loads(genres or "[]"):
-                if g in all_genres:
-                    vec[all_genres.index(g)] = 1
-            return vec
+        index = None if exact else ann_index.load(features)
+        top_recs = recommender.recommend(features, user_rows, limit, offset, index=index, probes=probes)
+
+        return {"recommendations": [features.track_ids[row] for row, _ in top_recs]}
 
-        genre_set = set()
-        for _, _, _, genres, _ in all_tracks:
-            genre_set.update(json.loads(genres or "[]"))
-        genre_list = sorted(genre_set)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print("Error generating content-based recommendations:", str(e))
+        raise HTTPException(status_code=500, detail=str(e))
 
-        def track_to_vector(track):
-            popularity = track[1] or 0
-            release_year = int((track[2] or "0")[:4]) if track[2] else 0
-            genres_vec = genre_vector(track[3], genre_list)
-            return [popularity, release_year] + genres_vec
 
-        user_vecs = np.array([track_to_vector(t) for t in user_tracks])
-        all_vecs = np.array([track_to_vector(t) for t in all_tracks])
+@router.post("/precompute")
+def precompute_recommendations(access_token: str = Body(..., embed=True)):
+    try:
+        job_id = jobs.submit("precompute_recommendations", access_token)
+        return {"message": "Precomputing recommendations for every user", "job_id": job_id}
+    except Exception as e:
+        print("Error starting recommendations precompute:", str(e))
+        raise HTTPException(status_code=500, detail=str(e))
 
-        sims = cosine_similarity(user_vecs, all_vecs)
-        avg_sim = sims.mean(axis=0)
 
-        seen_ids = set(t[0] for t in user_tracks)
-        recommendations = [
-            (track[0], float(score))
-            for track, score in zip(all_tracks, avg_sim)
-            if track[0] not in seen_ids
-        ]
-        recommendations.sort(key=lambda x: x[1], reverse=True)
-        top_recs = recommendations[:20]
+@jobs.handler("precompute_recommendations")
+def run_recommendations_precompute(job: jobs.JobContext) -> dict:
+    checkpoint = job.checkpoint or {}
+    with engine.begin() as conn:
+        total = conn.execute(text("SELECT count(*) FROM users")).scalar()
+    resumed = checkpoint.get("users", 0)
 
-        return {"recommendations": [r[0] for r in top_recs]}
+    def on_batch(done, last_user):
+        job.progress(resumed + done, total=total, checkpoint={"after": last_user, "users": resumed + done})
 
-    except Exception as e:
-        print("Error generating content-based recommendations:", str(e))
-        raise HTTPException(status_code=500, detail=str(e))
+    users = recommendation_batch.precompute(after=checkpoint.get("after"), on_batch=on_batch)
+    return {"users": resumed + users}
@@ -1,9 +1,16 @@
-from fastapi import APIRouter, Body, HTTPException
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter, Body, Depends, HTTPException
 from sqlalchemy import text
 from database import engine
 import services.spotify_api as spotify_api
+from services import rate_limit, bulk_write, ann_index, feature_matrix, jobs
+from services.artist_genres import resolve_artist_genres, track_genres_json
 
-router = APIRouter(prefix="/seeds", tags=["seeds"])
+router = APIRouter(prefix="/seeds", tags=["seeds"], dependencies=[Depends(rate_limit.bulk_priority)])
+
+# Albums fetched per /albums request and written per transaction; also how often the job checkpoints.
+ALBUMS_PER_CHECKPOINT = 20
 
 
 @router.post("/new-releases")
@@ -12,53 +19,91 @@ def seed_from_new_releases(
     max_albums: int = Body(100)
 ):
     try:
-        albums = spotify_api.get_new_releases(access_token, limit=50, max_albums=max_albums)
-        print(f"Found {len(albums)} new release albums")
+        job_id = jobs.submit("seed_new_releases", access_token, {"max_albums": max_albums})
+        return {"message": "Seeding tracks from new releases", "job_id": job_id}
+    except Exception as e:
+        print(f"Error seeding new releases: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        with engine.begin() as conn:
-            for album in albums:
-                album_id = album["id"]
-                try:
-                    album_tracks = spotify_api.get_album_tracks(access_token, album_id)
-                    track_ids = [t["id"] for t in album_tracks if t.get("id")]
-
-                    if not track_ids:
-                        continue
-
-                    detailed_tracks = spotify_api.get_tracks_metadata(access_token, track_ids)
-
-                    for track in detailed_tracks:
-                        if not track or not track.get("id"):
-                            continue
-
-                        artist = track["artists"][0]["name"]
-                        album_name = track["album"]["name"]
-                        uri = track.get("uri")
-                        popularity = track.get("popularity")
-                        release_date = track.get("album", {}).get("release_date")
-                        artist_id = track["artists"][0]["id"]
-                        genres = spotify_api.get_artist_genres(access_token, artist_id)
-
-                        conn.execute(text("""
-                            INSERT INTO tracks (id, name, artist, album, uri, popularity, release_date, genres)
-                            VALUES (:id, :name, :artist, :album, :uri, :popularity, :release_date, :genres)
-                            ON CONFLICT (id) DO NOTHING
-                        """), {
-                            "id": track["id"],
-                            "name": track["name"],
-                            "artist": artist,
-                            "album": album_name,
-                            "uri": uri,
-                            "popularity": popularity,
-                            "release_date": release_date,
-                            "genres": genres
-                        })
 
+def _fetch_albums(access_token: str, album_ids: list) -> list:
+    """Album objects for the ids not seeded yet, each with its full track list."""
+    with engine.begin() as conn:
+        seeded = set(conn.execute(text("SELECT id FROM albums WHERE id = ANY(:ids)"), {"ids": album_ids}).scalars().all())
+    albums = [a for a in spotify_api.get_albums(access_token, [i for i in album_ids if i not in seeded]) if a]
+    for album in albums:
+        if album["tracks"].get("next"):
+            album["tracks"]["items"] = spotify_api.get_album_tracks(access_token, album["id"])
+    return albums
+
+
+def _enrich(access_token: str, albums: list) -> list:
+    """Track metadata rows for every track on `albums`, with genres."""
+    track_ids = [t["id"] for album in albums for t in album["tracks"]["items"] if t.get("id")]
+    detailed_tracks = [t for t in spotify_api.get_tracks_metadata(access_token, track_ids) if t and t.get("id")]
+    genres_by_artist = resolve_artist_genres(access_token, [t["artists"][0]["id"] for t in detailed_tracks])
+    return [bulk_write.track_metadata_row(t, track_genres_json(t, genres_by_artist)) for t in detailed_tracks]
+
+
+@jobs.handler("seed_new_releases")
+def run_new_releases_seed(job: jobs.JobContext) -> dict:
+    """Seed tracks from new releases, ALBUMS_PER_CHECKPOINT albums at a time.
+
+    Each chunk is one /albums request, one /tracks request per 50 of its
+    tracks and one /artists request per 50 unknown artists; the next chunk's
+    albums are fetched while the current one is enriched and written.
+    Albums are recorded with their tracks, so albums already seeded are
+    skipped without any request.
+    """
+    checkpoint = job.checkpoint or {}
+    album_ids = checkpoint.get("album_ids")
+    if album_ids is None:
+        albums = spotify_api.get_new_releases(job.access_token, limit=50, max_albums=job.params["max_albums"])
+        album_ids = [album["id"] for album in albums]
+        print(f"Found {len(album_ids)} new release albums")
+
+    tracks_written = checkpoint.get("tracks_written", 0)
+    albums_seeded = checkpoint.get("albums_seeded", 0)
+    starts = list(range(checkpoint.get("next", 0), len(album_ids), ALBUMS_PER_CHECKPOINT))
+
+    def fetch(start):
+        # Copy the job's context so the prefetch keeps its bulk rate-limit priority.
+        chunk = album_ids[start:start + ALBUMS_PER_CHECKPOINT]
+        return pool.submit(contextvars.copy_context().run, _fetch_albums, job.access_token, chunk)
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        prefetch = fetch(starts[0]) if starts else None
+        for n, start in enumerate(starts):
+            try:
+                albums = prefetch.result()
+            except Exception as e:
+                print(f"Error fetching albums {album_ids[start:start + ALBUMS_PER_CHECKPOINT]}: {e}")
+                albums = []
+            if n + 1 < len(starts):
+                prefetch = fetch(starts[n + 1])
+
+            if albums:
+                try:
+                    rows = _enrich(job.access_token, albums)
+                    with engine.begin() as conn:
+                        tracks_written += bulk_write.insert_tracks(conn, rows, columns=bulk_write.TRACK_METADATA_COLUMNS)
+                        albums_seeded += bulk_write.insert_rows(conn, "albums", bulk_write.ALBUM_COLUMNS, [
+                            {"id": a["id"], "name": a.get("name"), "release_date": a.get("release_date"),
+                             "total_tracks": a.get("total_tracks")}
+                            for a in albums
+                        ])
+                    feature_matrix.refresh()
+                    ann_index.update()
                 except Exception as e:
-                    print(f"Error processing album {album_id}: {e}")
-                    continue
+                    # Left out of albums, so the next seed retries them.
+                    print(f"Error seeding albums {[a['id'] for a in albums]}: {e}")
 
-        return {"message": "Seeded tracks from new releases"}
-    except Exception as e:
-        print(f"Error seeding new releases: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+            done = min(start + ALBUMS_PER_CHECKPOINT, len(album_ids))
+            job.progress(done, total=len(album_ids), checkpoint={
+                "album_ids": album_ids,
+                "next": done,
+                "tracks_written": tracks_written,
+                "albums_seeded": albums_seeded,
+            })
+
+    return {"albums": len(album_ids), "albums_seeded": albums_seeded, "tracks_written": tracks_written}
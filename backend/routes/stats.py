@@ -1,46 +1,41 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy import text
 from database import engine
-import uuid
-import json
-from services import spotify_api
+from services import dashboard, rate_limit
+from services.identity import resolve_identity
 
 router = APIRouter(
     prefix="/stats",
-    tags=["stats"]
+    tags=["stats"],
+    dependencies=[Depends(rate_limit.interactive_priority)]
 )
 
+@router.get("/dashboard")
+def get_dashboard(access_token: str = Query(...)):
+    try:
+        user_uuid = resolve_identity(access_token).user_uuid
+        return dashboard.get_dashboard(user_uuid)
+
+    except Exception as e:
+        print(f"Error in /stats/dashboard: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get stats dashboard")
+
 @router.get("/top-genres")
 def get_top_genres(access_token: str = Query(...)):
     try:
-        user = spotify_api.get_user_profile(access_token)
-        user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, user["id"]))
+        user_uuid = resolve_identity(access_token).user_uuid
 
         with engine.begin() as conn:
             results = conn.execute(text("""
-                SELECT genres FROM tracks t
-                JOIN (
-                    SELECT track_id FROM user_liked_tracks WHERE user_id = :uid
-                    UNION
-                    SELECT track_id FROM user_stream_history WHERE user_id = :uid
-                    UNION
-                    SELECT track_id FROM user_top_tracks WHERE user_id = :uid
-                ) user_tracks
-                ON t.id = user_tracks.track_id
-                WHERE t.genres IS NOT NULL
+                SELECT g.name, c.tracks
+                FROM user_genre_counts c
+                JOIN genres g ON g.id = c.genre_id
+                WHERE c.user_id = :uid
+                ORDER BY c.tracks DESC, g.name
+                LIMIT 10
             """), {"uid": user_uuid}).fetchall()
 
-        genre_counts = {}
-        for (genres_json,) in results:
-            if genres_json:
-                try:
-                    genres = json.loads(genres_json)
-                    for genre in genres:
-                        genre_counts[genre] = genre_counts.get(genre, 0) + 1
-                except json.JSONDecodeError:
-                    continue
-
-        top_genres = sorted(genre_counts.items(), key=lambda x: x[1], reverse=True)[:10]
+        top_genres = [(name, count) for name, count in results]
         return {"top_genres": top_genres}
 
     except Exception as e:
@@ -50,29 +45,18 @@ def get_top_genres(access_token: str = Query(...)):
 @router.get("/top-artists")
 def get_top_artists(access_token: str = Query(...)):
     try:
-        user = spotify_api.get_user_profile(access_token)
-        user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, user["id"]))
+        user_uuid = resolve_identity(access_token).user_uuid
 
         with engine.begin() as conn:
             results = conn.execute(text("""
-                SELECT artist FROM tracks t
-                JOIN (
-                    SELECT track_id FROM user_liked_tracks WHERE user_id = :uid
-                    UNION
-                    SELECT track_id FROM user_stream_history WHERE user_id = :uid
-                    UNION
-                    SELECT track_id FROM user_top_tracks WHERE user_id = :uid
-                ) user_tracks
-                ON t.id = user_tracks.track_id
-                WHERE t.artist IS NOT NULL
+                SELECT artist, tracks
+                FROM user_artist_counts
+                WHERE user_id = :uid
+                ORDER BY tracks DESC, artist
+                LIMIT 10
             """), {"uid": user_uuid}).fetchall()
 
-        artist_counts = {}
-        for (artist,) in results:
-            if artist:
-                artist_counts[artist] = artist_counts.get(artist, 0) + 1
-
-        top_artists = sorted(artist_counts.items(), key=lambda x: x[1], reverse=True)[:10]
+        top_artists = [(artist, count) for artist, count in results]
         return {"top_artists": top_artists}
 
     except Exception as e:
@@ -82,49 +66,27 @@ def get_top_artists(access_token: str = Query(...)):
 @router.get("/track-summary")
 def get_track_summary(access_token: str = Query(...)):
     try:
-        user = spotify_api.get_user_profile(access_token)
-        user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, user["id"]))
+        user_uuid = resolve_identity(access_token).user_uuid
 
         with engine.begin() as conn:
-            results = conn.execute(text("""
-                SELECT t.popularity, t.release_date, t.genres
-                FROM tracks t
-                JOIN (
-                    SELECT track_id FROM user_liked_tracks WHERE user_id = :uid
-                    UNION
-                    SELECT track_id FROM user_stream_history WHERE user_id = :uid
-                    UNION
-                    SELECT track_id FROM user_top_tracks WHERE user_id = :uid
-                ) user_tracks
-                ON t.id = user_tracks.track_id
-                WHERE t.popularity IS NOT NULL AND t.release_date IS NOT NULL
+            release_years = conn.execute(text("""
+                SELECT release_year, tracks, popularity_sum
+                FROM user_year_counts
+                WHERE user_id = :uid
+                ORDER BY release_year DESC
             """), {"uid": user_uuid}).fetchall()
+            genre_diversity = conn.execute(text("""
+                SELECT count(*) FROM user_genre_counts WHERE user_id = :uid AND summary_tracks > 0
+            """), {"uid": user_uuid}).scalar()
 
-        if not results:
+        if not release_years:
             return {"message": "No track data available for summary."}
 
-        total_popularity = 0
-        release_years = {}
-        genre_set = set()
-        total_tracks = 0
-
-        for popularity, release_date, genres_json in results:
-            total_tracks += 1
-            total_popularity += popularity
-
-            year = release_date[:4]
-            release_years[year] = release_years.get(year, 0) + 1
-
-            if genres_json:
-                try:
-                    genres = json.loads(genres_json)
-                    genre_set.update(genres)
-                except json.JSONDecodeError:
-                    continue
+        total_tracks = sum(count for _, count, _ in release_years)
+        total_popularity = sum(popularity for _, _, popularity in release_years)
 
         avg_popularity = round(total_popularity / total_tracks, 2)
-        release_year_distribution = dict(sorted(release_years.items(), key=lambda x: x[0], reverse=True))
-        genre_diversity = len(genre_set)
+        release_year_distribution = {str(year): count for year, count, _ in release_years}
 
         return {
             "average_popularity": avg_popularity,
@@ -1,11 +1,63 @@
 from fastapi import APIRouter, Body, HTTPException
 from sqlalchemy import text
 from database import engine
-import uuid
 import services.spotify_api as spotify
+from services import ann_index, audio_features, bulk_write, feature_matrix, jobs, recommender, rollups
+from services.artist_genres import resolve_artist_genres, track_genres_json
+from services.identity import resolve_identity
 
 router = APIRouter(prefix="/tracks", tags=["tracks"])
 
+MISSING_METADATA_SQL = "popularity IS NULL OR release_date IS NULL OR genres IS NULL"
+MISSING_AUDIO_SQL = f"NOT EXISTS (SELECT 1 FROM audio_features a WHERE a.track_id = tracks.id AND {audio_features.SETTLED_SQL})"
+# Tracks enriched per round: one /audio-features request, two /tracks requests.
+ENRICH_CHUNK = 100
+# The global job brings the feature matrix and ANN index up to date every this many tracks.
+MATRIX_REFRESH_TRACKS = 5000
+
+USER_CANDIDATES_SQL = f"""
+    SELECT id, ({MISSING_METADATA_SQL}) FROM tracks
+    WHERE id IN (SELECT track_id FROM ({recommender.USER_TRACKS_SQL}) user_tracks)
+      AND ({MISSING_METADATA_SQL} OR {MISSING_AUDIO_SQL})
+    ORDER BY id
+"""
+
+
+def enrich_chunk(access_token: str, track_ids: list) -> int:
+    """Fill popularity, release date and genres for up to 50 tracks."""
+    track_meta = [t for t in spotify.get_tracks_metadata(access_token, track_ids) if t and t.get("id")]
+    genres_by_artist = resolve_artist_genres(access_token, [t["artists"][0]["id"] for t in track_meta])
+
+    with engine.begin() as conn:
+        bulk_write.update_rows(conn, "tracks", "id", bulk_write.TRACK_ENRICHMENT_COLUMNS, bulk_write.dedupe([{
+            "id": t["id"],
+            "popularity": t.get("popularity"),
+            "release_date": t.get("album", {}).get("release_date"),
+            "genres": track_genres_json(t, genres_by_artist)
+        } for t in track_meta], ("id",)))
+        rollups.refresh_tracks(conn, [t["id"] for t in track_meta])
+
+    return len(track_meta)
+
+
+def enrich_candidates(access_token: str, rows: list) -> tuple:
+    """Enrich (track_id, missing_metadata) rows.
+
+    Returns (tracks updated, tracks given audio features, audio features
+    error). A failed audio features request is logged and reported rather
+    than raised, so it doesn't stop the metadata enrichment.
+    """
+    missing_metadata = [track_id for track_id, missing in rows if missing]
+    updated = 0
+    for i in range(0, len(missing_metadata), 50):
+        updated += enrich_chunk(access_token, missing_metadata[i:i + 50])
+    try:
+        return updated, audio_features.ingest(access_token, [track_id for track_id, _ in rows]), None
+    except Exception as e:
+        print("Fetching audio features failed:", e)
+        return updated, 0, str(e)
+
+
 @router.post("/enrich")
 def enrich_tracks_metadata(
     access_token: str = Body(..., embed=True),
@@ -15,72 +67,91 @@ def enrich_tracks_metadata(
         if mode not in {"user", "global"}:
             raise HTTPException(status_code=400, detail="Invalid mode. Use 'user' or 'global'.")
 
-        if mode == "user":
-            user_data = spotify.get_user_profile(access_token)
-            user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, user_data["id"]))
-
-            with engine.begin() as conn:
-                liked = conn.execute(text("SELECT track_id FROM user_liked_tracks WHERE user_id = :uid"),
-                                     {"uid": user_uuid}).scalars().all()
-                history = conn.execute(text("SELECT track_id FROM user_stream_history WHERE user_id = :uid"),
-                                       {"uid": user_uuid}).scalars().all()
-                playlist = conn.execute(text("""
-                    SELECT pt.track_id
-                    FROM playlist_tracks pt
-                    JOIN playlists p ON pt.playlist_id = p.id
-                    WHERE p.user_id = :uid
-                """), {"uid": user_uuid}).scalars().all()
-                top = conn.execute(text("SELECT track_id FROM user_top_tracks WHERE user_id = :uid"),
-                                   {"uid": user_uuid}).scalars().all()
-
-            track_ids = list({*liked, *history, *playlist, *top})
-            if not track_ids:
-                return {"updated": 0, "detail": "No tracks associated with this user."}
-
-            with engine.begin() as conn:
-                missing_ids = conn.execute(text("""
-                    SELECT id FROM tracks
-                    WHERE id = ANY(:ids)
-                      AND (popularity IS NULL OR release_date IS NULL OR genres IS NULL)
-                """), {"ids": track_ids}).scalars().all()
-
-        else:
-            with engine.begin() as conn:
-                missing_ids = conn.execute(text("""
-                    SELECT id FROM tracks
-                    WHERE popularity IS NULL OR release_date IS NULL OR genres IS NULL
-                """)).scalars().all()
-
-        if not missing_ids:
+        if mode == "global":
+            job_id = jobs.submit("enrich_global", access_token)
+            return {"message": "Global enrichment started", "job_id": job_id, "mode": mode}
+
+        user_uuid = resolve_identity(access_token).user_uuid
+
+        # Stream the user's tracks that still need enrichment from a server-side
+        # cursor, ENRICH_CHUNK at a time; the writes go through other connections.
+        updated = audio = candidates = audio_errors = 0
+        audio_error = None
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, max_row_buffer=ENRICH_CHUNK).execute(
+                text(USER_CANDIDATES_SQL), {"users": [str(user_uuid)]}
+            )
+            for rows in iter(lambda: result.fetchmany(ENRICH_CHUNK), []):
+                candidates += len(rows)
+                chunk_updated, chunk_audio, chunk_error = enrich_candidates(access_token, rows)
+                updated += chunk_updated
+                audio += chunk_audio
+                if chunk_error:
+                    audio_errors += 1
+                    audio_error = chunk_error
+
+        if not candidates:
             return {"updated": 0, "detail": "No tracks require enrichment."}
 
-        updated = 0
-        batches = [missing_ids[i:i+50] for i in range(0, len(missing_ids), 50)]
-        for chunk in batches:
-            track_meta = spotify.get_tracks_metadata(access_token, chunk)
-
-            with engine.begin() as conn:
-                for t in track_meta:
-                    if not t or not t.get("id"):
-                        continue
-                    artist_id = t["artists"][0]["id"]
-                    genres = spotify.get_artist_genres(access_token, artist_id)
-                    conn.execute(text("""
-                        UPDATE tracks
-                        SET popularity = :popularity,
-                            release_date = :release_date,
-                            genres = :genres
-                        WHERE id = :id
-                    """), {
-                        "id": t["id"],
-                        "popularity": t.get("popularity"),
-                        "release_date": t.get("album", {}).get("release_date"),
-                        "genres": genres
-                    })
-                    updated += 1
-
-        return {"updated": updated, "mode": mode}
+        feature_matrix.refresh()
+        ann_index.update()
+
+        return {"updated": updated, "audio_features": audio, "audio_feature_errors": audio_errors,
+                "audio_feature_error": audio_error, "mode": mode}
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Metadata enrichment failed ({mode=}):", e)
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@jobs.handler("enrich_global")
+def run_global_enrichment(job: jobs.JobContext) -> dict:
+    # Walk the tracks missing metadata or audio features in id order so the
+    # checkpoint is just the last id done.
+    checkpoint = job.checkpoint or {}
+    after_id = checkpoint.get("after_id", "")
+    updated = checkpoint.get("updated", 0)
+    audio = checkpoint.get("audio_features", 0)
+    audio_errors = checkpoint.get("audio_feature_errors", 0)
+    audio_error = checkpoint.get("audio_feature_error")
+
+    with engine.begin() as conn:
+        remaining = conn.execute(text(f"""
+            SELECT count(*) FROM tracks WHERE ({MISSING_METADATA_SQL} OR {MISSING_AUDIO_SQL}) AND id > :after
+        """), {"after": after_id}).scalar()
+    total = job.done + remaining
+
+    since_refresh = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(f"""
+                SELECT id, ({MISSING_METADATA_SQL}) FROM tracks
+                WHERE ({MISSING_METADATA_SQL} OR {MISSING_AUDIO_SQL}) AND id > :after
+                ORDER BY id
+                LIMIT :n
+            """), {"after": after_id, "n": ENRICH_CHUNK}).fetchall()
+        if not rows:
+            break
+
+        chunk_updated, chunk_audio, chunk_error = enrich_candidates(job.access_token, rows)
+        updated += chunk_updated
+        audio += chunk_audio
+        if chunk_error:
+            audio_errors += 1
+            audio_error = chunk_error
+        since_refresh += len(rows)
+        if since_refresh >= MATRIX_REFRESH_TRACKS:
+            feature_matrix.refresh()
+            ann_index.update()
+            since_refresh = 0
+        after_id = rows[-1][0]
+        job.progress(job.done + len(rows), total=total,
+                     checkpoint={"after_id": after_id, "updated": updated, "audio_features": audio,
+                                 "audio_feature_errors": audio_errors, "audio_feature_error": audio_error})
+
+    feature_matrix.refresh()
+    ann_index.update()
+    return {"updated": updated, "audio_features": audio, "audio_feature_errors": audio_errors,
+            "audio_feature_error": audio_error, "mode": "global"}
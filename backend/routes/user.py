@@ -1,34 +1,43 @@
 from fastapi import APIRouter, Body, HTTPException
 from sqlalchemy import text
 from database import engine
-from datetime import datetime, timezone
-import uuid
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import time
 import services.spotify_api as spotify
+from services import bulk_write, cooccurrence, playlist_import, library_sync, rollups
+from services.identity import resolve_identity, remember_profile
+from services.recently_played_poller import poller
 
 router = APIRouter(prefix="/user", tags=["user"])
 
 
+def upsert_user(conn, user_uuid: str, profile: dict):
+    conn.execute(text("""
+        INSERT INTO users (id, spotify_id, email, display_name, country)
+        VALUES (:id, :spotify_id, :email, :display_name, :country)
+        ON CONFLICT (id) DO UPDATE SET
+            email = EXCLUDED.email,
+            display_name = EXCLUDED.display_name,
+            country = EXCLUDED.country
+    """), {
+        "id": user_uuid,
+        "spotify_id": profile["id"],
+        "email": profile.get("email", f"{profile['id']}@spotify.com"),
+        "display_name": profile.get("display_name"),
+        "country": profile.get("country")
+    })
+
+
 @router.post("/profile")
 def import_user_profile(access_token: str = Body(..., embed=True)):
     try:
         profile = spotify.get_user_profile(access_token)
-        user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, profile["id"]))
+        user_uuid = remember_profile(access_token, profile).user_uuid
+        poller.register(user_uuid, access_token)
 
         with engine.begin() as conn:
-            conn.execute(text("""
-                INSERT INTO users (id, spotify_id, email, display_name, country)
-                VALUES (:id, :spotify_id, :email, :display_name, :country)
-                ON CONFLICT (id) DO UPDATE SET
-                    email = EXCLUDED.email,
-                    display_name = EXCLUDED.display_name,
-                    country = EXCLUDED.country
-            """), {
-                "id": user_uuid,
-                "spotify_id": profile["id"],
-                "email": profile.get("email", f"{profile['id']}@spotify.com"),
-                "display_name": profile.get("display_name"),
-                "country": profile.get("country")
-            })
+            upsert_user(conn, user_uuid, profile)
 
         return {"message": "User profile imported successfully."}
 
@@ -40,33 +49,16 @@ def import_user_profile(access_token: str = Body(..., embed=True)):
 @router.post("/top-tracks")
 def import_user_top_tracks(access_token: str = Body(..., embed=True)):
     try:
-        profile = spotify.get_user_profile(access_token)
-        user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, profile["id"]))
+        user_uuid = resolve_identity(access_token).user_uuid
         top_tracks = spotify.get_user_top_tracks(access_token)
 
         with engine.begin() as conn:
-            for rank, track in enumerate(top_tracks):
-                conn.execute(text("""
-                    INSERT INTO tracks (id, name, artist, album, uri)
-                    VALUES (:id, :name, :artist, :album, :uri)
-                    ON CONFLICT (id) DO NOTHING
-                """), {
-                    "id": track["id"],
-                    "name": track["name"],
-                    "artist": track["artists"][0]["name"],
-                    "album": track["album"]["name"],
-                    "uri": track["uri"]
-                })
-
-                conn.execute(text("""
-                    INSERT INTO user_top_tracks (user_id, track_id, rank)
-                    VALUES (:user_id, :track_id, :rank)
-                    ON CONFLICT DO NOTHING
-                """), {
-                    "user_id": user_uuid,
-                    "track_id": track["id"],
-                    "rank": rank + 1
-                })
+            bulk_write.insert_tracks(conn, [bulk_write.track_row(t) for t in top_tracks])
+            bulk_write.insert_rows(conn, "user_top_tracks", bulk_write.USER_TOP_TRACK_COLUMNS, [
+                {"user_id": user_uuid, "track_id": track["id"], "rank": rank + 1}
+                for rank, track in enumerate(top_tracks)
+            ])
+            rollups.add_tracks(conn, user_uuid, [track["id"] for track in top_tracks])
 
         return {"message": f"Imported {len(top_tracks)} top tracks."}
 
@@ -76,39 +68,13 @@ def import_user_top_tracks(access_token: str = Body(..., embed=True)):
 
 
 @router.post("/liked-tracks")
-def import_liked_tracks(access_token: str = Body(..., embed=True)):
+def import_liked_tracks(access_token: str = Body(..., embed=True), full: bool = Body(False, embed=True)):
     try:
-        profile = spotify.get_user_profile(access_token)
-        user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, profile["id"]))
-        liked = spotify.get_liked_tracks(access_token)
-        now = datetime.now(timezone.utc)
+        user_uuid = resolve_identity(access_token).user_uuid
+        result = library_sync.sync_liked_tracks(access_token, user_uuid, full=full)
+        cooccurrence.refresh(wait=False)
 
-        with engine.begin() as conn:
-            for item in liked:
-                track = item["track"]
-                conn.execute(text("""
-                    INSERT INTO tracks (id, name, artist, album, uri)
-                    VALUES (:id, :name, :artist, :album, :uri)
-                    ON CONFLICT (id) DO NOTHING
-                """), {
-                    "id": track["id"],
-                    "name": track["name"],
-                    "artist": track["artists"][0]["name"],
-                    "album": track["album"]["name"],
-                    "uri": track["uri"]
-                })
-
-                conn.execute(text("""
-                    INSERT INTO user_liked_tracks (user_id, track_id, liked_at)
-                    VALUES (:user_id, :track_id, :liked_at)
-                    ON CONFLICT DO NOTHING
-                """), {
-                    "user_id": user_uuid,
-                    "track_id": track["id"],
-                    "liked_at": now
-                })
-
-        return {"message": f"Imported {len(liked)} liked tracks."}
+        return {"message": f"Imported {result['fetched']} liked tracks.", **result}
 
     except Exception as e:
         print("Error in /user/liked-tracks:", e)
@@ -118,39 +84,114 @@ def import_liked_tracks(access_token: str = Body(..., embed=True)):
 @router.post("/recently-played")
 def import_recently_played(access_token: str = Body(..., embed=True)):
     try:
-        profile = spotify.get_user_profile(access_token)
-        user_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, profile["id"]))
-        history = spotify.get_recently_played(access_token)
+        user_uuid = resolve_identity(access_token).user_uuid
+        poller.register(user_uuid, access_token)
+        result = library_sync.sync_recently_played(access_token, user_uuid)
 
-        with engine.begin() as conn:
-            for item in history:
-                track = item["track"]
-                played_at = item["played_at"]
-
-                conn.execute(text("""
-                    INSERT INTO tracks (id, name, artist, album, uri)
-                    VALUES (:id, :name, :artist, :album, :uri)
-                    ON CONFLICT (id) DO NOTHING
-                """), {
-                    "id": track["id"],
-                    "name": track["name"],
-                    "artist": track["artists"][0]["name"],
-                    "album": track["album"]["name"],
-                    "uri": track["uri"]
-                })
-
-                conn.execute(text("""
-                    INSERT INTO user_stream_history (user_id, track_id, played_at)
-                    VALUES (:user_id, :track_id, :played_at)
-                    ON CONFLICT DO NOTHING
-                """), {
-                    "user_id": user_uuid,
-                    "track_id": track["id"],
-                    "played_at": played_at
-                })
-
-        return {"message": f"Imported {len(history)} recently played tracks."}
+        return {"message": f"Imported {result['fetched']} recently played tracks.", **result}
 
     except Exception as e:
         print("Error in /user/history:", e)
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def _submit(pool, fn, *args):
+    # Copy the request's context so worker threads keep its rate-limit priority.
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _timed(timings: dict, stage: str, fn, *args):
+    started = time.monotonic()
+    result = fn(*args)
+    timings[stage] = round(time.monotonic() - started, 3)
+    return result
+
+
+@router.post("/sync")
+def sync_user_library(access_token: str = Body(..., embed=True)):
+    """Import profile, top/liked/recent tracks, playlists and playlist tracks in one call.
+
+    The profile is fetched once, the independent Spotify fetches run
+    concurrently, and every track row is deduplicated into a single bulk write.
+    """
+    try:
+        started = time.monotonic()
+        timings = {}
+        profile = _timed(timings, "profile", spotify.get_user_profile, access_token)
+        user_uuid = remember_profile(access_token, profile).user_uuid
+        poller.register(user_uuid, access_token)
+
+        def fetch_playlists_with_items():
+            playlists = _timed(timings, "playlists", spotify.get_user_playlists, access_token)
+            with ThreadPoolExecutor(max_workers=playlist_import.FETCH_WORKERS) as pool:
+                futures = [_submit(pool, spotify.get_tracks_in_playlist, access_token, pl["id"]) for pl in playlists]
+                items = _timed(timings, "playlist_tracks", lambda: [f.result() for f in futures])
+            return playlists, items
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            top_future = _submit(pool, _timed, timings, "top_tracks", spotify.get_user_top_tracks, access_token)
+            liked_future = _submit(pool, _timed, timings, "liked_tracks", library_sync.fetch_liked_tracks, access_token, user_uuid)
+            recent_future = _submit(pool, _timed, timings, "recently_played", library_sync.fetch_recently_played, access_token, user_uuid)
+            playlists_future = _submit(pool, fetch_playlists_with_items)
+
+            top_tracks = top_future.result()
+            liked = liked_future.result()
+            history = recent_future.result()
+            playlists, playlist_items = playlists_future.result()
+
+        write_started = time.monotonic()
+        playlist_pairs = [
+            (pl["id"], item)
+            for pl, items in zip(playlists, playlist_items)
+            for item in items
+            if bulk_write.track_row(item.get("track"))
+        ]
+        track_rows = [bulk_write.track_row(t) for t in top_tracks]
+        track_rows += [bulk_write.track_row(item["track"]) for item in liked.items + history]
+        track_rows += [bulk_write.track_row(item["track"]) for _, item in playlist_pairs]
+
+        with engine.begin() as conn:
+            upsert_user(conn, user_uuid, profile)
+            tracks_written = bulk_write.insert_tracks(conn, track_rows)
+            bulk_write.insert_rows(conn, "user_top_tracks", bulk_write.USER_TOP_TRACK_COLUMNS, [
+                {"user_id": user_uuid, "track_id": track["id"], "rank": rank + 1}
+                for rank, track in enumerate(top_tracks)
+            ])
+            rollups.add_tracks(conn, user_uuid, [track["id"] for track in top_tracks])
+            library_sync.write_liked_tracks(conn, user_uuid, liked, with_tracks=False)
+            library_sync.write_recently_played(conn, user_uuid, history, with_tracks=False)
+            # Playlists whose snapshot moved get the /playlists/snapshots delta: tracks
+            # no longer on them are removed before the new snapshot_id is stored.
+            stored = dict(conn.execute(text("""
+                SELECT id, snapshot_id FROM playlists WHERE id = ANY(:ids)
+            """), {"ids": [pl["id"] for pl in playlists]}).fetchall())
+            for pl, items in zip(playlists, playlist_items):
+                if pl["id"] in stored and stored[pl["id"]] != pl["snapshot_id"]:
+                    conn.execute(text("""
+                        DELETE FROM playlist_tracks
+                        WHERE playlist_id = :pid AND NOT (track_id = ANY(:ids))
+                    """), {"pid": pl["id"], "ids": [
+                        item["track"]["id"] for item in items if bulk_write.track_row(item.get("track"))
+                    ]})
+            bulk_write.upsert_playlists(conn, user_uuid, playlists)
+            bulk_write.insert_playlist_items(conn, playlist_pairs, with_tracks=False)
+        timings["write"] = round(time.monotonic() - write_started, 3)
+        _timed(timings, "cooccurrence", cooccurrence.refresh, False)
+        timings["total"] = round(time.monotonic() - started, 3)
+
+        return {
+            "message": "User library synced.",
+            "counts": {
+                "top_tracks": len(top_tracks),
+                "liked_tracks": len(liked.items),
+                "recently_played": len(history),
+                "playlists": len(playlists),
+                "playlist_tracks": len(playlist_pairs),
+                "new_tracks": tracks_written
+            },
+            "timings": timings
+        }
+
+    except Exception as e:
+        print("Error in /user/sync:", e)
+        raise HTTPException(status_code=500, detail=str(e))
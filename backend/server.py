@@ -1,12 +1,29 @@
 from fastapi.responses import JSONResponse
 from starlette.middleware.cors import CORSMiddleware
 from fastapi import FastAPI, exceptions
-from routes import admin, user, playlist, recommendations, seeds, stats, tracks
+from contextlib import asynccontextmanager
+from routes import admin, user, playlist, recommendations, seeds, stats, tracks, jobs
+import services.jobs as job_runner
+from services.recently_played_poller import poller as recently_played_poller
+from services.spotify_client import client as spotify_client
+import migrations
 
 description = """
 Our spotify app offers an alternative experienve to enjoying your music.
 """
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if migrations.MIGRATE_ON_STARTUP:
+        migrations.migrate()
+    spotify_client.start()
+    job_runner.start()
+    recently_played_poller.start()
+    yield
+    recently_played_poller.stop()
+    job_runner.shutdown()
+    spotify_client.close()
+
 app = FastAPI(
     title="My Spotify App",
     description=description,
@@ -16,6 +33,7 @@ app = FastAPI(
         "name": "Adrian Elias",
         "email": "ahern388@calpoly.edu",
     },
+    lifespan=lifespan,
 )
 
 origins = ["http://localhost:3000"]
@@ -35,6 +53,7 @@ app.include_router(recommendations.router)
 app.include_router(seeds.router)
 app.include_router(stats.router)
 app.include_router(tracks.router)
+app.include_router(jobs.router)
 
 @app.get("/")
 async def root():
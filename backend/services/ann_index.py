@@ -0,0 +1,252 @@
+"""Approximate nearest-neighbour index over the recommender's feature matrix.
+
+Random-projection LSH for Euclidean distance: each of TABLES tables keys a
+row by HASHES quantized projections, floor((a . x + b) / w), of its
+L2-normalized vector. Between unit vectors, Euclidean distance ranks the
+same as cosine similarity, so the rows nearest the user's normalized
+centroid are the ones the recommender scores highest. Each bucket width is
+a fraction of its projection's spread over the catalog: release year makes
+every track point almost the same way, so sign-only hyperplanes would put
+half the catalog in one bucket.
+
+A query looks up its own bucket in each table, then the neighbouring
+buckets across the boundaries it sits closest to (multi-probe). The union
+is the candidate set the recommender re-ranks exactly, and `probes` is the
+recall-vs-latency knob.
+
+The index follows a feature-matrix generation. Rows appended to the
+matrix are hashed on the next load; a compacted matrix, or one that has
+grown REBUILD_GROWTH times since the last build, gets a fresh build.
+Build ahead of time, or measure recall against exact scoring, from
+backend/ with:
+
+    python -m services.ann_index [--evaluate USERS] [--probes N ...]
+"""
+import functools
+import os
+import threading
+import time
+import dotenv
+import numpy as np
+from services import feature_matrix
+from services.feature_matrix import AUDIO_COLUMNS
+
+dotenv.load_dotenv()
+
+INDEX_DIR = os.environ.get("ANN_INDEX_DIR", os.path.join("data", "ann_index"))
+TABLES = int(os.environ.get("ANN_TABLES", 8))
+HASHES = int(os.environ.get("ANN_HASHES", 6))
+# Bucket width, in standard deviations of each projection over the catalog.
+BUCKET_WIDTH = float(os.environ.get("ANN_BUCKET_WIDTH", 0.25))
+PROBES = int(os.environ.get("ANN_PROBES", 4))
+MAX_PROBES = 256
+SEED = 20240601
+AUDIO = len(AUDIO_COLUMNS)
+HASH_ROWS = 50000
+# Recalibrate bucket widths once the matrix has grown this much since the last build.
+REBUILD_GROWTH = 2.0
+
+_lock = threading.Lock()
+_loaded = None
+
+
+@functools.lru_cache(maxsize=4)
+def _projections(cols: int) -> np.ndarray:
+    """Projection rows for `cols` matrix columns followed by the audio columns."""
+    # Generated row-major from a fixed seed, so the first rows never change as genre columns are added.
+    matrix_part = np.random.default_rng(SEED).standard_normal((cols, TABLES * HASHES), dtype=np.float32)
+    audio_part = np.random.default_rng(SEED + 1).standard_normal((AUDIO, TABLES * HASHES), dtype=np.float32)
+    return np.vstack([matrix_part, audio_part])
+
+
+@functools.lru_cache(maxsize=1)
+def _multipliers() -> np.ndarray:
+    """Odd 64-bit multipliers that fold a table's HASHES buckets into one key."""
+    return np.random.default_rng(SEED).integers(1, 2 ** 63, HASHES, dtype=np.uint64) | np.uint64(1)
+
+
+def _keys(buckets: np.ndarray) -> np.ndarray:
+    """(..., HASHES) integer buckets -> (...) uint64 keys."""
+    return (buckets.astype(np.uint64) * _multipliers()).sum(axis=-1, dtype=np.uint64)
+
+
+class AnnIndex:
+    def __init__(self, generation: int, rows: int, built_rows: int, cols: int, width: np.ndarray,
+                 offset: np.ndarray, keys: np.ndarray, live_rows: np.ndarray):
+        self.generation = generation
+        self.rows = rows
+        self.built_rows = built_rows
+        self.cols = cols  # matrix columns hashed; genres added later are left out until a rebuild
+        self.width = width
+        self.offset = offset
+        self.keys = keys  # one key per table for every matrix row
+        live_keys = keys[live_rows]
+        self._order = []
+        self._sorted = []
+        for t in range(TABLES):
+            order = np.argsort(live_keys[:, t], kind="stable")
+            self._order.append(live_rows[order])
+            self._sorted.append(live_keys[order, t])
+
+    def project(self, vectors) -> np.ndarray:
+        """Projections of normalized vectors, in bucket widths."""
+        return (vectors @ _projections(self.cols) + self.offset) / self.width
+
+    def candidates(self, query: np.ndarray, probes: int = None) -> np.ndarray:
+        """Rows in the `probes` buckets nearest `query`'s direction in each table."""
+        probes = min(max(1, probes or PROBES), MAX_PROBES)
+        query = np.concatenate([query[:self.cols], query[-AUDIO:]])
+        position = self.project(query / (np.linalg.norm(query) or 1)).reshape(TABLES, HASHES)
+        buckets = np.floor(position).astype(np.int64)
+        frac = position - buckets
+
+        # Single steps to a neighbouring bucket: hash i down for i < HASHES, hash i - HASHES up otherwise.
+        step_hash = np.tile(np.arange(HASHES), 2)
+        step_dir = np.repeat([-1, 1], HASHES)
+        n = min(2 * HASHES, int(np.ceil(np.log2(probes))) + 2)
+        subsets = ((np.arange(1 << n)[:, None] >> np.arange(n)) & 1).astype(np.int64)
+
+        found = []
+        for t in range(TABLES):
+            cost = np.concatenate([frac[t], 1 - frac[t]]) ** 2
+            cheapest = np.argsort(cost)[:n]
+            steps = np.zeros((n, HASHES), dtype=np.int64)
+            steps[np.arange(n), step_hash[cheapest]] = step_dir[cheapest]
+            # Subsets of the cheapest steps by total squared distance, never stepping one hash both ways.
+            valid = (subsets @ np.abs(steps)).max(axis=1, initial=0) <= 1
+            order = np.argsort(np.where(valid, subsets @ cost[cheapest], np.inf), kind="stable")
+            probe_keys = _keys(buckets[t] + subsets[order[:min(probes, int(valid.sum()))]] @ steps)
+
+            starts = np.searchsorted(self._sorted[t], probe_keys, side="left")
+            ends = np.searchsorted(self._sorted[t], probe_keys, side="right")
+            found.extend(self._order[t][s:e] for s, e in zip(starts, ends) if e > s)
+        return np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+
+def _projected(features, rows: np.ndarray, cols: int) -> np.ndarray:
+    """Normalized vectors of `rows`, over their first `cols` matrix columns and the audio columns, projected."""
+    projections = _projections(cols)
+    norms = features.norms[rows].copy()
+    norms[norms == 0] = 1
+    projected = np.asarray(features.matrix[rows][:, :cols] @ projections[:cols]) + features.audio[rows] @ projections[cols:]
+    return projected / norms[:, None]
+
+
+def _hash_rows(features, rows: np.ndarray, cols: int, width: np.ndarray, offset: np.ndarray) -> np.ndarray:
+    keys = np.zeros((len(rows), TABLES), dtype=np.uint64)
+    for start in range(0, len(rows), HASH_ROWS):
+        chunk = rows[start:start + HASH_ROWS]
+        buckets = np.floor((_projected(features, chunk, cols) + offset) / width).astype(np.int64)
+        keys[start:start + len(chunk)] = _keys(buckets.reshape(len(chunk), TABLES, HASHES))
+    return keys
+
+
+def build(features) -> AnnIndex:
+    live, cols = features.live_rows, features.matrix.shape[1]
+    # Per-projection spread, from a sample of the catalog.
+    sample = np.sort(np.random.default_rng(SEED).choice(live, min(len(live), HASH_ROWS), replace=False))
+    spread = _projected(features, sample, cols).std(axis=0) if len(sample) else 0
+    width = np.maximum(BUCKET_WIDTH * spread, 1e-6).astype(np.float32)
+    offset = (np.random.default_rng(SEED).random(TABLES * HASHES) * width).astype(np.float32)
+
+    keys = np.zeros((features.rows, TABLES), dtype=np.uint64)
+    keys[live] = _hash_rows(features, live, cols, width, offset)
+    return AnnIndex(features.generation, features.rows, features.rows, cols, width, offset, keys, live)
+
+
+def _extend(index: AnnIndex, features) -> AnnIndex:
+    new_keys = _hash_rows(features, np.arange(index.rows, features.rows), index.cols, index.width, index.offset)
+    return AnnIndex(features.generation, features.rows, index.built_rows, index.cols, index.width, index.offset,
+                    np.concatenate([index.keys, new_keys]), features.live_rows)
+
+
+def _save(index: AnnIndex):
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    path = os.path.join(INDEX_DIR, "index.npz")
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, generation=index.generation, rows=index.rows, built_rows=index.built_rows, cols=index.cols,
+                 shape=(TABLES, HASHES, AUDIO, SEED), width=index.width, offset=index.offset, keys=index.keys)
+    os.replace(path + ".tmp", path)
+
+
+def _read(features):
+    try:
+        with np.load(os.path.join(INDEX_DIR, "index.npz")) as saved:
+            if int(saved["generation"]) != features.generation or tuple(saved["shape"]) != (TABLES, HASHES, AUDIO, SEED):
+                return None
+            rows = min(int(saved["rows"]), features.rows)
+            return AnnIndex(features.generation, rows, int(saved["built_rows"]), int(saved["cols"]), saved["width"],
+                            saved["offset"], saved["keys"][:rows], features.live_rows[features.live_rows < rows])
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
+
+
+def load(features) -> AnnIndex:
+    """The index for this feature matrix, hashing appended rows (or rebuilding) as needed."""
+    global _loaded
+    if features is None:
+        return None
+    with _lock:
+        index = _loaded
+        if index is None or index.generation != features.generation or index.rows > features.rows:
+            index = _read(features)
+        if index is None or features.rows > REBUILD_GROWTH * max(index.built_rows, 1):
+            index = build(features)
+            _save(index)
+        elif index.rows < features.rows:
+            index = _extend(index, features)
+            _save(index)
+        _loaded = index
+        return index
+
+
+def update() -> AnnIndex:
+    """Bring the persisted index up to date with the persisted feature matrix."""
+    return load(feature_matrix.load())
+
+
+def evaluate(users: int = 50, probes_list=(PROBES,), limit: int = 20):
+    """Recall@limit and latency of ANN retrieval against exact scoring, over sample users."""
+    from sqlalchemy import text
+    from database import engine
+    from services import recommender
+
+    features = feature_matrix.current()
+    index = load(features)
+    with engine.begin() as conn:
+        user_ids = conn.execute(text("SELECT id FROM users ORDER BY random() LIMIT :n"), {"n": users}).scalars().all()
+        user_rows = []
+        for uid in user_ids:
+            rows = [features.row_of[t] for t in recommender.user_track_ids(conn, uid) if t in features.row_of]
+            if rows:
+                user_rows.append(rows)
+
+    started = time.perf_counter()
+    exact = [recommender.recommend(features, rows, limit) for rows in user_rows]
+    exact_ms = (time.perf_counter() - started) * 1000 / max(len(user_rows), 1)
+    print(f"users={len(user_rows)} rows={len(features.live_rows)} exact: {exact_ms:.1f} ms/query")
+
+    for probes in probes_list:
+        started = time.perf_counter()
+        approx = [recommender.recommend(features, rows, limit, index=index, probes=probes) for rows in user_rows]
+        ann_ms = (time.perf_counter() - started) * 1000 / max(len(user_rows), 1)
+        # Tracks tied with the exact list's last score count as hits, since ties are ordered arbitrarily.
+        recall = np.mean([
+            sum(score >= e[-1][1] - 1e-6 for _, score in a) / len(e) for a, e in zip(approx, exact) if e
+        ]) if exact else 0.0
+        print(f"probes={probes}: recall@{limit}={recall:.3f} {ann_ms:.1f} ms/query")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the recommender's ANN index or measure its recall.")
+    parser.add_argument("--evaluate", type=int, metavar="USERS", help="compare against exact scoring for this many users")
+    parser.add_argument("--probes", type=int, nargs="+", default=[PROBES], help="probes per table to evaluate")
+    args = parser.parse_args()
+
+    if args.evaluate:
+        evaluate(args.evaluate, args.probes)
+    else:
+        index = update()
+        print(f"ANN index covers {index.rows if index else 0} feature row(s) in {INDEX_DIR}.")
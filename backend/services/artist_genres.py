@@ -0,0 +1,85 @@
+import json
+import os
+from datetime import datetime, timezone
+import dotenv
+from sqlalchemy import text
+from database import engine
+from services import spotify_api
+from services.cache import TTLCache
+
+dotenv.load_dotenv()
+
+CACHE_SIZE = int(os.environ.get("ARTIST_GENRE_CACHE_SIZE", 50000))
+CACHE_TTL = float(os.environ.get("ARTIST_GENRE_CACHE_TTL", 24 * 3600))
+# Rows older than this in the artists table are refetched from Spotify.
+DB_MAX_AGE_DAYS = int(os.environ.get("ARTIST_GENRE_MAX_AGE_DAYS", 30))
+
+_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+
+
+def resolve_artist_genres(access_token: str, artist_ids) -> dict:
+    """Map each artist ID to its genre list.
+
+    Lookups go in-process cache -> `artists` table -> Spotify's multi-artist
+    endpoint (50 IDs per request), and each layer is filled from the one
+    below, so artists we already know cost no network calls.
+    """
+    ids = list(dict.fromkeys(a for a in artist_ids if a))
+    genres_by_artist = {}
+    missing = []
+    for artist_id in ids:
+        genres = _cache.get(artist_id)
+        if genres is None:
+            missing.append(artist_id)
+        else:
+            genres_by_artist[artist_id] = genres
+
+    if missing:
+        with engine.begin() as conn:
+            rows = conn.execute(text("""
+                SELECT id, genres FROM artists
+                WHERE id = ANY(:ids)
+                  AND updated_at > now() - make_interval(days => :max_age)
+            """), {"ids": missing, "max_age": DB_MAX_AGE_DAYS}).fetchall()
+        for artist_id, genres in rows:
+            genres_by_artist[artist_id] = list(genres)
+            _cache.set(artist_id, genres_by_artist[artist_id])
+        missing = [a for a in missing if a not in genres_by_artist]
+
+    if missing:
+        fetched = {
+            artist["id"]: artist
+            for artist in spotify_api.get_artists(access_token, missing)
+            if artist
+        }
+        now = datetime.now(timezone.utc)
+        rows = []
+        for artist_id in missing:
+            # Unknown artists come back as null; remember them with no genres.
+            artist = fetched.get(artist_id, {})
+            genres = artist.get("genres", [])
+            rows.append({"id": artist_id, "name": artist.get("name"), "genres": genres, "updated_at": now})
+            genres_by_artist[artist_id] = genres
+            _cache.set(artist_id, genres)
+
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO artists (id, name, genres, updated_at)
+                VALUES (:id, :name, :genres, :updated_at)
+                ON CONFLICT (id) DO UPDATE SET
+                    name = COALESCE(EXCLUDED.name, artists.name),
+                    genres = EXCLUDED.genres,
+                    updated_at = EXCLUDED.updated_at
+            """), rows)
+
+    return genres_by_artist
+
+
+def track_genres_json(track: dict, genres_by_artist: dict) -> str:
+    """Genres of a track's primary artist, in the JSON form stored in tracks.genres."""
+    artist_id = track["artists"][0]["id"]
+    return json.dumps(genres_by_artist.get(artist_id, []))
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
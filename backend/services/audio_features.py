@@ -0,0 +1,66 @@
+import os
+from datetime import datetime, timedelta, timezone
+import dotenv
+from sqlalchemy import text
+from database import engine
+from services import bulk_write, spotify_api
+from services.feature_matrix import AUDIO_COLUMNS
+
+dotenv.load_dotenv()
+
+# Tracks whose /audio-features request failed are asked for again after this long.
+RETRY_AFTER_HOURS = float(os.environ.get("AUDIO_FEATURES_RETRY_HOURS", 24))
+
+# An audio_features row `a` that needs no fetch: stored, or failed and still backing off.
+SETTLED_SQL = "(a.retry_after IS NULL OR a.retry_after > now())"
+
+# Replaces only rows left by a failed fetch; stored features are never overwritten.
+RETRY_CONFLICT_SQL = f"""
+    ON CONFLICT (track_id) DO UPDATE SET
+        {", ".join(f"{c} = excluded.{c}" for c in (*AUDIO_COLUMNS, "retry_after"))}
+    WHERE audio_features.retry_after IS NOT NULL
+"""
+
+
+def missing_track_ids(conn, track_ids: list) -> list:
+    """The tracks among `track_ids` with no audio_features row yet, or whose failed fetch is due a retry."""
+    return conn.execute(text(f"""
+        SELECT t.id FROM tracks t
+        WHERE t.id = ANY(:ids)
+          AND NOT EXISTS (SELECT 1 FROM audio_features a WHERE a.track_id = t.id AND {SETTLED_SQL})
+    """), {"ids": list(track_ids)}).scalars().all()
+
+
+def ingest(access_token: str, track_ids: list) -> int:
+    """Fetch and store audio features for tracks that don't have them, 100 per request.
+
+    Tracks Spotify has no features for get a row of NULLs, so they aren't
+    asked for again. If the request fails, the tracks get a row of NULLs
+    with retry_after RETRY_AFTER_HOURS ahead and the error is raised.
+    Returns the number of tracks stored with features.
+    """
+    if not track_ids:
+        return 0
+    with engine.begin() as conn:
+        missing = missing_track_ids(conn, track_ids)
+    if not missing:
+        return 0
+
+    try:
+        fetched = {f["id"]: f for f in spotify_api.get_audio_features(access_token, missing) if f}
+    except Exception:
+        retry_after = datetime.now(timezone.utc) + timedelta(hours=RETRY_AFTER_HOURS)
+        with engine.begin() as conn:
+            bulk_write.insert_rows(conn, "audio_features", bulk_write.AUDIO_FEATURE_COLUMNS, [
+                {"track_id": track_id, **{c: None for c in AUDIO_COLUMNS}, "retry_after": retry_after}
+                for track_id in missing
+            ], on_conflict=RETRY_CONFLICT_SQL)
+        raise
+    rows = [
+        {"track_id": track_id, **{c: fetched.get(track_id, {}).get(c) for c in AUDIO_COLUMNS}, "retry_after": None}
+        for track_id in missing
+    ]
+    with engine.begin() as conn:
+        bulk_write.insert_rows(conn, "audio_features", bulk_write.AUDIO_FEATURE_COLUMNS, rows,
+                               on_conflict=RETRY_CONFLICT_SQL)
+    return sum(1 for track_id in missing if track_id in fetched)
@@ -0,0 +1,144 @@
+"""In-memory range index over the catalog's audio features, for target-driven playlists.
+
+Sorted-column index: for each of AUDIO_COLUMNS, the feature matrix's rows
+ordered by that column's value. A query binary-searches every bounded
+column, walks only the narrowest slice, and checks the other bounds on
+those rows' audio values, so it touches a handful of rows instead of the
+catalog. Matches are ranked by distance to the requested targets (or to
+the middle of each range), in units of each column's spread.
+
+The index follows a feature-matrix generation: rows appended as audio
+features are ingested are merged into the sorted columns on the next load,
+superseded rows are masked out, and a compacted matrix gets a fresh build.
+"""
+import threading
+import numpy as np
+from services import feature_matrix
+from services.feature_matrix import AUDIO_COLUMNS, AUDIO_SCALE
+
+_lock = threading.Lock()
+_loaded = None
+
+
+class AudioIndex:
+    def __init__(self, generation: int, rows: int, values: list, order: list, usable: np.ndarray,
+                 spread: np.ndarray):
+        self.generation = generation
+        self.rows = rows
+        self.values = values  # per column, indexed (usable when added) rows' values ascending
+        self.order = order  # per column, the rows in that order
+        self.usable = usable  # rows that are current and have audio features
+        self.spread = spread  # per-column standard deviation, from the last build
+
+    def query(self, audio: np.ndarray, ranges: dict, targets: dict, size: int) -> np.ndarray:
+        """Up to `size` usable rows within `ranges` ({column: (low, high)}), closest to `targets` first.
+
+        Columns are indexes into AUDIO_COLUMNS; a None bound is open. Without
+        targets, rows closest to the middle of each closed range rank first.
+        Without any ranges every usable row is a candidate.
+        """
+        if not targets:
+            targets = {c: (low + high) / 2 for c, (low, high) in ranges.items()
+                       if low is not None and high is not None}
+        slices = {}
+        for column, (low, high) in ranges.items():
+            values = self.values[column]
+            start = 0 if low is None else np.searchsorted(values, low, side="left")
+            end = len(values) if high is None else np.searchsorted(values, high, side="right")
+            slices[column] = (start, end)
+
+        if slices:
+            column, (start, end) = min(slices.items(), key=lambda item: item[1][1] - item[1][0])
+            rows = np.sort(self.order[column][start:end])
+        else:
+            rows = np.arange(self.rows)
+        rows = rows[self.usable[rows]]
+
+        values = np.asarray(audio[rows])
+        keep = np.ones(len(rows), dtype=bool)
+        for c, (low, high) in ranges.items():
+            if low is not None:
+                keep &= values[:, c] >= low
+            if high is not None:
+                keep &= values[:, c] <= high
+        rows, values = rows[keep], values[keep]
+        if not targets:
+            return rows[:size]
+
+        columns = np.array(list(targets), dtype=np.int64)
+        goal = np.array([targets[c] for c in columns], dtype=np.float32)
+        distance = (((values[:, columns] - goal) / self.spread[columns]) ** 2).sum(axis=1)
+        k = min(size, len(rows))
+        if not k:
+            return rows
+        best = np.argpartition(distance, k - 1)[:k]
+        return rows[best[np.lexsort((rows[best], distance[best]))]]
+
+
+def _sorted_columns(audio: np.ndarray, rows: np.ndarray):
+    block = np.asarray(audio[rows])
+    order = [rows[np.argsort(block[:, c], kind="stable")] for c in range(len(AUDIO_COLUMNS))]
+    values = [np.asarray(audio[o, c]) for c, o in enumerate(order)]
+    return values, order
+
+
+def _usable(features, has_features: np.ndarray) -> np.ndarray:
+    # Tracks without stored features are all zeros in the audio block.
+    live = np.zeros(features.rows, dtype=bool)
+    live[features.live_rows] = True
+    return live & has_features
+
+
+def build(features) -> AudioIndex:
+    audio = np.asarray(features.audio)
+    usable = _usable(features, audio.any(axis=1))
+    values, order = _sorted_columns(audio, np.flatnonzero(usable))
+    spread = audio[usable].std(axis=0) if usable.any() else np.ones(len(AUDIO_COLUMNS), dtype=np.float32)
+    spread[spread == 0] = 1
+    return AudioIndex(features.generation, features.rows, values, order, usable, spread)
+
+
+def _extend(index: AudioIndex, features) -> AudioIndex:
+    has_features = np.concatenate([index.usable, np.asarray(features.audio[index.rows:]).any(axis=1)])
+    usable = _usable(features, has_features)
+    # Only the appended usable rows are merged in; rows they supersede stay in the columns, masked by `usable`.
+    new_rows = index.rows + np.flatnonzero(usable[index.rows:])
+    new_values, new_order = _sorted_columns(features.audio, new_rows)
+    values, order = [], []
+    for c in range(len(AUDIO_COLUMNS)):
+        at = np.searchsorted(index.values[c], new_values[c], side="right")
+        values.append(np.insert(index.values[c], at, new_values[c]))
+        order.append(np.insert(index.order[c], at, new_order[c]))
+    return AudioIndex(features.generation, features.rows, values, order, usable, index.spread)
+
+
+def load(features) -> AudioIndex:
+    """The index for this feature matrix, merging in appended rows (or rebuilding) as needed."""
+    global _loaded
+    if features is None:
+        return None
+    with _lock:
+        index = _loaded
+        if index is None or index.generation != features.generation or index.rows > features.rows:
+            index = build(features)
+        elif index.rows < features.rows:
+            index = _extend(index, features)
+        _loaded = index
+        return index
+
+
+def find_tracks(ranges: dict, targets: dict, size: int) -> list:
+    """Track ids for AudioIndex.query, with columns given by name ({"tempo": (120, 130)}, {"energy": 0.8}).
+
+    Bounds and targets are raw feature values; they're scaled like the feature matrix's audio block.
+    """
+    features = feature_matrix.current()
+    index = load(features)
+    if index is None:
+        return []
+    column = {name: c for c, name in enumerate(AUDIO_COLUMNS)}
+    scaled = {column[name]: tuple(None if b is None else b / AUDIO_SCALE[column[name]] for b in bounds)
+              for name, bounds in ranges.items()}
+    rows = index.query(features.audio, scaled,
+                       {column[name]: target / AUDIO_SCALE[column[name]] for name, target in targets.items()}, size)
+    return [features.track_ids[row] for row in rows]
@@ -0,0 +1,146 @@
+import os
+import dotenv
+from sqlalchemy import text
+
+dotenv.load_dotenv()
+
+BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", 1000))
+
+TRACK_COLUMNS = {"id": "text", "name": "text", "artist": "text", "album": "text", "uri": "text"}
+TRACK_METADATA_COLUMNS = {**TRACK_COLUMNS, "popularity": "integer", "release_date": "text", "genres": "text"}
+USER_TOP_TRACK_COLUMNS = {"user_id": "uuid", "track_id": "text", "rank": "integer"}
+USER_LIKED_TRACK_COLUMNS = {"user_id": "uuid", "track_id": "text", "liked_at": "timestamptz"}
+STREAM_HISTORY_COLUMNS = {"user_id": "uuid", "track_id": "text", "played_at": "timestamptz"}
+PLAYLIST_COLUMNS = {"id": "text", "user_id": "uuid", "name": "text", "is_public": "boolean", "snapshot_id": "text"}
+PLAYLIST_TRACK_COLUMNS = {"playlist_id": "text", "track_id": "text", "added_at": "timestamptz"}
+AUDIO_FEATURE_COLUMNS = {"track_id": "text", "danceability": "double precision", "energy": "double precision",
+                         "tempo": "double precision", "valence": "double precision",
+                         "acousticness": "double precision", "instrumentalness": "double precision",
+                         "retry_after": "timestamptz"}
+USER_RECOMMENDATION_COLUMNS = {"user_id": "uuid", "rank": "smallint", "track_id": "text", "score": "real", "import_version": "bigint"}
+ALBUM_COLUMNS = {"id": "text", "name": "text", "release_date": "text", "total_tracks": "integer"}
+TRACK_ENRICHMENT_COLUMNS = {"id": "text", "popularity": "integer", "release_date": "text", "genres": "text"}
+
+
+def track_row(track: dict) -> dict:
+    """Row for the tracks table from a Spotify track object, or None for local/unavailable tracks."""
+    if not track or not track.get("id"):
+        return None
+    return {
+        "id": track["id"],
+        "name": track["name"],
+        "artist": track["artists"][0]["name"],
+        "album": track["album"]["name"],
+        "uri": track["uri"],
+    }
+
+
+def track_metadata_row(track: dict, genres: str) -> dict:
+    row = track_row(track)
+    if row is None:
+        return None
+    row["popularity"] = track.get("popularity")
+    row["release_date"] = track.get("album", {}).get("release_date")
+    row["genres"] = genres
+    return row
+
+
+def dedupe(rows, key):
+    """Drop rows repeating an earlier row's key columns (first one wins)."""
+    seen = set()
+    unique = []
+    for row in rows:
+        k = tuple(row[c] for c in key)
+        if k not in seen:
+            seen.add(k)
+            unique.append(row)
+    return unique
+
+
+def insert_rows(conn, table: str, columns: dict, rows: list,
+                on_conflict: str = "ON CONFLICT DO NOTHING", batch_size: int = None) -> int:
+    """Insert `rows` with one statement per batch instead of one per row.
+
+    Each batch is sent as one array per column and expanded server side with
+    `unnest`, so a batch costs a single round trip and a single plan.
+    `columns` maps column names to their Postgres types. Returns the number
+    of rows actually written.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    names = list(columns)
+    arrays = ", ".join(f"CAST(:{c} AS {t}[])" for c, t in columns.items())
+    stmt = text(f"""
+        INSERT INTO {table} ({", ".join(names)})
+        SELECT * FROM unnest({arrays})
+        {on_conflict}
+    """)
+
+    written = 0
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        result = conn.execute(stmt, {c: [row[c] for row in batch] for c in names})
+        written += result.rowcount
+    return written
+
+
+def update_rows(conn, table: str, key: str, columns: dict, rows: list, batch_size: int = None) -> int:
+    """Update existing rows matched on `key` with one statement per batch.
+
+    Like insert_rows, each batch is sent as one array per column (`columns`
+    includes `key`) and joined back with `UPDATE ... FROM unnest(...)`.
+    Returns the number of rows updated.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    names = list(columns)
+    arrays = ", ".join(f"CAST(:{c} AS {t}[])" for c, t in columns.items())
+    stmt = text(f"""
+        UPDATE {table} AS t
+        SET {", ".join(f"{c} = v.{c}" for c in names if c != key)}
+        FROM unnest({arrays}) AS v({", ".join(names)})
+        WHERE t.{key} = v.{key}
+    """)
+
+    updated = 0
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        result = conn.execute(stmt, {c: [row[c] for row in batch] for c in names})
+        updated += result.rowcount
+    return updated
+
+
+def insert_tracks(conn, rows: list, columns: dict = TRACK_COLUMNS, batch_size: int = None) -> int:
+    rows = dedupe([r for r in rows if r], ("id",))
+    return insert_rows(conn, "tracks", columns, rows, "ON CONFLICT (id) DO NOTHING", batch_size)
+
+
+def upsert_playlists(conn, user_uuid: str, playlists: list, batch_size: int = None) -> int:
+    """Insert or refresh playlist rows from Spotify playlist objects, including their snapshot_id."""
+    rows = dedupe([{
+        "id": pl["id"],
+        "user_id": user_uuid,
+        "name": pl["name"],
+        "is_public": pl["public"],
+        "snapshot_id": pl["snapshot_id"]
+    } for pl in playlists], ("id",))
+    return insert_rows(conn, "playlists", PLAYLIST_COLUMNS, rows, """
+        ON CONFLICT (id) DO UPDATE
+        SET name = EXCLUDED.name,
+            is_public = EXCLUDED.is_public,
+            snapshot_id = EXCLUDED.snapshot_id
+    """, batch_size)
+
+
+def insert_playlist_items(conn, playlist_items: list, batch_size: int = None, with_tracks: bool = True) -> int:
+    """Write (playlist_id, item) pairs, where item is a Spotify playlist-track object.
+
+    Local and unavailable tracks are skipped. Pass `with_tracks=False` when
+    the tracks rows were already written. Returns the number of new
+    playlist_tracks rows.
+    """
+    playlist_items = [(pid, item) for pid, item in playlist_items if track_row(item.get("track"))]
+    if with_tracks:
+        insert_tracks(conn, [track_row(item["track"]) for _, item in playlist_items], batch_size=batch_size)
+    return insert_rows(conn, "playlist_tracks", PLAYLIST_TRACK_COLUMNS, [
+        {"playlist_id": pid, "track_id": item["track"]["id"], "added_at": item.get("added_at")}
+        for pid, item in playlist_items
+    ], batch_size=batch_size)
@@ -0,0 +1,284 @@
+"""Item x item co-occurrence matrix for the collaborative recommender.
+
+A basket is one playlist's tracks or one user's liked tracks (the newest
+MAX_BASKET_TRACKS of either). B is the binary basket x track matrix and
+the co-occurrence matrix is C = B^T B: C[i, j] counts the baskets holding
+both tracks, and the diagonal counts each track's baskets. A user's scores
+are C times their track indicator vector, cosine-normalized by the
+diagonal, so one sparse matrix-vector product scores the catalog.
+
+Triggers (migration 11) log every basket whose tracks change in
+basket_changes. A refresh claims the logged entries, re-reads only those
+baskets and applies C += B_new^T B_new - B_old^T B_old against the
+basket rows saved last time. The claim commits after the new matrix is
+saved; re-applying a basket is a no-op, so a crash in between is
+harmless. Both matrices are saved under COOCCURRENCE_DIR, and writers
+serialize on a Postgres advisory lock. Rebuild from backend/ with:
+
+    python -m services.cooccurrence [--full]
+"""
+import json
+import os
+import threading
+from typing import NamedTuple
+import dotenv
+import numpy as np
+from scipy import sparse
+from sqlalchemy import text
+from database import engine
+from services import recommender
+
+dotenv.load_dotenv()
+
+MATRIX_DIR = os.environ.get("COOCCURRENCE_DIR", os.path.join("data", "cooccurrence"))
+MAX_BASKET_TRACKS = int(os.environ.get("COOCCURRENCE_MAX_BASKET_TRACKS", 500))
+FETCH_ROWS = 10000
+LOCK_KEY = 4_172_031_963
+
+BASKET_TRACKS_SQL = """
+    SELECT basket, track_id FROM (
+        SELECT 'playlist:' || playlist_id AS basket, track_id,
+               row_number() OVER (PARTITION BY playlist_id ORDER BY added_at DESC NULLS LAST, track_id) AS n
+        FROM playlist_tracks
+        WHERE :all OR playlist_id = ANY(:playlists)
+        UNION ALL
+        SELECT 'liked:' || user_id, track_id,
+               row_number() OVER (PARTITION BY user_id ORDER BY liked_at DESC NULLS LAST, track_id)
+        FROM user_liked_tracks
+        WHERE :all OR user_id = ANY(CAST(:users AS uuid[]))
+    ) b
+    WHERE n <= :max_tracks
+"""
+
+
+class Cooccurrence(NamedTuple):
+    counts: sparse.csr_matrix  # (tracks, tracks) float32, symmetric
+    baskets: sparse.csr_matrix  # (baskets, tracks) binary, as of the last refresh
+    track_ids: list  # track id of each row/column
+    column_of: dict  # track id -> its row/column
+    basket_keys: list  # key of each basket row
+    version: int
+
+
+_write_lock = threading.Lock()
+_load_lock = threading.Lock()
+_loaded = None
+
+
+def _path(version: int) -> str:
+    return os.path.join(MATRIX_DIR, f"cooccurrence.{version}.npz")
+
+
+def _read_manifest():
+    try:
+        with open(os.path.join(MATRIX_DIR, "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _save(matrix: Cooccurrence):
+    os.makedirs(MATRIX_DIR, exist_ok=True)
+    with open(_path(matrix.version), "wb") as f:
+        np.savez(f, counts_data=matrix.counts.data, counts_indices=matrix.counts.indices,
+                 counts_indptr=matrix.counts.indptr, baskets_indices=matrix.baskets.indices,
+                 baskets_indptr=matrix.baskets.indptr, track_ids=np.array(matrix.track_ids, dtype=str),
+                 basket_keys=np.array(matrix.basket_keys, dtype=str))
+        f.flush()
+        os.fsync(f.fileno())
+    path = os.path.join(MATRIX_DIR, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump({"version": matrix.version, "tracks": len(matrix.track_ids), "baskets": len(matrix.basket_keys)}, f)
+    os.replace(path + ".tmp", path)
+    try:
+        os.remove(_path(matrix.version - 1))
+    except OSError:
+        pass
+
+
+def load() -> Cooccurrence:
+    """The saved matrix; None until the first refresh."""
+    global _loaded
+    with _load_lock:
+        manifest = _read_manifest()
+        if manifest is None:
+            return None
+        if _loaded is not None and _loaded.version == manifest["version"]:
+            return _loaded
+
+        with np.load(_path(manifest["version"])) as saved:
+            track_ids = saved["track_ids"].tolist()
+            basket_keys = saved["basket_keys"].tolist()
+            counts = sparse.csr_matrix((saved["counts_data"], saved["counts_indices"], saved["counts_indptr"]),
+                                       shape=(len(track_ids), len(track_ids)))
+            indices = saved["baskets_indices"]
+            baskets = sparse.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, saved["baskets_indptr"]),
+                                        shape=(len(basket_keys), len(track_ids)))
+        _loaded = Cooccurrence(counts, baskets, track_ids, {tid: i for i, tid in enumerate(track_ids)},
+                               basket_keys, manifest["version"])
+        return _loaded
+
+
+def _read_baskets(conn, baskets: list = None) -> dict:
+    """basket key -> its track ids, for `baskets` (default: every basket)."""
+    kinds = {"playlist": [], "liked": []}
+    for key in baskets or ():
+        kind, _, basket_id = key.partition(":")
+        kinds[kind].append(basket_id)
+    result = conn.execution_options(stream_results=True, max_row_buffer=FETCH_ROWS).execute(
+        text(BASKET_TRACKS_SQL),
+        {"all": baskets is None, "playlists": kinds["playlist"], "users": kinds["liked"],
+         "max_tracks": MAX_BASKET_TRACKS}
+    )
+    contents = {key: [] for key in baskets or ()}
+    for batch in iter(lambda: result.fetchmany(FETCH_ROWS), []):
+        for basket, track_id in batch:
+            contents.setdefault(basket, []).append(track_id)
+    return contents
+
+
+def _basket_rows(contents: dict, track_ids: list, column_of: dict) -> sparse.csr_matrix:
+    """Binary rows for `contents`' baskets, in its order, adding unseen tracks to `track_ids`/`column_of`."""
+    columns = []
+    for tracks in contents.values():
+        for tid in tracks:
+            if tid not in column_of:
+                column_of[tid] = len(track_ids)
+                track_ids.append(tid)
+            columns.append(column_of[tid])
+    lengths = [len(tracks) for tracks in contents.values()]
+    indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    rows = sparse.csr_matrix((np.ones(len(columns), dtype=np.float32), np.array(columns, dtype=np.int64), indptr),
+                             shape=(len(contents), len(track_ids)))
+    rows.sum_duplicates()
+    return rows
+
+
+def _resized(matrix: sparse.csr_matrix, shape: tuple) -> sparse.csr_matrix:
+    matrix = matrix.copy()
+    matrix.resize(shape)
+    return matrix
+
+
+def _rebuild(conn, previous: Cooccurrence) -> Cooccurrence:
+    conn.execute(text("DELETE FROM basket_changes"))
+    contents = _read_baskets(conn)
+    track_ids, column_of = [], {}
+    baskets = _basket_rows(contents, track_ids, column_of)
+    counts = (baskets.T @ baskets).tocsr().astype(np.float32)
+    matrix = Cooccurrence(counts, baskets, track_ids, column_of, list(contents),
+                          previous.version + 1 if previous else 0)
+    _save(matrix)
+    conn.commit()
+    return matrix
+
+
+def _apply(conn, current: Cooccurrence) -> int:
+    # Claimed in this transaction, which commits after the new matrix is saved.
+    changed = conn.execute(text("DELETE FROM basket_changes RETURNING basket")).scalars().all()
+    if not changed:
+        conn.commit()
+        return 0
+    contents = _read_baskets(conn, list(dict.fromkeys(changed)))
+
+    track_ids, column_of = list(current.track_ids), dict(current.column_of)
+    new_rows = _basket_rows(contents, track_ids, column_of)
+    n = len(track_ids)
+
+    basket_keys = list(current.basket_keys)
+    row_of = {key: i for i, key in enumerate(basket_keys)}
+    for key in contents:
+        if key not in row_of:
+            row_of[key] = len(basket_keys)
+            basket_keys.append(key)
+    baskets = _resized(current.baskets, (len(basket_keys), n))
+    positions = np.array([row_of[key] for key in contents], dtype=np.int64)
+    old_rows = baskets[positions]
+
+    counts = _resized(current.counts, (n, n)) + (new_rows.T @ new_rows) - (old_rows.T @ old_rows)
+    counts.eliminate_zeros()
+
+    # Swap the changed baskets' rows for their new contents.
+    keep = sparse.diags(np.isin(np.arange(len(basket_keys)), positions, invert=True).astype(np.float32))
+    placed = sparse.csr_matrix((np.ones(len(positions), dtype=np.float32), (positions, np.arange(len(positions)))),
+                               shape=(len(basket_keys), len(positions)))
+    baskets = (keep @ baskets + placed @ new_rows).tocsr()
+    baskets.eliminate_zeros()
+
+    _save(Cooccurrence(counts.tocsr().astype(np.float32), baskets, track_ids, column_of, basket_keys,
+                       current.version + 1))
+    conn.commit()
+    return len(contents)
+
+
+def refresh(wait: bool = True, full: bool = False) -> int:
+    """Apply logged basket changes (or rebuild); returns the number of baskets re-read.
+
+    With `wait=False`, returns -1 right away if another writer, in this
+    process or another, holds the lock.
+    """
+    if not _write_lock.acquire(blocking=wait):
+        return -1
+    try:
+        return _refresh(wait, full)
+    finally:
+        _write_lock.release()
+
+
+def _refresh(wait: bool, full: bool) -> int:
+    with engine.connect() as conn:
+        if wait:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+        elif not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": LOCK_KEY}).scalar():
+            return -1
+        conn.commit()
+        try:
+            current = load()
+            if current is None or full:
+                return len(_rebuild(conn, current).basket_keys)
+            return _apply(conn, current)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+            conn.commit()
+
+
+def current() -> Cooccurrence:
+    """The saved matrix, built first if there is none.
+
+    Requests only read it: the import routes and jobs that change baskets
+    apply their changes with refresh().
+    """
+    if _read_manifest() is None:
+        refresh()
+    return load()
+
+
+def recommend(matrix: Cooccurrence, user_track_ids: list, limit: int, offset: int = 0) -> list:
+    """Top unseen tracks co-occurring with the user's tracks, as (track_id, score) pairs.
+
+    A track scores the sum of its cosine similarities, C[i, j] / sqrt(C[i, i] C[j, j]),
+    to the user's tracks. Tracks sharing no basket with them are left out.
+    """
+    columns = np.unique([matrix.column_of[t] for t in user_track_ids if t in matrix.column_of])
+    if not len(columns):
+        return []
+    occurrences = np.sqrt(matrix.counts.diagonal())
+    occurrences[occurrences == 0] = 1
+    weights = np.zeros(len(matrix.track_ids), dtype=np.float32)
+    weights[columns] = 1 / occurrences[columns]
+
+    scores = (matrix.counts @ weights) / occurrences
+    scores[columns] = 0
+    candidates = np.flatnonzero(scores > 0)
+    return [(matrix.track_ids[c], score)
+            for c, score in recommender.top_k(candidates, scores[candidates], limit, offset)]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or update the co-occurrence recommender's matrix.")
+    parser.add_argument("--full", action="store_true", help="rebuild the matrix from scratch")
+    args = parser.parse_args()
+
+    print(f"Re-read {refresh(full=args.full)} basket(s) into {MATRIX_DIR}.")
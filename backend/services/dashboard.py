@@ -0,0 +1,99 @@
+import os
+import dotenv
+from sqlalchemy import text
+from database import engine
+from services.cache import TTLCache
+
+dotenv.load_dotenv()
+
+CACHE_SIZE = int(os.environ.get("DASHBOARD_CACHE_SIZE", 1000))
+# Entries are keyed on the data version, so the TTL only bounds memory held by idle users.
+CACHE_TTL = float(os.environ.get("DASHBOARD_CACHE_TTL", 6 * 60 * 60))
+
+_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+
+DASHBOARD_SQL = """
+    SELECT
+        u.data_version,
+        (
+            SELECT coalesce(json_agg(json_build_array(name, tracks) ORDER BY tracks DESC, name), '[]')
+            FROM (
+                SELECT g.name, c.tracks
+                FROM user_genre_counts c
+                JOIN genres g ON g.id = c.genre_id
+                WHERE c.user_id = u.id
+                ORDER BY c.tracks DESC, g.name
+                LIMIT 10
+            ) top
+        ),
+        (
+            SELECT coalesce(json_agg(json_build_array(artist, tracks) ORDER BY tracks DESC, artist), '[]')
+            FROM (
+                SELECT artist, tracks
+                FROM user_artist_counts
+                WHERE user_id = u.id
+                ORDER BY tracks DESC, artist
+                LIMIT 10
+            ) top
+        ),
+        (
+            SELECT coalesce(json_agg(json_build_array(release_year, tracks, popularity_sum) ORDER BY release_year DESC), '[]')
+            FROM user_year_counts
+            WHERE user_id = u.id
+        ),
+        (SELECT count(*) FROM user_genre_counts WHERE user_id = u.id AND summary_tracks > 0)
+    FROM users u
+    WHERE u.id = :uid
+"""
+
+
+def _track_summary(release_years: list, genre_diversity: int) -> dict:
+    if not release_years:
+        return {"message": "No track data available for summary."}
+
+    total_tracks = sum(count for _, count, _ in release_years)
+    total_popularity = sum(popularity for _, _, popularity in release_years)
+    return {
+        "average_popularity": round(total_popularity / total_tracks, 2),
+        "release_year_distribution": {str(year): count for year, count, _ in release_years},
+        "genre_diversity": genre_diversity,
+        "total_unique_tracks": total_tracks
+    }
+
+
+def get_dashboard(user_uuid: str) -> dict:
+    """Top genres, top artists and the track summary for one user, from one query.
+
+    Every change to a user's stats rollups bumps users.data_version, so a
+    cached result stays valid until new data lands; a repeat view costs a
+    single primary-key lookup.
+    """
+    with engine.begin() as conn:
+        version = conn.execute(text("SELECT data_version FROM users WHERE id = :uid"),
+                               {"uid": user_uuid}).scalar()
+        cached = _cache.get((user_uuid, version)) if version is not None else None
+        if cached is not None:
+            return cached
+        row = conn.execute(text(DASHBOARD_SQL), {"uid": user_uuid}).fetchone()
+
+    if row is None:
+        return {"top_genres": [], "top_artists": [], "track_summary": _track_summary([], 0), "data_version": None}
+
+    version, top_genres, top_artists, release_years, genre_diversity = row
+    dashboard = {
+        "top_genres": top_genres,
+        "top_artists": top_artists,
+        "track_summary": _track_summary(release_years, genre_diversity),
+        "data_version": version
+    }
+    _cache.set((user_uuid, version), dashboard)
+    return dashboard
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
+
+
+def clear_cache():
+    """Forget every cached dashboard, e.g. after a reset restarts users' data versions at 0."""
+    _cache.clear()
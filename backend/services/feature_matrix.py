@@ -0,0 +1,349 @@
+"""Persistent sparse feature matrix for the content-based recommender.
+
+One CSR row per track: popularity in column 0, release year in column 1
+and a one-hot genre in column FIXED_COLUMNS + genres.id, so columns never
+need remapping as genres are added. Each row also has a dense float32 row
+of AUDIO_COLUMNS divided by AUDIO_SCALE (zeros until the track's audio
+features are stored); a track's full vector is its sparse row followed
+by its audio row. The arrays live in flat files under MATRIX_DIR that
+requests memory-map, next to a manifest that says how much of each file
+is valid.
+
+Updates are append-only. Triggers (migration 13) log every track whose
+features change in track_feature_changes. A refresh drains the log in a
+transaction that commits only after the manifest is written, so each
+change is picked up once its own transaction commits, whatever its
+sequence value. Changed tracks get a new row at the end, and the
+id -> row map points at the newest one. Once superseded rows make up
+COMPACT_RATIO of the matrix, the files are rewritten as a new
+generation. Writers serialize on a Postgres advisory lock, so several
+server processes can share the directory.
+"""
+import json
+import os
+import threading
+from typing import NamedTuple
+import dotenv
+import numpy as np
+from scipy import sparse
+from sqlalchemy import text
+from database import engine
+
+dotenv.load_dotenv()
+
+MATRIX_DIR = os.environ.get("FEATURE_MATRIX_DIR", os.path.join("data", "feature_matrix"))
+# Rewrite the files once this share of rows has been superseded.
+COMPACT_RATIO = float(os.environ.get("FEATURE_MATRIX_COMPACT_RATIO", 0.25))
+FETCH_ROWS = 10000
+
+FIXED_COLUMNS = 2  # popularity, release year
+AUDIO_COLUMNS = ("danceability", "energy", "tempo", "valence", "acousticness", "instrumentalness")
+# Stored audio values are divided by these so each column spans about 0..1; raw BPM would outweigh the rest.
+AUDIO_SCALE = np.array([250.0 if c == "tempo" else 1.0 for c in AUDIO_COLUMNS], dtype=np.float32)
+LOCK_KEY = 4_172_031_962
+FILES = ("indptr", "indices", "data", "audio", "track_ids")
+# Bumped when the manifest's meaning changes; older matrices are rebuilt.
+# 2: synced from track_feature_changes. 3: audio divided by AUDIO_SCALE.
+FORMAT = 3
+
+FEATURE_SQL = f"""
+    SELECT t.id, t.popularity, t.release_year, t.genre_ids, {", ".join(f"a.{c}" for c in AUDIO_COLUMNS)}, t.feature_seq
+    FROM tracks t
+    LEFT JOIN audio_features a ON a.track_id = t.id
+"""
+
+
+class FeatureMatrix(NamedTuple):
+    matrix: sparse.csr_matrix  # every row written, including superseded ones
+    audio: np.ndarray  # (rows, len(AUDIO_COLUMNS)) float32, aligned with `matrix`
+    track_ids: list  # track id of each row
+    row_of: dict  # track id -> its current row
+    live_rows: np.ndarray  # current rows, ascending
+    norms: np.ndarray  # L2 norm of every row
+    generation: int
+    rows: int
+    ids_bytes: int
+
+
+_write_lock = threading.Lock()
+_load_lock = threading.Lock()
+_loaded = None
+
+
+def _path(generation: int, name: str) -> str:
+    return os.path.join(MATRIX_DIR, f"{name}.{generation}")
+
+
+def _read_manifest():
+    try:
+        with open(os.path.join(MATRIX_DIR, "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(manifest: dict):
+    path = os.path.join(MATRIX_DIR, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def track_features(popularity, release_year, genre_ids):
+    """(indices, data) of one track's row."""
+    indices = []
+    data = []
+    if popularity:
+        indices.append(0)
+        data.append(popularity)
+    if release_year:
+        indices.append(1)
+        data.append(release_year)
+    for g in sorted(set(genre_ids or ())):
+        indices.append(FIXED_COLUMNS + g)
+        data.append(1.0)
+    return np.array(indices, dtype=np.int32), np.array(data, dtype=np.float32)
+
+
+def audio_block(rows) -> np.ndarray:
+    """(len(rows), len(AUDIO_COLUMNS)) float32 block from rows of raw audio values, scaled; missing values are 0."""
+    return np.nan_to_num(np.array(rows, dtype=np.float32).reshape(-1, len(AUDIO_COLUMNS))) / AUDIO_SCALE
+
+
+def _row_norms(matrix: sparse.csr_matrix, audio: np.ndarray) -> np.ndarray:
+    squares = np.asarray(matrix.multiply(matrix).sum(axis=1), dtype=np.float32).ravel()
+    return np.sqrt(squares + np.einsum("ij,ij->i", audio, audio))
+
+
+def dot(features: FeatureMatrix, dense: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+    """Feature vectors of `rows` (default: every row) times `dense`.
+
+    `dense`'s first axis covers the matrix columns followed by the audio
+    columns, like a track's full vector; the two blocks are multiplied
+    separately instead of being stacked into one matrix.
+    """
+    cols = features.matrix.shape[1]
+    matrix = features.matrix if rows is None else features.matrix[rows]
+    audio = features.audio if rows is None else features.audio[rows]
+    return np.asarray(matrix @ dense[:cols]) + audio @ dense[cols:]
+
+
+def weighted_sum(features: FeatureMatrix, weights: sparse.csr_matrix) -> np.ndarray:
+    """weights (k x rows) times the rows' full vectors, as a dense (k, cols + audio columns) array."""
+    return np.hstack([(weights @ features.matrix).toarray(), weights @ features.audio]).astype(np.float32)
+
+
+def _memmap(path: str, dtype, count: int, width: int = None):
+    shape = (count,) if width is None else (count, width)
+    if count == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+def load() -> FeatureMatrix:
+    """The current matrix, memory-mapped; None until the first refresh."""
+    global _loaded
+    with _load_lock:
+        manifest = _read_manifest()
+        if manifest is None:
+            return None
+        generation, rows = manifest["generation"], manifest["rows"]
+
+        loaded = _loaded
+        if loaded is not None and (loaded.generation, loaded.rows) == (generation, rows):
+            return loaded
+        if loaded is not None and loaded.generation == generation and loaded.rows < rows:
+            # Same files with rows appended: only read the new ids. Copy so
+            # requests still holding the previous matrix see a consistent map.
+            track_ids, row_of, offset = list(loaded.track_ids), dict(loaded.row_of), loaded.ids_bytes
+            known_norms = loaded.norms
+        else:
+            track_ids, row_of, offset = [], {}, 0
+            known_norms = np.zeros(0, dtype=np.float32)
+
+        with open(_path(generation, "track_ids"), "rb") as f:
+            f.seek(offset)
+            new_ids = f.read(manifest["ids_bytes"] - offset).decode().split("\n")[:-1]
+        for tid in new_ids:
+            row_of[tid] = len(track_ids)
+            track_ids.append(tid)
+
+        matrix = sparse.csr_matrix((
+            _memmap(_path(generation, "data"), np.float32, manifest["nnz"]),
+            _memmap(_path(generation, "indices"), np.int32, manifest["nnz"]),
+            _memmap(_path(generation, "indptr"), np.int32, rows + 1),
+        ), shape=(rows, manifest["cols"]), copy=False)
+        if "audio_columns" in manifest:
+            audio = _memmap(_path(generation, "audio"), np.float32, rows, len(AUDIO_COLUMNS))
+        else:
+            audio = np.zeros((rows, len(AUDIO_COLUMNS)), dtype=np.float32)  # written before audio features; rebuilt on the next refresh
+        live_rows = np.fromiter(sorted(row_of.values()), dtype=np.int64, count=len(row_of))
+        norms = np.concatenate([known_norms, _row_norms(matrix[len(known_norms):], audio[len(known_norms):])])
+
+        _loaded = FeatureMatrix(matrix, audio, track_ids, row_of, live_rows, norms, generation, rows, manifest["ids_bytes"])
+        return _loaded
+
+
+def _same_row(current: FeatureMatrix, track_id: str, indices, data, audio) -> bool:
+    if current is None or track_id not in current.row_of:
+        return False
+    row = current.row_of[track_id]
+    start, end = current.matrix.indptr[row], current.matrix.indptr[row + 1]
+    return (np.array_equal(current.matrix.indices[start:end], indices)
+            and np.array_equal(current.matrix.data[start:end], data)
+            and np.array_equal(current.audio[row], audio))
+
+
+def _append(manifest: dict, rows: list) -> dict:
+    """Append (track_id, indices, data, audio) rows to the manifest's generation and return the new manifest."""
+    generation = manifest["generation"]
+    # Drop anything a crashed writer appended past the manifest.
+    for name, size in (("indptr", 4 * (manifest["rows"] + 1)), ("indices", 4 * manifest["nnz"]),
+                       ("data", 4 * manifest["nnz"]), ("audio", 4 * len(AUDIO_COLUMNS) * manifest["rows"]),
+                       ("track_ids", manifest["ids_bytes"])):
+        with open(_path(generation, name), "r+b") as f:
+            f.truncate(size)
+
+    lengths = np.array([len(indices) for _, indices, _, _ in rows], dtype=np.int64)
+    nnz = manifest["nnz"] + int(lengths.sum())
+    if nnz >= 2 ** 31:
+        raise OverflowError("Feature matrix exceeds int32 indexing; raise COMPACT_RATIO or shard it.")
+    ids_blob = "".join(f"{tid}\n" for tid, _, _, _ in rows).encode()
+
+    with open(_path(generation, "indptr"), "ab") as f:
+        f.write((manifest["nnz"] + np.cumsum(lengths)).astype(np.int32).tobytes())
+    with open(_path(generation, "indices"), "ab") as f:
+        for _, indices, _, _ in rows:
+            f.write(indices.tobytes())
+    with open(_path(generation, "data"), "ab") as f:
+        for _, _, data, _ in rows:
+            f.write(data.tobytes())
+    with open(_path(generation, "audio"), "ab") as f:
+        f.write(np.stack([audio for _, _, _, audio in rows]).astype(np.float32).tobytes())
+    with open(_path(generation, "track_ids"), "ab") as f:
+        f.write(ids_blob)
+
+    max_col = max((int(indices[-1]) for _, indices, _, _ in rows if len(indices)), default=-1)
+    return {
+        **manifest,
+        "rows": manifest["rows"] + len(rows),
+        "nnz": nnz,
+        "cols": max(manifest["cols"], max_col + 1),
+        "ids_bytes": manifest["ids_bytes"] + len(ids_blob),
+    }
+
+
+def _rebuild(conn, previous: dict) -> dict:
+    generation = previous["generation"] + 1 if previous else 0
+    os.makedirs(MATRIX_DIR, exist_ok=True)
+    for name in FILES:
+        with open(_path(generation, name), "wb") as f:
+            if name == "indptr":
+                f.write(np.zeros(1, dtype=np.int32).tobytes())
+
+    manifest = {"format": FORMAT, "generation": generation, "rows": 0, "nnz": 0, "cols": FIXED_COLUMNS,
+                "audio_columns": len(AUDIO_COLUMNS), "ids_bytes": 0, "superseded": 0}
+    # Everything logged so far is covered by the full read below; the caller commits after the manifest.
+    conn.execute(text("DELETE FROM track_feature_changes"))
+    result = conn.execution_options(stream_results=True, max_row_buffer=FETCH_ROWS).execute(
+        text(FEATURE_SQL + " ORDER BY t.feature_seq")
+    )
+    while True:
+        batch = result.fetchmany(FETCH_ROWS)
+        if not batch:
+            break
+        audio = audio_block([row[4:-1] for row in batch])
+        manifest = _append(manifest, [(row[0], *track_features(*row[1:4]), a) for row, a in zip(batch, audio)])
+    _write_manifest(manifest)
+
+    if previous:
+        for name in FILES:
+            try:
+                os.remove(_path(previous["generation"], name))
+            except OSError:
+                pass  # still mapped by a reader on a platform that forbids unlinking open files
+    return manifest
+
+
+def refresh(wait: bool = True, full: bool = False) -> int:
+    """Bring the matrix up to date with `tracks`; returns the number of rows written.
+
+    With `wait=False`, returns -1 right away if another writer, in this
+    process or another, holds the lock.
+    """
+    if not _write_lock.acquire(blocking=wait):
+        return -1
+    try:
+        return _refresh(wait, full)
+    finally:
+        _write_lock.release()
+
+
+def _refresh(wait: bool, full: bool) -> int:
+    with engine.connect() as conn:
+        if wait:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+        elif not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": LOCK_KEY}).scalar():
+            return -1
+        conn.commit()
+        try:
+            manifest = _read_manifest()
+            if (manifest is None or full or manifest.get("format") != FORMAT
+                    or manifest.get("audio_columns") != len(AUDIO_COLUMNS)):
+                rows = _rebuild(conn, manifest)["rows"]
+                conn.commit()
+                return rows
+
+            # Claimed in this transaction, which commits once the manifest is written;
+            # rows re-read after a crash in between match the matrix and are skipped.
+            track_ids = conn.execute(text("DELETE FROM track_feature_changes RETURNING track_id")).scalars().all()
+            changed = conn.execute(text(FEATURE_SQL + " WHERE t.id = ANY(:ids) ORDER BY t.feature_seq"),
+                                   {"ids": list(set(track_ids))}).fetchall() if track_ids else []
+            current = load()
+            rows = []
+            superseded = 0
+            for row, audio in zip(changed, audio_block([row[4:-1] for row in changed])):
+                tid = row[0]
+                indices, data = track_features(*row[1:4])
+                if not _same_row(current, tid, indices, data, audio):
+                    if current is not None and tid in current.row_of:
+                        superseded += 1
+                    rows.append((tid, indices, data, audio))
+            if not rows:
+                conn.commit()
+                return 0
+
+            manifest = _append(manifest, rows)
+            manifest["superseded"] += superseded
+            if manifest["superseded"] > COMPACT_RATIO * manifest["rows"]:
+                _rebuild(conn, manifest)
+            else:
+                _write_manifest(manifest)
+            conn.commit()
+            return len(rows)
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+            conn.commit()
+
+
+def current() -> FeatureMatrix:
+    """Load the matrix after picking up recent track changes.
+
+    Doesn't queue behind another writer (e.g. an enrichment job) unless the
+    matrix has never been built.
+    """
+    refresh(wait=_read_manifest() is None)
+    return load()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or update the recommender's feature matrix.")
+    parser.add_argument("--full", action="store_true", help="rewrite the matrix from scratch")
+    args = parser.parse_args()
+
+    print(f"Wrote {refresh(full=args.full)} feature row(s) to {MATRIX_DIR}.")
@@ -0,0 +1,77 @@
+import hashlib
+import os
+import threading
+import uuid
+from concurrent.futures import Future
+from typing import NamedTuple
+import dotenv
+from services import spotify_api
+from services.cache import TTLCache
+
+dotenv.load_dotenv()
+
+CACHE_SIZE = int(os.environ.get("IDENTITY_CACHE_SIZE", 10000))
+# Spotify access tokens live for an hour; stay well inside that.
+CACHE_TTL = float(os.environ.get("IDENTITY_CACHE_TTL", 15 * 60))
+
+
+class UserIdentity(NamedTuple):
+    spotify_id: str
+    user_uuid: str
+
+
+_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _token_key(access_token: str) -> str:
+    # Never keep raw tokens around as cache keys.
+    return hashlib.sha256(access_token.encode()).hexdigest()
+
+
+def user_uuid_for(spotify_id: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, spotify_id))
+
+
+def remember_profile(access_token: str, profile: dict) -> UserIdentity:
+    identity = UserIdentity(profile["id"], user_uuid_for(profile["id"]))
+    _cache.set(_token_key(access_token), identity)
+    return identity
+
+
+def resolve_identity(access_token: str) -> UserIdentity:
+    """Resolve a token to the user's Spotify ID and internal UUID.
+
+    Results are cached per token, and concurrent lookups for the same token
+    share a single /me request.
+    """
+    key = _token_key(access_token)
+    identity = _cache.get(key)
+    if identity is not None:
+        return identity
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+
+    if not leader:
+        return future.result()
+
+    try:
+        identity = remember_profile(access_token, spotify_api.get_user_profile(access_token))
+        future.set_result(identity)
+        return identity
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
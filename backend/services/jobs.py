@@ -0,0 +1,246 @@
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import dotenv
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from database import engine
+from services import rate_limit
+
+dotenv.load_dotenv()
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# A running job that hasn't reported progress for this long is treated as
+# interrupted (its process died) and may be resumed.
+STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", 600))
+
+RESUMABLE_SQL = f"""
+    status IN ('failed', 'cancelled')
+    OR (status IN ('queued', 'running') AND updated_at < now() - interval '{STALE_SECONDS} seconds')
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """Handed to a job handler: its parameters, last checkpoint and progress reporting."""
+
+    def __init__(self, job_id, access_token, params, checkpoint, done, total, cancel_event):
+        self.id = job_id
+        self.access_token = access_token
+        self.params = params
+        self.checkpoint = checkpoint
+        self.done = done
+        self.total = total
+        self._cancel_event = cancel_event
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def progress(self, done: int, total: int = None, checkpoint: dict = None):
+        """Persist progress (and a checkpoint to resume from); raises JobCancelled if cancel was requested."""
+        self.done = done
+        self.total = total if total is not None else self.total
+        if checkpoint is not None:
+            self.checkpoint = checkpoint
+        with engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE jobs
+                SET done = :done, total = :total, checkpoint = CAST(:checkpoint AS jsonb), updated_at = now()
+                WHERE id = :id
+            """), {"id": self.id, "done": self.done, "total": self.total, "checkpoint": json.dumps(self.checkpoint)})
+        if self.cancelled:
+            raise JobCancelled()
+
+
+_handlers = {}
+_executor = None
+_lock = threading.Lock()
+_cancel_events = {}
+
+
+def handler(kind: str):
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def start():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+    return _executor
+
+
+def shutdown():
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+        for event in _cancel_events.values():
+            event.set()
+    if executor is not None:
+        # Running jobs stop at their next progress report and keep their checkpoint.
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def submit(kind: str, access_token: str, params: dict = None, user_id: str = None) -> str:
+    """Queue a job and return its id.
+
+    A catalog-wide job (no `user_id`) of a kind that is already queued or
+    running isn't queued again: its id is returned instead, and if it was
+    interrupted it is resumed.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+    while True:
+        with engine.begin() as conn:
+            job_id = conn.execute(text("""
+                INSERT INTO jobs (id, kind, status, user_id, params, done, resumed_from, created_at, updated_at)
+                VALUES (:id, :kind, 'queued', :user_id, CAST(:params AS jsonb), 0, 0, now(), now())
+                ON CONFLICT (kind) WHERE user_id IS NULL AND status IN ('queued', 'running') DO NOTHING
+                RETURNING id
+            """), {"id": str(uuid.uuid4()), "kind": kind, "user_id": user_id,
+                   "params": json.dumps(params or {})}).scalar()
+            if job_id is None:
+                existing = conn.execute(text("""
+                    SELECT id FROM jobs
+                    WHERE kind = :kind AND user_id IS NULL AND status IN ('queued', 'running')
+                """), {"kind": kind}).scalar()
+        if job_id is not None:
+            job_id = str(job_id)
+            _enqueue(job_id, access_token)
+            return job_id
+        # None if it finished in between; then try again.
+        if existing is not None:
+            resume(str(existing), access_token)
+            return str(existing)
+
+
+def resume(job_id: str, access_token: str) -> bool:
+    """Requeue a failed, cancelled or interrupted job from its last checkpoint."""
+    with _lock:
+        if job_id in _cancel_events:
+            return False
+    try:
+        with engine.begin() as conn:
+            claimed = conn.execute(text(f"""
+                UPDATE jobs SET status = 'queued', error = NULL, updated_at = now()
+                WHERE id = :id AND ({RESUMABLE_SQL})
+                RETURNING id
+            """), {"id": job_id}).scalar()
+    except IntegrityError:
+        # Another catalog-wide job of the same kind is queued or running.
+        return False
+    if claimed is None:
+        return False
+    _enqueue(job_id, access_token)
+    return True
+
+
+def cancel(job_id: str) -> bool:
+    with _lock:
+        event = _cancel_events.get(job_id)
+    if event is not None:
+        event.set()
+        return True
+    with engine.begin() as conn:
+        cancelled = conn.execute(text("""
+            UPDATE jobs SET status = 'cancelled', updated_at = now(), finished_at = now()
+            WHERE id = :id AND status = 'queued'
+            RETURNING id
+        """), {"id": job_id}).scalar()
+    return cancelled is not None
+
+
+def _enqueue(job_id: str, access_token: str):
+    # The access token is only ever held in memory, never written to the jobs table.
+    event = threading.Event()
+    executor = start()
+    with _lock:
+        _cancel_events[job_id] = event
+    executor.submit(_run, job_id, access_token, event)
+
+
+def _finish(job_id: str, status: str, result=None, error: str = None):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE jobs
+            SET status = :status, result = CAST(:result AS jsonb), error = :error,
+                updated_at = now(), finished_at = now()
+            WHERE id = :id
+        """), {"id": job_id, "status": status, "result": json.dumps(result), "error": error})
+
+
+def _run(job_id: str, access_token: str, cancel_event: threading.Event):
+    try:
+        with engine.begin() as conn:
+            row = conn.execute(text("""
+                UPDATE jobs
+                SET status = 'running', started_at = now(), updated_at = now(), resumed_from = done
+                WHERE id = :id AND status = 'queued'
+                RETURNING kind, params, checkpoint, done, total
+            """), {"id": job_id}).fetchone()
+        if row is None:
+            return
+
+        kind, params, checkpoint, done, total = row
+        job = JobContext(job_id, access_token, params, checkpoint, done, total, cancel_event)
+        try:
+            with rate_limit.priority(rate_limit.BULK):
+                result = _handlers[kind](job)
+            _finish(job_id, "succeeded", result=result)
+        except JobCancelled:
+            _finish(job_id, "cancelled")
+        except Exception as e:
+            print(f"Job {job_id} ({kind}) failed:", e)
+            _finish(job_id, "failed", error=str(e))
+    finally:
+        with _lock:
+            _cancel_events.pop(job_id, None)
+
+
+def get(job_id: str) -> dict:
+    with engine.begin() as conn:
+        row = conn.execute(text(f"""
+            SELECT id, kind, status, user_id, done, total, resumed_from,
+                   result, error, created_at, started_at, updated_at, finished_at,
+                   EXTRACT(EPOCH FROM (COALESCE(finished_at, now()) - started_at)),
+                   status IN ('queued', 'running') AND ({RESUMABLE_SQL})
+            FROM jobs WHERE id = :id
+        """), {"id": job_id}).fetchone()
+    if row is None:
+        return None
+
+    (job_id, kind, status, user_id, done, total, resumed_from, result, error,
+     created_at, started_at, updated_at, finished_at, elapsed, stale) = row
+
+    rate = None
+    eta = None
+    if elapsed and done > resumed_from:
+        rate = (done - resumed_from) / float(elapsed)
+        if total is not None and status == "running":
+            eta = round(max(total - done, 0) / rate, 1)
+
+    return {
+        "id": str(job_id),
+        "kind": kind,
+        "status": "interrupted" if stale else status,
+        "user_id": str(user_id) if user_id else None,
+        "done": done,
+        "total": total,
+        "rate_per_sec": round(rate, 2) if rate is not None else None,
+        "eta_seconds": eta,
+        "resumable": stale or status in ("failed", "cancelled"),
+        "result": result,
+        "error": error,
+        "created_at": created_at,
+        "started_at": started_at,
+        "finished_at": finished_at,
+    }
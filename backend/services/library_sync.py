@@ -0,0 +1,162 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+from sqlalchemy import text
+from database import engine
+from services import spotify_api, bulk_write, rollups
+
+LIKED_TRACKS = "liked_tracks"
+RECENTLY_PLAYED = "recently_played"
+
+
+class LikedDelta(NamedTuple):
+    items: list  # saved-track objects, newest first
+    watermark: Optional[datetime]
+    watermark_key: Optional[str]
+    complete: bool  # True when the whole library was scanned
+
+
+def _parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def get_watermark(conn, user_uuid: str, stream: str):
+    row = conn.execute(text("""
+        SELECT watermark, watermark_key FROM sync_watermarks
+        WHERE user_id = :uid AND stream = :stream
+    """), {"uid": user_uuid, "stream": stream}).fetchone()
+    return (row[0], row[1]) if row else (None, None)
+
+
+def set_watermark(conn, user_uuid: str, stream: str, watermark: datetime, watermark_key: str = None):
+    conn.execute(text("""
+        INSERT INTO sync_watermarks (user_id, stream, watermark, watermark_key, synced_at)
+        VALUES (:uid, :stream, :watermark, :key, now())
+        ON CONFLICT (user_id, stream) DO UPDATE SET
+            watermark = COALESCE(EXCLUDED.watermark, sync_watermarks.watermark),
+            watermark_key = CASE WHEN EXCLUDED.watermark IS NULL
+                                 THEN sync_watermarks.watermark_key ELSE EXCLUDED.watermark_key END,
+            synced_at = EXCLUDED.synced_at
+    """), {"uid": user_uuid, "stream": stream, "watermark": watermark, "key": watermark_key})
+
+
+def fetch_liked_tracks(access_token: str, user_uuid: str, full: bool = False) -> LikedDelta:
+    """Fetch saved tracks added since the last sync.
+
+    Pages are read newest first and reading stops at the track stored at the
+    watermark, so a routine sync costs one or two requests. Without a
+    watermark (or with `full`) every page is fetched, in parallel.
+    """
+    with engine.begin() as conn:
+        watermark, watermark_key = (None, None) if full else get_watermark(conn, user_uuid, LIKED_TRACKS)
+
+    if watermark is None:
+        items = []
+        for page in spotify_api.iter_liked_track_pages(access_token):
+            items.extend(item for item in page if bulk_write.track_row(item.get("track")))
+        newest = items[0] if items else None
+        return LikedDelta(
+            items,
+            _parse_time(newest["added_at"]) if newest else None,
+            newest["track"]["id"] if newest else None,
+            True
+        )
+
+    items = []
+    pages = spotify_api.iter_liked_track_pages(access_token, max_workers=1)
+    try:
+        for page in pages:
+            reached = False
+            for item in page:
+                added_at = _parse_time(item["added_at"])
+                track = item.get("track") or {}
+                if added_at < watermark or (added_at == watermark and track.get("id") == watermark_key):
+                    reached = True
+                    break
+                if bulk_write.track_row(track):
+                    items.append(item)
+            if reached:
+                break
+    finally:
+        pages.close()
+
+    if not items:
+        return LikedDelta([], None, None, False)
+    return LikedDelta(items, _parse_time(items[0]["added_at"]), items[0]["track"]["id"], False)
+
+
+def write_liked_tracks(conn, user_uuid: str, delta: LikedDelta, with_tracks: bool = True) -> int:
+    if with_tracks:
+        bulk_write.insert_tracks(conn, [bulk_write.track_row(item["track"]) for item in delta.items])
+    written = bulk_write.insert_rows(conn, "user_liked_tracks", bulk_write.USER_LIKED_TRACK_COLUMNS, bulk_write.dedupe([
+        {"user_id": user_uuid, "track_id": item["track"]["id"], "liked_at": item["added_at"]}
+        for item in delta.items
+    ], ("track_id",)), on_conflict="ON CONFLICT (user_id, track_id) DO UPDATE SET liked_at = EXCLUDED.liked_at")
+    rollups.add_tracks(conn, user_uuid, [item["track"]["id"] for item in delta.items])
+
+    if delta.complete:
+        # A full scan is the whole library, so anything else was un-liked.
+        unliked = conn.execute(text("""
+            DELETE FROM user_liked_tracks
+            WHERE user_id = :uid AND NOT (track_id = ANY(:ids))
+            RETURNING track_id
+        """), {"uid": user_uuid, "ids": [item["track"]["id"] for item in delta.items]}).scalars().all()
+        rollups.remove_tracks(conn, user_uuid, unliked)
+
+    set_watermark(conn, user_uuid, LIKED_TRACKS, delta.watermark, delta.watermark_key)
+    return written
+
+
+def sync_liked_tracks(access_token: str, user_uuid: str, full: bool = False) -> dict:
+    delta = fetch_liked_tracks(access_token, user_uuid, full)
+    with engine.begin() as conn:
+        written = write_liked_tracks(conn, user_uuid, delta)
+    return {"fetched": len(delta.items), "written": written, "full_scan": delta.complete}
+
+
+def fetch_recently_played(access_token: str, user_uuid: str) -> list:
+    """Fetch only the plays newer than the last ingested played_at."""
+    with engine.begin() as conn:
+        watermark, _ = get_watermark(conn, user_uuid, RECENTLY_PLAYED)
+    after = int(watermark.timestamp() * 1000) if watermark else None
+    items = spotify_api.get_recently_played(access_token, after=after)
+    return [item for item in items if bulk_write.track_row(item.get("track"))]
+
+
+def write_recently_played(conn, user_uuid: str, items: list, with_tracks: bool = True) -> int:
+    if with_tracks:
+        bulk_write.insert_tracks(conn, [bulk_write.track_row(item["track"]) for item in items])
+    written = bulk_write.insert_rows(conn, "user_stream_history", bulk_write.STREAM_HISTORY_COLUMNS, [
+        {"user_id": user_uuid, "track_id": item["track"]["id"], "played_at": item["played_at"]}
+        for item in items
+    ])
+    rollups.add_tracks(conn, user_uuid, [item["track"]["id"] for item in items])
+    newest = max((_parse_time(item["played_at"]) for item in items), default=None)
+    set_watermark(conn, user_uuid, RECENTLY_PLAYED, newest)
+    return written
+
+
+def sync_recently_played(access_token: str, user_uuid: str) -> dict:
+    items = fetch_recently_played(access_token, user_uuid)
+    with engine.begin() as conn:
+        written = write_recently_played(conn, user_uuid, items)
+    return {"fetched": len(items), "written": written}
+
+
+def sync_lag() -> list:
+    """Per-user freshness of recently-played ingestion."""
+    with engine.begin() as conn:
+        rows = conn.execute(text("""
+            SELECT user_id, watermark, synced_at,
+                   EXTRACT(EPOCH FROM now() - synced_at),
+                   EXTRACT(EPOCH FROM now() - watermark)
+            FROM sync_watermarks
+            WHERE stream = :stream
+            ORDER BY synced_at
+        """), {"stream": RECENTLY_PLAYED}).fetchall()
+    return [{
+        "user_id": str(user_id),
+        "newest_play_at": watermark,
+        "last_synced_at": synced_at,
+        "seconds_since_sync": round(float(since_sync), 1),
+        "seconds_since_newest_play": round(float(since_play), 1) if since_play is not None else None,
+    } for user_id, watermark, synced_at, since_sync, since_play in rows]
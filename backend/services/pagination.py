@@ -0,0 +1,66 @@
+import contextvars
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import dotenv
+from services.spotify_client import client
+
+dotenv.load_dotenv()
+
+PAGE_FANOUT = int(os.environ.get("SPOTIFY_PAGE_FANOUT", 4))
+
+
+def _fetch_page(access_token: str, url: str, params: dict, container: str = None) -> dict:
+    headers = {"Authorization": f"Bearer {access_token}"}
+    resp = client.get(url, headers=headers, params=params)
+    resp.raise_for_status()
+    data = resp.json()
+    return data[container] if container else data
+
+
+def iter_pages(access_token: str, url: str, page_size: int, params: dict = None,
+               container: str = None, max_items: int = None, max_workers: int = PAGE_FANOUT):
+    """Yield the `items` of each page of an offset-paginated endpoint, in order.
+
+    The first page is fetched alone to learn `total`; the remaining offsets are
+    then fetched concurrently, at most `max_workers` at a time, and yielded in
+    offset order as soon as each one (and every page before it) is ready.
+    `container` names the key wrapping the paging object (e.g. "albums").
+    """
+    params = dict(params or {})
+
+    def fetch(offset):
+        return _fetch_page(access_token, url, {**params, "limit": page_size, "offset": offset}, container)
+
+    first = fetch(0)
+    total = first.get("total") or 0
+    if max_items is not None:
+        total = min(total, max_items)
+    yield first["items"]
+
+    offsets = range(page_size, total, page_size)
+    if not offsets:
+        return
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        try:
+            for offset in offsets:
+                # Copy the caller's context so pages keep its rate-limit priority.
+                ctx = contextvars.copy_context()
+                pending.append(pool.submit(ctx.run, fetch, offset))
+                if len(pending) >= max_workers:
+                    yield pending.popleft().result()["items"]
+            while pending:
+                yield pending.popleft().result()["items"]
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def fetch_all(access_token: str, url: str, page_size: int, params: dict = None,
+              container: str = None, max_items: int = None, max_workers: int = PAGE_FANOUT) -> list:
+    items = []
+    for page in iter_pages(access_token, url, page_size, params, container, max_items, max_workers):
+        items.extend(page)
+    return items[:max_items] if max_items is not None else items
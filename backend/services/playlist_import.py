@@ -0,0 +1,116 @@
+import contextvars
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import dotenv
+from database import engine
+from services import spotify_api, bulk_write
+
+dotenv.load_dotenv()
+
+FETCH_WORKERS = int(os.environ.get("PLAYLIST_IMPORT_WORKERS", 4))
+# Pages buffered between the fetchers and the writer; fetchers block when full.
+QUEUE_PAGES = int(os.environ.get("PLAYLIST_IMPORT_QUEUE_PAGES", 16))
+
+_DONE = object()
+
+
+def import_playlist_tracks(access_token: str, playlist_ids: list,
+                           fetch_workers: int = FETCH_WORKERS, queue_pages: int = QUEUE_PAGES,
+                           batch_rows: int = None, on_playlist_done=None) -> dict:
+    """Fetch many playlists concurrently and write their tracks in batched transactions.
+
+    Fetcher threads stream each playlist's pages into a bounded queue; the
+    calling thread drains it and commits one transaction per `batch_rows`
+    items across playlists. A playlist whose fetch or write fails is reported
+    in the summary without affecting the others. `on_playlist_done(id)` is
+    called once a playlist's tracks are committed.
+    """
+    batch_rows = batch_rows or bulk_write.BATCH_SIZE
+    pages = queue.Queue(maxsize=queue_pages)
+    stop = threading.Event()
+    started = time.monotonic()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                pages.put(entry, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def fetch(playlist_id):
+        try:
+            for items in spotify_api.iter_playlist_track_pages(access_token, playlist_id):
+                if stop.is_set():
+                    return
+                put((playlist_id, items))
+            put((playlist_id, _DONE))
+        except Exception as e:
+            put((playlist_id, e))
+
+    failed = {}
+    fetched_done = []
+    pending = []
+    summary = {"playlists": len(playlist_ids), "items": 0, "tracks_written": 0, "batches": 0}
+
+    def flush():
+        if pending:
+            write_batch()
+        for pid in fetched_done:
+            if pid not in failed and on_playlist_done:
+                on_playlist_done(pid)
+        fetched_done.clear()
+
+    def write_batch():
+        try:
+            with engine.begin() as conn:
+                summary["tracks_written"] += bulk_write.insert_playlist_items(conn, pending)
+        except Exception:
+            # Retry playlist by playlist so one bad playlist doesn't sink the batch.
+            for pid in {pid for pid, _ in pending}:
+                try:
+                    with engine.begin() as conn:
+                        summary["tracks_written"] += bulk_write.insert_playlist_items(
+                            conn, [entry for entry in pending if entry[0] == pid]
+                        )
+                except Exception as e:
+                    failed[pid] = str(e)
+        summary["batches"] += 1
+        pending.clear()
+
+    remaining = len(playlist_ids)
+    with ThreadPoolExecutor(max_workers=max(1, fetch_workers)) as pool:
+        try:
+            for playlist_id in playlist_ids:
+                # Copy the caller's context so fetches keep its rate-limit priority.
+                pool.submit(contextvars.copy_context().run, fetch, playlist_id)
+
+            while remaining:
+                playlist_id, payload = pages.get()
+                if payload is _DONE:
+                    remaining -= 1
+                    fetched_done.append(playlist_id)
+                elif isinstance(payload, Exception):
+                    remaining -= 1
+                    failed[playlist_id] = str(payload)
+                else:
+                    summary["items"] += len(payload)
+                    pending.extend((playlist_id, item) for item in payload)
+
+                if len(pending) >= batch_rows:
+                    flush()
+            flush()
+        finally:
+            stop.set()
+
+    elapsed = time.monotonic() - started
+    summary.update({
+        "succeeded": len(playlist_ids) - len(failed),
+        "failed": [{"id": pid, "error": error} for pid, error in failed.items()],
+        "seconds": round(elapsed, 3),
+        "items_per_sec": round(summary["items"] / elapsed, 1) if elapsed else None,
+    })
+    return summary
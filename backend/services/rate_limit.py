@@ -0,0 +1,171 @@
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+import dotenv
+
+dotenv.load_dotenv()
+
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal", BULK: "bulk"}
+
+RATE_PER_SEC = float(os.environ.get("SPOTIFY_RATE_LIMIT_PER_SEC", 10))
+BURST = float(os.environ.get("SPOTIFY_RATE_LIMIT_BURST", 20))
+MAX_RETRIES = int(os.environ.get("SPOTIFY_MAX_RETRIES", 5))
+BACKOFF_BASE = float(os.environ.get("SPOTIFY_BACKOFF_BASE", 0.5))
+BACKOFF_MAX = float(os.environ.get("SPOTIFY_BACKOFF_MAX", 30))
+
+_priority = contextvars.ContextVar("spotify_priority", default=NORMAL)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+@contextmanager
+def priority(level: int):
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+async def interactive_priority():
+    # Async so it runs in the request's own context, which FastAPI copies into
+    # the worker thread that runs the (sync) route handler.
+    _priority.set(INTERACTIVE)
+
+
+async def bulk_priority():
+    _priority.set(BULK)
+
+
+def _retry_after_seconds(resp) -> float:
+    try:
+        return max(float(resp.headers.get("Retry-After", 1)), 0.0)
+    except ValueError:
+        return 1.0
+
+
+class RequestScheduler:
+    """Process-wide token bucket that every Spotify request passes through.
+
+    Waiting callers are served strictly by priority (then arrival order), so
+    interactive requests jump ahead of bulk imports. A 429 pauses the whole
+    bucket for `Retry-After` seconds, since Spotify's limit is per app rather
+    than per request.
+    """
+
+    def __init__(self, rate=RATE_PER_SEC, burst=BURST, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._cond = threading.Condition()
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._waiting = []
+        self._seq = itertools.count()
+        self._backlog = {level: 0 for level in PRIORITY_NAMES}
+        self._throttled_seconds = {level: 0.0 for level in PRIORITY_NAMES}
+        self._requests = 0
+        self._rate_limited = 0
+        self._retry_after_seconds = 0.0
+        self._server_error_retries = 0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, level: int = None):
+        level = current_priority() if level is None else level
+        ticket = (level, next(self._seq))
+        start = time.monotonic()
+
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            self._backlog[level] += 1
+            try:
+                while True:
+                    if self._waiting[0] != ticket:
+                        self._cond.wait()
+                        continue
+
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now < self._blocked_until:
+                        self._cond.wait(self._blocked_until - now)
+                    elif self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+                    else:
+                        self._cond.wait((1 - self._tokens) / self.rate)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._backlog[level] -= 1
+                self._requests += 1
+                self._throttled_seconds[level] += time.monotonic() - start
+                self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._rate_limited += 1
+            self._retry_after_seconds += seconds
+            self._cond.notify_all()
+
+    def backoff_delay(self, attempt: int) -> float:
+        # "Full jitter" exponential backoff.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def send(self, send, retry_server_errors: bool = True):
+        """Run `send()` under the bucket, retrying 429s and (optionally) 5xx."""
+        attempt = 0
+        while True:
+            self.acquire()
+            resp = send()
+
+            if resp.status_code == 429 and attempt < self.max_retries:
+                self.pause(_retry_after_seconds(resp))
+            elif resp.status_code >= 500 and retry_server_errors and attempt < self.max_retries:
+                with self._cond:
+                    self._server_error_retries += 1
+                delay = self.backoff_delay(attempt)
+                level = current_priority()
+                time.sleep(delay)
+                with self._cond:
+                    self._throttled_seconds[level] += delay
+            else:
+                return resp
+
+            resp.close()
+            attempt += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "rate_per_sec": self.rate,
+                "burst": self.burst,
+                "tokens": round(self._tokens, 2),
+                "paused_for": round(max(self._blocked_until - time.monotonic(), 0.0), 2),
+                "backlog": {PRIORITY_NAMES[k]: v for k, v in self._backlog.items()},
+                "throttled_seconds": {PRIORITY_NAMES[k]: round(v, 3) for k, v in self._throttled_seconds.items()},
+                "requests": self._requests,
+                "rate_limited": self._rate_limited,
+                "retry_after_seconds": round(self._retry_after_seconds, 3),
+                "server_error_retries": self._server_error_retries,
+            }
+
+
+scheduler = RequestScheduler()
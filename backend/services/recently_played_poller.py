@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+import dotenv
+import requests
+from services import library_sync, rate_limit
+
+dotenv.load_dotenv()
+
+# How often every registered user is polled; 0 disables the poller. Spotify
+# only keeps the last 50 plays, so this must stay well under ~2 hours.
+POLL_SECONDS = float(os.environ.get("RECENTLY_PLAYED_POLL_SECONDS", 600))
+# Spotify access tokens expire after an hour.
+TOKEN_TTL = float(os.environ.get("RECENTLY_PLAYED_TOKEN_TTL", 55 * 60))
+
+
+class RecentlyPlayedPoller:
+    """Periodically ingests new plays for every user with a live access token.
+
+    Users register a token whenever they hit an import route. Each round
+    polls the least recently polled users first and spaces the requests
+    evenly over the poll interval, at bulk priority, so polling never
+    bursts against the shared Spotify rate budget.
+    """
+
+    def __init__(self, poll_seconds=POLL_SECONDS, token_ttl=TOKEN_TTL):
+        self.poll_seconds = poll_seconds
+        self.token_ttl = token_ttl
+        self._lock = threading.Lock()
+        self._users = {}  # user_uuid -> {"token", "expires_at", "last_polled"}
+        self._stop = threading.Event()
+        self._thread = None
+        self.rounds = 0
+        self.errors = 0
+
+    def register(self, user_uuid: str, access_token: str):
+        with self._lock:
+            entry = self._users.setdefault(user_uuid, {"last_polled": 0.0})
+            entry["token"] = access_token
+            entry["expires_at"] = time.monotonic() + self.token_ttl
+
+    def start(self):
+        if self.poll_seconds <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="recently-played-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _due_users(self):
+        now = time.monotonic()
+        with self._lock:
+            for user_uuid in [u for u, e in self._users.items() if e["expires_at"] <= now]:
+                del self._users[user_uuid]
+            return sorted(self._users.items(), key=lambda kv: kv[1]["last_polled"])
+
+    def poll_once(self, spread_seconds: float = 0.0):
+        users = self._due_users()
+        gap = spread_seconds / len(users) if users else 0.0
+        for user_uuid, entry in users:
+            if self._stop.is_set():
+                return
+            started = time.monotonic()
+            try:
+                with rate_limit.priority(rate_limit.BULK):
+                    library_sync.sync_recently_played(entry["token"], user_uuid)
+            except requests.HTTPError as e:
+                self.errors += 1
+                if e.response is not None and e.response.status_code == 401:
+                    with self._lock:
+                        self._users.pop(user_uuid, None)
+            except Exception as e:
+                self.errors += 1
+                print(f"Recently-played poll failed for {user_uuid}:", e)
+            with self._lock:
+                if user_uuid in self._users:
+                    self._users[user_uuid]["last_polled"] = time.monotonic()
+            self._stop.wait(max(gap - (time.monotonic() - started), 0.0))
+        self.rounds += 1
+
+    def _loop(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.poll_once(spread_seconds=self.poll_seconds)
+            self._stop.wait(max(self.poll_seconds - (time.monotonic() - started), 0.0))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._thread is not None,
+                "poll_seconds": self.poll_seconds,
+                "registered_users": len(self._users),
+                "rounds": self.rounds,
+                "errors": self.errors,
+            }
+
+
+poller = RecentlyPlayedPoller()
@@ -0,0 +1,149 @@
+"""Batch precompute of every user's top recommendations.
+
+Users are scored USER_BATCH at a time against the whole catalog: their
+centroids form one dense (columns x users) block, and each BLOCK_ROWS
+slice of the feature matrix is multiplied by it while a running top TOP_N
+is kept per user. The lists land in user_recommendations, stamped with
+the users.import_version they were computed from, and /recommendations
+serves them until the user's library changes again.
+
+Run it nightly (cron, or POST /recommendations/precompute) from backend/:
+
+    python -m services.recommendation_batch [--user USER_UUID]
+"""
+import argparse
+import os
+import dotenv
+import numpy as np
+from scipy import sparse
+from sqlalchemy import text
+from database import engine
+from services import bulk_write, feature_matrix, recommender
+
+dotenv.load_dotenv()
+
+TOP_N = int(os.environ.get("RECOMMENDATIONS_TOP_N", 200))
+USER_BATCH = int(os.environ.get("RECOMMENDATIONS_USER_BATCH", 256))
+BLOCK_ROWS = int(os.environ.get("RECOMMENDATIONS_BLOCK_ROWS", 20000))
+
+PRECOMPUTED_SQL = """
+    SELECT r.track_id
+    FROM user_recommendations r
+    JOIN users u ON u.id = r.user_id AND u.import_version = r.import_version
+    WHERE r.user_id = :uid AND r.rank > :offset AND r.rank <= :offset + :limit
+    ORDER BY r.rank
+"""
+
+
+def precomputed(conn, user_uuid: str, limit: int, offset: int = 0) -> list:
+    """A page of the user's precomputed recommendations, or None if the list is stale or too short."""
+    track_ids = conn.execute(text(PRECOMPUTED_SQL), {"uid": user_uuid, "limit": limit, "offset": offset}).scalars().all()
+    return track_ids if len(track_ids) == limit else None
+
+
+def score_users(features, user_rows: list, top_n: int = TOP_N):
+    """Best `top_n` unseen (rows, scores) per user, best first, padded with -1 / -inf.
+
+    Same scores as recommender.recommend without an index, computed as
+    catalog-block x centroid-block matrix products.
+    """
+    n_users = len(user_rows)
+    owner = np.repeat(np.arange(n_users), [len(rows) for rows in user_rows])
+    rows = np.concatenate([np.asarray(r, dtype=np.int64) for r in user_rows]) if n_users else np.zeros(0, dtype=np.int64)
+    norms = features.norms[rows].copy()
+    norms[norms == 0] = 1
+    counts = np.array([len(r) for r in user_rows], dtype=np.float32)
+
+    # Row u of `assign` averages user u's normalized vectors, so assign @ vectors stacks the centroids.
+    assign = sparse.csr_matrix(((1 / (norms * counts[owner])).astype(np.float32), (owner, rows)),
+                               shape=(n_users, features.rows))
+    centroids = np.ascontiguousarray(feature_matrix.weighted_sum(features, assign).T)
+    seen = sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, owner)), shape=(features.rows, n_users))
+
+    best_rows = np.full((n_users, top_n), -1, dtype=np.int64)
+    best_scores = np.full((n_users, top_n), -np.inf, dtype=np.float32)
+    for start in range(0, len(features.live_rows), BLOCK_ROWS):
+        block = features.live_rows[start:start + BLOCK_ROWS]
+        block_norms = features.norms[block].copy()
+        block_norms[block_norms == 0] = 1
+        scores = feature_matrix.dot(features, centroids, block) / block_norms[:, None]
+        hits = seen[block].tocoo()
+        scores[hits.row, hits.col] = -np.inf
+        scores = scores.T
+
+        k = min(top_n, len(block))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        merged_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+        merged_rows = np.concatenate([best_rows, block[top]], axis=1)
+        keep = np.argpartition(-merged_scores, top_n - 1, axis=1)[:, :top_n]
+        best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+        best_rows = np.take_along_axis(merged_rows, keep, axis=1)
+
+    order = np.lexsort((best_rows, -best_scores))
+    return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def _next_users(user_uuid: str, after: str):
+    """The next batch of users with their import versions and track ids, read from one snapshot."""
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="REPEATABLE READ")
+        with conn.begin():
+            if user_uuid:
+                users = conn.execute(text("SELECT id, import_version FROM users WHERE id = :uid"),
+                                     {"uid": user_uuid}).fetchall()
+            else:
+                users = conn.execute(text("""
+                    SELECT id, import_version FROM users
+                    WHERE :after IS NULL OR id > CAST(:after AS uuid)
+                    ORDER BY id
+                    LIMIT :n
+                """), {"after": after, "n": USER_BATCH}).fetchall()
+            tracks = recommender.users_track_ids(conn, [uid for uid, _ in users])
+    return [(str(uid), version, tracks[str(uid)]) for uid, version in users]
+
+
+def precompute(user_uuid: str = None, after: str = None, on_batch=None) -> int:
+    """Recompute and store top-N lists for every user after `after` (or just `user_uuid`).
+
+    `on_batch(users_done, last_user_id)` is called after each batch is
+    written. Returns the number of users processed.
+    """
+    features = feature_matrix.current()
+    done = 0
+    while features is not None:
+        users = _next_users(user_uuid, after)
+        if not users:
+            break
+
+        scored = [(uid, version, [features.row_of[t] for t in track_ids if t in features.row_of])
+                  for uid, version, track_ids in users]
+        scored = [u for u in scored if u[2]]
+        best_rows, best_scores = score_users(features, [rows for _, _, rows in scored])
+
+        records = []
+        for (uid, version, _), rows, scores in zip(scored, best_rows, best_scores):
+            records.extend(
+                {"user_id": uid, "rank": rank, "track_id": features.track_ids[row],
+                 "score": float(score), "import_version": version}
+                for rank, (row, score) in enumerate(zip(rows, scores), start=1) if np.isfinite(score)
+            )
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM user_recommendations WHERE user_id = ANY(CAST(:users AS uuid[]))"),
+                         {"users": [uid for uid, _, _ in users]})
+            bulk_write.insert_rows(conn, "user_recommendations", bulk_write.USER_RECOMMENDATION_COLUMNS, records)
+
+        done += len(users)
+        after = users[-1][0]
+        if on_batch is not None:
+            on_batch(done, after)
+        if user_uuid:
+            break
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute every user's top recommendations.")
+    parser.add_argument("--user", help="only recompute this user (users.id)")
+    args = parser.parse_args()
+
+    print(f"Precomputed recommendations for {precompute(args.user)} user(s).")
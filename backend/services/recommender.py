@@ -0,0 +1,80 @@
+import numpy as np
+from scipy import sparse
+from sqlalchemy import text
+from services import feature_matrix
+from services.feature_matrix import FeatureMatrix
+
+USER_TRACKS_SQL = """
+    SELECT user_id, track_id FROM user_liked_tracks WHERE user_id = ANY(CAST(:users AS uuid[]))
+    UNION
+    SELECT user_id, track_id FROM user_top_tracks WHERE user_id = ANY(CAST(:users AS uuid[]))
+    UNION
+    SELECT user_id, track_id FROM user_stream_history WHERE user_id = ANY(CAST(:users AS uuid[]))
+    UNION
+    SELECT p.user_id, pt.track_id
+    FROM playlist_tracks pt
+    JOIN playlists p ON pt.playlist_id = p.id
+    WHERE p.user_id = ANY(CAST(:users AS uuid[]))
+"""
+
+
+def user_track_ids(conn, user_uuid: str) -> list:
+    """Every track the user has liked, played, ranked or put in a playlist."""
+    return [track_id for _, track_id in conn.execute(text(USER_TRACKS_SQL), {"users": [str(user_uuid)]})]
+
+
+def users_track_ids(conn, user_uuids: list) -> dict:
+    """user_track_ids for several users at once, keyed by user id."""
+    tracks = {str(uid): [] for uid in user_uuids}
+    for user_id, track_id in conn.execute(text(USER_TRACKS_SQL), {"users": list(tracks)}):
+        tracks[str(user_id)].append(track_id)
+    return tracks
+
+
+def user_centroid(features: FeatureMatrix, user_rows: list) -> np.ndarray:
+    """Mean of the user's L2-normalized track vectors (matrix columns, then audio columns).
+
+    The mean cosine similarity between a track and every user track is the
+    track's normalized vector dotted with this centroid, so scoring the
+    catalog is one sparse matrix-vector product.
+    """
+    norms = features.norms[user_rows]
+    norms[norms == 0] = 1
+    weights = sparse.csr_matrix(((1 / (norms * len(user_rows))).astype(np.float32),
+                                 (np.zeros(len(user_rows), dtype=np.int64), user_rows)),
+                                shape=(1, features.rows))
+    return feature_matrix.weighted_sum(features, weights).ravel()
+
+
+def content_scores(features: FeatureMatrix, centroid: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+    """Mean cosine similarity to the user's tracks of `rows` (default: every row); 0 for featureless rows."""
+    norms = (features.norms if rows is None else features.norms[rows]).copy()
+    norms[norms == 0] = 1
+    return feature_matrix.dot(features, centroid, rows) / norms
+
+
+def top_k(rows: np.ndarray, scores: np.ndarray, limit: int, offset: int = 0) -> list:
+    """(row, score) pairs ranked offset..offset+limit by score, best first."""
+    k = min(offset + limit, len(rows))
+    if k <= offset:
+        return []
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return [(int(rows[i]), float(scores[i])) for i in best[offset:k]]
+
+
+def recommend(features: FeatureMatrix, user_rows: list, limit: int, offset: int = 0,
+              index=None, probes: int = None) -> list:
+    """Top unseen tracks for the user, as (row, score) pairs.
+
+    With an ANN `index`, only its candidates are scored exactly; without
+    one, or if it returns too few candidates, the whole catalog is scored.
+    """
+    centroid = user_centroid(features, user_rows)
+    if index is not None:
+        candidates = np.setdiff1d(index.candidates(centroid, probes), user_rows)
+        if len(candidates) >= offset + limit:
+            return top_k(candidates, content_scores(features, centroid, candidates), limit, offset)
+
+    candidates = np.setdiff1d(features.live_rows, user_rows, assume_unique=True)
+    return top_k(candidates, content_scores(features, centroid)[candidates], limit, offset)
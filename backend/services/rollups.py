@@ -0,0 +1,169 @@
+"""Per-user stats rollups.
+
+user_stat_tracks holds, for each user, the tracks the stats cover (liked,
+recently played or top) along with the metadata they were counted with.
+The count tables are kept in step by applying +1/-1 deltas whenever a
+track enters or leaves that set or its metadata changes, so the stats
+routes only read a handful of rows. Each change also bumps the user's
+data_version, which keys the dashboard cache.
+
+Repair drifted rollups from backend/ with:
+
+    python -m services.rollups [--user USER_UUID]
+"""
+import argparse
+from sqlalchemy import text
+from database import engine
+
+# Applies the rows of a `delta` CTE (user_id, artist, release_year,
+# popularity, genre_ids, weight) to the count tables.
+_APPLY_DELTA_SQL = """
+    genre_delta AS (
+        INSERT INTO user_genre_counts AS c (user_id, genre_id, tracks, summary_tracks)
+        SELECT user_id, genre_id, sum(weight),
+               coalesce(sum(weight) FILTER (WHERE popularity IS NOT NULL AND release_year IS NOT NULL), 0)
+        FROM delta, unnest(genre_ids) AS genre_id
+        GROUP BY user_id, genre_id
+        ON CONFLICT (user_id, genre_id) DO UPDATE
+        SET tracks = c.tracks + EXCLUDED.tracks,
+            summary_tracks = c.summary_tracks + EXCLUDED.summary_tracks
+    ),
+    artist_delta AS (
+        INSERT INTO user_artist_counts AS c (user_id, artist, tracks)
+        SELECT user_id, artist, sum(weight)
+        FROM delta
+        WHERE artist IS NOT NULL
+        GROUP BY user_id, artist
+        ON CONFLICT (user_id, artist) DO UPDATE
+        SET tracks = c.tracks + EXCLUDED.tracks
+    ),
+    year_delta AS (
+        INSERT INTO user_year_counts AS c (user_id, release_year, tracks, popularity_sum)
+        SELECT user_id, release_year, sum(weight), sum(weight * popularity)
+        FROM delta
+        WHERE popularity IS NOT NULL AND release_year IS NOT NULL
+        GROUP BY user_id, release_year
+        ON CONFLICT (user_id, release_year) DO UPDATE
+        SET tracks = c.tracks + EXCLUDED.tracks,
+            popularity_sum = c.popularity_sum + EXCLUDED.popularity_sum
+    )
+    SELECT DISTINCT user_id FROM delta
+"""
+
+
+def _apply(conn, delta_sql: str, params: dict) -> int:
+    users = conn.execute(text(f"WITH {delta_sql}, {_APPLY_DELTA_SQL}"), params).scalars().all()
+    if users:
+        for table in ("user_genre_counts", "user_artist_counts", "user_year_counts"):
+            conn.execute(text(f"DELETE FROM {table} WHERE user_id = ANY(:users) AND tracks = 0"),
+                         {"users": users})
+        conn.execute(text("UPDATE users SET data_version = data_version + 1 WHERE id = ANY(:users)"),
+                     {"users": users})
+    return len(users)
+
+
+def add_tracks(conn, user_uuid: str, track_ids: list):
+    """Count tracks that just entered the user's liked, recently played or top tracks."""
+    if not track_ids:
+        return
+    _apply(conn, """
+        delta AS (
+            INSERT INTO user_stat_tracks (user_id, track_id, artist, release_year, popularity, genre_ids)
+            SELECT CAST(:uid AS uuid), id, artist, release_year, popularity, genre_ids
+            FROM tracks
+            WHERE id = ANY(:ids)
+            ON CONFLICT (user_id, track_id) DO NOTHING
+            RETURNING user_id, artist, release_year, popularity, genre_ids, 1 AS weight
+        )
+    """, {"uid": user_uuid, "ids": list(track_ids)})
+
+
+def remove_tracks(conn, user_uuid: str, track_ids: list):
+    """Uncount tracks deleted from one of the user's sources, unless another still has them."""
+    if not track_ids:
+        return
+    _apply(conn, """
+        delta AS (
+            DELETE FROM user_stat_tracks s
+            WHERE s.user_id = :uid AND s.track_id = ANY(:ids)
+              AND NOT EXISTS (SELECT 1 FROM user_liked_tracks x WHERE x.user_id = s.user_id AND x.track_id = s.track_id)
+              AND NOT EXISTS (SELECT 1 FROM user_stream_history x WHERE x.user_id = s.user_id AND x.track_id = s.track_id)
+              AND NOT EXISTS (SELECT 1 FROM user_top_tracks x WHERE x.user_id = s.user_id AND x.track_id = s.track_id)
+            RETURNING s.user_id, s.artist, s.release_year, s.popularity, s.genre_ids, -1 AS weight
+        )
+    """, {"uid": user_uuid, "ids": list(track_ids)})
+
+
+def refresh_tracks(conn, track_ids: list):
+    """Recount tracks whose metadata changed (e.g. after enrichment), for every user that has them."""
+    if not track_ids:
+        return
+    _apply(conn, """
+        changed AS (
+            UPDATE user_stat_tracks s
+            SET artist = t.artist, release_year = t.release_year,
+                popularity = t.popularity, genre_ids = t.genre_ids
+            FROM user_stat_tracks old
+            JOIN tracks t ON t.id = old.track_id
+            WHERE old.track_id = ANY(:ids)
+              AND s.user_id = old.user_id AND s.track_id = old.track_id
+              AND (old.artist, old.release_year, old.popularity, old.genre_ids)
+                  IS DISTINCT FROM (t.artist, t.release_year, t.popularity, t.genre_ids)
+            RETURNING s.user_id,
+                      old.artist AS old_artist, old.release_year AS old_release_year,
+                      old.popularity AS old_popularity, old.genre_ids AS old_genre_ids,
+                      t.artist, t.release_year, t.popularity, t.genre_ids
+        ),
+        delta AS (
+            SELECT user_id, old_artist AS artist, old_release_year AS release_year,
+                   old_popularity AS popularity, old_genre_ids AS genre_ids, -1 AS weight
+            FROM changed
+            UNION ALL
+            SELECT user_id, artist, release_year, popularity, genre_ids, 1 AS weight
+            FROM changed
+        )
+    """, {"ids": list(track_ids)})
+
+
+def rebuild(conn, user_uuid: str):
+    """Recompute one user's rollups from scratch."""
+    for table in ("user_genre_counts", "user_artist_counts", "user_year_counts", "user_stat_tracks"):
+        conn.execute(text(f"DELETE FROM {table} WHERE user_id = :uid"), {"uid": user_uuid})
+    conn.execute(text("UPDATE users SET data_version = data_version + 1 WHERE id = :uid"), {"uid": user_uuid})
+    _apply(conn, """
+        delta AS (
+            INSERT INTO user_stat_tracks (user_id, track_id, artist, release_year, popularity, genre_ids)
+            SELECT CAST(:uid AS uuid), t.id, t.artist, t.release_year, t.popularity, t.genre_ids
+            FROM tracks t
+            JOIN (
+                SELECT track_id FROM user_liked_tracks WHERE user_id = :uid
+                UNION
+                SELECT track_id FROM user_stream_history WHERE user_id = :uid
+                UNION
+                SELECT track_id FROM user_top_tracks WHERE user_id = :uid
+            ) user_tracks
+            ON t.id = user_tracks.track_id
+            RETURNING user_id, artist, release_year, popularity, genre_ids, 1 AS weight
+        )
+    """, {"uid": user_uuid})
+
+
+def rebuild_all(user_uuid: str = None) -> int:
+    """Rebuild every user's rollups (or just `user_uuid`'s), one transaction per user."""
+    if user_uuid:
+        user_ids = [user_uuid]
+    else:
+        with engine.begin() as conn:
+            user_ids = conn.execute(text("SELECT id FROM users ORDER BY id")).scalars().all()
+    for uid in user_ids:
+        with engine.begin() as conn:
+            rebuild(conn, str(uid))
+    return len(user_ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild per-user stats rollups.")
+    parser.add_argument("--user", help="only rebuild this user (users.id)")
+    args = parser.parse_args()
+
+    print(f"Rebuilt stats rollups for {rebuild_all(args.user)} user(s).")
@@ -1,12 +1,10 @@
-import requests
-import json
-
-SPOTIFY_API_BASE = "https://api.spotify.com/v1"
+from services.spotify_client import client, SPOTIFY_API_BASE
+from services import pagination
 
 
 def get_user_profile(access_token: str) -> dict:
     headers = {"Authorization": f"Bearer {access_token}"}
-    resp = requests.get(f"{SPOTIFY_API_BASE}/me", headers=headers)
+    resp = client.get(f"{SPOTIFY_API_BASE}/me", headers=headers)
     resp.raise_for_status()
     return resp.json()
 
@@ -14,52 +12,39 @@ def get_user_profile(access_token: str) -> dict:
 def get_user_top_tracks(access_token: str, limit=20) -> list:
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"limit": limit, "time_range": "medium_term"}
-    resp = requests.get(f"{SPOTIFY_API_BASE}/me/top/tracks", headers=headers, params=params)
+    resp = client.get(f"{SPOTIFY_API_BASE}/me/top/tracks", headers=headers, params=params)
     resp.raise_for_status()
     return resp.json()["items"]
 
 def get_liked_tracks(access_token: str, limit: int = 50) -> list:
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"limit": limit}
-    resp = requests.get(f"{SPOTIFY_API_BASE}/me/tracks", headers=headers, params=params)
+    resp = client.get(f"{SPOTIFY_API_BASE}/me/tracks", headers=headers, params=params)
     resp.raise_for_status()
     return resp.json()["items"]
 
-def get_recently_played(access_token: str, limit=50) -> list:
+def iter_liked_track_pages(access_token: str, max_workers: int = pagination.PAGE_FANOUT):
+    # Saved tracks come back newest first.
+    return pagination.iter_pages(access_token, f"{SPOTIFY_API_BASE}/me/tracks", page_size=50, max_workers=max_workers)
+
+def get_recently_played(access_token: str, limit=50, after: int = None) -> list:
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"limit": limit}
-    resp = requests.get(f"{SPOTIFY_API_BASE}/me/player/recently-played", headers=headers, params=params)
+    if after is not None:
+        params["after"] = after  # unix ms; only plays strictly after it are returned
+    resp = client.get(f"{SPOTIFY_API_BASE}/me/player/recently-played", headers=headers, params=params)
     resp.raise_for_status()
     return resp.json()["items"]
 
 def get_user_playlists(access_token: str) -> list:
-    headers = {"Authorization": f"Bearer {access_token}"}
-    playlists = []
-    url = f"{SPOTIFY_API_BASE}/me/playlists"
-
-    while url:
-        resp = requests.get(url, headers=headers)
-        resp.raise_for_status()
-        data = resp.json()
-        playlists.extend(data["items"])
-        url = data.get("next")  # handle pagination
-
-    return playlists
+    return pagination.fetch_all(access_token, f"{SPOTIFY_API_BASE}/me/playlists", page_size=50)
 
 
 def get_tracks_in_playlist(access_token: str, playlist_id: str) -> list:
-    headers = {"Authorization": f"Bearer {access_token}"}
-    tracks = []
-    url = f"{SPOTIFY_API_BASE}/playlists/{playlist_id}/tracks"
+    return pagination.fetch_all(access_token, f"{SPOTIFY_API_BASE}/playlists/{playlist_id}/tracks", page_size=100)
 
-    while url:
-        resp = requests.get(url, headers=headers)
-        resp.raise_for_status()
-        data = resp.json()
-        tracks.extend(data["items"])
-        url = data.get("next")
-
-    return tracks
+def iter_playlist_track_pages(access_token: str, playlist_id: str):
+    return pagination.iter_pages(access_token, f"{SPOTIFY_API_BASE}/playlists/{playlist_id}/tracks", page_size=100)
 
 def get_tracks_metadata(access_token: str, track_ids: list) -> list:
     headers = {"Authorization": f"Bearer {access_token}"}
@@ -68,48 +53,58 @@ def get_tracks_metadata(access_token: str, track_ids: list) -> list:
     ids_chunks = [track_ids[i:i + 50] for i in range(0, len(track_ids), 50)]
     for chunk in ids_chunks:
         ids_str = ",".join(chunk)
-        resp = requests.get(f"{SPOTIFY_API_BASE}/tracks", headers=headers, params={"ids": ids_str})
+        resp = client.get(f"{SPOTIFY_API_BASE}/tracks", headers=headers, params={"ids": ids_str})
         resp.raise_for_status()
         tracks.extend(resp.json()["tracks"])
 
     return tracks
 
-def get_artist_genres(access_token: str, artist_id: str) -> str:
+def get_audio_features(access_token: str, track_ids: list) -> list:
+    """Audio features for each id, in order; None where Spotify has none."""
     headers = {"Authorization": f"Bearer {access_token}"}
-    resp = requests.get(f"{SPOTIFY_API_BASE}/artists/{artist_id}", headers=headers)
-    if resp.status_code == 404:
-        return json.dumps([])
-    resp.raise_for_status()
-    genres = resp.json().get("genres", [])
-    return json.dumps(genres)
+    features = []
 
-def get_new_releases(access_token: str, limit: int = 50, max_albums: int = 200) -> list:
+    for i in range(0, len(track_ids), 100):
+        chunk = track_ids[i:i + 100]
+        resp = client.get(f"{SPOTIFY_API_BASE}/audio-features", headers=headers, params={"ids": ",".join(chunk)})
+        resp.raise_for_status()
+        features.extend(resp.json()["audio_features"])
+
+    return features
+
+def get_artists(access_token: str, artist_ids: list) -> list:
     headers = {"Authorization": f"Bearer {access_token}"}
-    albums = []
-    url = f"{SPOTIFY_API_BASE}/browse/new-releases?limit={limit}"
+    artists = []
 
-    while url and len(albums) < max_albums:
-        resp = requests.get(url, headers=headers)
+    for i in range(0, len(artist_ids), 50):
+        chunk = artist_ids[i:i + 50]
+        resp = client.get(f"{SPOTIFY_API_BASE}/artists", headers=headers, params={"ids": ",".join(chunk)})
         resp.raise_for_status()
-        data = resp.json()
-        albums.extend(data["albums"]["items"])
-        url = data["albums"].get("next")
+        artists.extend(resp.json()["artists"])
 
-    return albums[:max_albums]
+    return artists
+
+def get_new_releases(access_token: str, limit: int = 50, max_albums: int = 200) -> list:
+    return pagination.fetch_all(
+        access_token, f"{SPOTIFY_API_BASE}/browse/new-releases",
+        page_size=limit, container="albums", max_items=max_albums
+    )
 
 def get_album_tracks(access_token: str, album_id: str) -> list:
+    return pagination.fetch_all(access_token, f"{SPOTIFY_API_BASE}/albums/{album_id}/tracks", page_size=50)
+
+def get_albums(access_token: str, album_ids: list) -> list:
+    """Full album objects, 20 per request, with their first page of tracks embedded; None for unknown ids."""
     headers = {"Authorization": f"Bearer {access_token}"}
-    url = f"{SPOTIFY_API_BASE}/albums/{album_id}/tracks"
+    albums = []
 
-    tracks = []
-    while url:
-        resp = requests.get(url, headers=headers)
+    for i in range(0, len(album_ids), 20):
+        chunk = album_ids[i:i + 20]
+        resp = client.get(f"{SPOTIFY_API_BASE}/albums", headers=headers, params={"ids": ",".join(chunk)})
         resp.raise_for_status()
-        data = resp.json()
-        tracks.extend(data["items"])
-        url = data.get("next")  # handle pagination
+        albums.extend(resp.json()["albums"])
 
-    return tracks
+    return albums
 
 def create_playlist(access_token: str, user_id: str, name: str, public: bool = False) -> dict:
     headers = {
@@ -121,7 +116,7 @@ def create_playlist(access_token: str, user_id: str, name: str, public: bool = F
         "public": public,
         "description": "Generated by your custom recommender"
     }
-    resp = requests.post(f"{SPOTIFY_API_BASE}/users/{user_id}/playlists", headers=headers, json=body)
+    resp = client.post(f"{SPOTIFY_API_BASE}/users/{user_id}/playlists", headers=headers, json=body)
     resp.raise_for_status()
     return resp.json()
 
@@ -135,7 +130,7 @@ def add_tracks_to_playlist(access_token: str, playlist_id: str, track_ids: list[
     track_uris = [f"spotify:track:{track_id}" for track_id in track_ids]
     for i in range(0, len(track_uris), 100):
         chunk = track_uris[i:i + 100]
-        resp = requests.post(
+        resp = client.post(
             f"{SPOTIFY_API_BASE}/playlists/{playlist_id}/tracks",
             headers=headers,
             json={"uris": chunk}
@@ -143,25 +138,4 @@ def add_tracks_to_playlist(access_token: str, playlist_id: str, track_ids: list[
         resp.raise_for_status()
 
 def get_playlist_tracks(access_token, playlist_id):
-    import requests
-    headers = {"Authorization": f"Bearer {access_token}"}
-    url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-
-    tracks = []
-    while url:
-        res = requests.get(url, headers=headers)
-        res.raise_for_status()
-        data = res.json()
-        tracks.extend(data["items"])
-        url = data.get("next")
-
-    return tracks
-
-
-
-
-
-
-
-
-
+    return get_tracks_in_playlist(access_token, playlist_id)
@@ -0,0 +1,113 @@
+import os
+import threading
+import dotenv
+import requests
+from requests.adapters import HTTPAdapter
+from services.rate_limit import scheduler as default_scheduler
+
+dotenv.load_dotenv()
+
+SPOTIFY_API_BASE = "https://api.spotify.com/v1"
+
+POOL_CONNECTIONS = int(os.environ.get("SPOTIFY_HTTP_POOL_CONNECTIONS", 4))
+POOL_MAXSIZE = int(os.environ.get("SPOTIFY_HTTP_POOL_MAXSIZE", 16))
+CONNECT_TIMEOUT = float(os.environ.get("SPOTIFY_HTTP_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.environ.get("SPOTIFY_HTTP_READ_TIMEOUT", 30))
+
+
+class SpotifyClient:
+    """Shared keep-alive HTTP session for every Spotify Web API call.
+
+    One session is kept per process with a bounded connection pool per host
+    (`pool_block=True`, so callers wait for a free connection instead of
+    opening throwaway ones). The session is opened on app startup and closed
+    on shutdown, but is also created lazily so scripts can use the helpers
+    without running the app. Every request is admitted by the rate-limit
+    scheduler, which also retries 429s and server errors.
+    """
+
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 scheduler=default_scheduler):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = (connect_timeout, read_timeout)
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._session = None
+        self._adapter = None
+        self._closed_requests = 0
+        self._closed_connections = 0
+
+    def start(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                adapter = HTTPAdapter(
+                    pool_connections=self.pool_connections,
+                    pool_maxsize=self.pool_maxsize,
+                    pool_block=True,
+                )
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._adapter = adapter
+                self._session = session
+            return self._session
+
+    def close(self):
+        with self._lock:
+            if self._session is None:
+                return
+            requests_made, connections_made = self._pool_counts()
+            self._closed_requests += requests_made
+            self._closed_connections += connections_made
+            self._session.close()
+            self._session = None
+            self._adapter = None
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        session = self._session or self.start()
+        kwargs.setdefault("timeout", self.timeout)
+        # Only GETs are safe to repeat after a 5xx; a 429 was never processed.
+        return self.scheduler.send(
+            lambda: session.request(method, url, **kwargs),
+            retry_server_errors=method == "GET",
+        )
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def _pool_counts(self):
+        # urllib3 tracks requests served and new connections opened per host pool;
+        # every request beyond the connections it had to open reused a live one.
+        if self._adapter is None:
+            return 0, 0
+        pools = self._adapter.poolmanager.pools
+        requests_made = 0
+        connections_made = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_made += pool.num_requests
+            connections_made += pool.num_connections
+        return requests_made, connections_made
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests_made, connections_made = self._pool_counts()
+            requests_made += self._closed_requests
+            connections_made += self._closed_connections
+            return {
+                "open": self._session is not None,
+                "pool_maxsize": self.pool_maxsize,
+                "requests": requests_made,
+                "pool_hits": max(requests_made - connections_made, 0),
+                "pool_misses": connections_made,
+            }
+
+
+client = SpotifyClient()
@@ -11,19 +11,12 @@ const Stats = ({ accessToken }) => {
       if (!accessToken) return;
 
       try {
-        const [genresRes, artistsRes, summaryRes] = await Promise.all([
-          fetch(`http://localhost:8000/stats/top-genres?access_token=${accessToken}`),
-          fetch(`http://localhost:8000/stats/top-artists?access_token=${accessToken}`),
-          fetch(`http://localhost:8000/stats/track-summary?access_token=${accessToken}`)
-        ]);
+        const res = await fetch(`http://localhost:8000/stats/dashboard?access_token=${accessToken}`);
+        const data = await res.json();
 
-        const genresData = await genresRes.json();
-        const artistsData = await artistsRes.json();
-        const summaryData = await summaryRes.json();
-
-        setTopGenres(genresData.top_genres || []);
-        setTopArtists(artistsData.top_artists || []);
-        setTrackSummary(summaryData || {});
+        setTopGenres(data.top_genres || []);
+        setTopArtists(data.top_artists || []);
+        setTrackSummary(data.track_summary || {});
         setLoading(false);
       } catch (err) {
         console.error("Failed to fetch stats:", err);